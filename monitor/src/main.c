@@ -11,7 +11,8 @@
  * The monitor fulfills two purposes:
  *
  *   1. creating the initial state of the system.
- *   2. acting as the fault handler for for protection domains.
+ *   2. acting as the fault handler for for protection domains,
+ *      including mapping the pages of demand maps on first access.
  *
  * Initialisation is performed by executing a number of kernel
  * invocations to create and configure kernel objects.
@@ -70,16 +71,35 @@
 #define MAX_TCBS 64
 
 #define MAX_UNTYPED_REGIONS 256
+#define MAX_DEMAND_MAPS 128
 
 /* Max words available for bootstrap invocations.
  *
  * Only a small number of syscalls is required to
  * get to the point where the main syscalls data
- * is mapped in, so we keep this small.
+ * is mapped in. However, a very large invocation
+ * table needs a retype for every fan out limit's
+ * worth of pages and system leaf CNodes, so allow
+ * for some growth.
  *
  * FIXME: This can be smaller once compression is enabled.
  */
-#define BOOTSTRAP_INVOCATION_DATA_SIZE 110
+#define BOOTSTRAP_INVOCATION_DATA_SIZE 1024
+
+/* Encodings of the system invocation data (set by the tool).
+ *
+ * RAW: an array of words, executed in place.
+ * VARINT: each word is rotated left by one bit (or, for the increments
+ * of a repeated invocation, zigzag encoded) and LEB128 encoded;
+ * invocations are decoded one at a time into invocation_buffer.
+ */
+#define INVOCATION_ENCODING_RAW 0
+#define INVOCATION_ENCODING_VARINT 1
+
+/* Max words in a single invocation: tag, service, 3 extra caps and
+ * 127 message registers, plus the increments if it is repeated.
+ */
+#define MAX_INVOCATION_WORDS (2 + 2 * (1 + 3 + 127))
 
 seL4_IPCBuffer *__sel4_ipc_buffer;
 
@@ -105,13 +125,45 @@ struct untyped_info {
     struct region regions[MAX_UNTYPED_REGIONS];
 };
 
+/* A memory region mapping that is made on the first fault.
+ *
+ * The page objects exist from boot; on a fault in the mapping the
+ * monitor copies the page's cap (page_cap + n) into map_cap + n
+ * and maps that copy into the PD's vspace.
+ */
+struct demand_map {
+    seL4_Word vaddr;
+    seL4_Word page_count;
+    seL4_Word page_size_bits;
+    seL4_Word page_cap;
+    seL4_Word map_cap;
+    seL4_Word vspace_cap;
+    seL4_Word rights;
+    seL4_Word attrs;
+};
+
+/* The maps of the PD with badge b are maps[first[b]] to
+ * maps[first[b + 1] - 1], ordered by vaddr.
+ */
+struct demand_map_info {
+    seL4_Word cnode;
+    seL4_Word cnode_depth;
+    seL4_Word first[MAX_PDS + 1];
+    struct demand_map maps[MAX_DEMAND_MAPS];
+};
+
 seL4_Word bootstrap_invocation_count;
 seL4_Word bootstrap_invocation_data[BOOTSTRAP_INVOCATION_DATA_SIZE];
 
 seL4_Word system_invocation_count;
+seL4_Word system_invocation_encoding;
+/* Where the system invocation data is mapped (set by the tool). */
 seL4_Word *system_invocation_data = (void*)0x80000000;
 
+static seL4_Word invocation_buffer[MAX_INVOCATION_WORDS];
+
 struct untyped_info untyped_info;
+struct demand_map_info demand_map_info;
 
 static char *
 ec_to_string(uintptr_t ec)
@@ -364,6 +416,110 @@ perform_invocation(seL4_Word *invocation_data, unsigned offset, unsigned idx)
     return next_offset;
 }
 
+static seL4_Word
+decode_varint(const uint8_t **cursor)
+{
+    seL4_Word v = 0;
+    unsigned shift = 0;
+    uint8_t b;
+
+    do {
+        b = *(*cursor)++;
+        v |= (seL4_Word)(b & 0x7f) << shift;
+        shift += 7;
+    } while (b & 0x80);
+
+    return v;
+}
+
+static seL4_Word
+decode_word(const uint8_t **cursor)
+{
+    seL4_Word v = decode_varint(cursor);
+    return (v >> 1) | (v << 63);
+}
+
+static seL4_Word
+decode_increment(const uint8_t **cursor)
+{
+    seL4_Word v = decode_varint(cursor);
+    return (v >> 1) ^ -(v & 1);
+}
+
+static const uint8_t *
+decode_invocation(const uint8_t *cursor, seL4_Word *buffer)
+{
+    seL4_MessageInfo_t tag;
+    seL4_Word cmd = decode_word(&cursor);
+    unsigned count;
+
+    tag.words[0] = cmd & 0xffffffffULL;
+    count = 1 + seL4_MessageInfo_get_extraCaps(tag) + seL4_MessageInfo_get_length(tag);
+
+    buffer[0] = cmd;
+    for (unsigned i = 0; i < count; i++) {
+        buffer[1 + i] = decode_word(&cursor);
+    }
+    if ((cmd >> 32) != 0) {
+        /* Repeated invocations have an increment for each word */
+        for (unsigned i = 0; i < count; i++) {
+            buffer[1 + count + i] = decode_increment(&cursor);
+        }
+    }
+
+    return cursor;
+}
+
+/* Map the page containing fault_addr if it is in one of the PD's
+ * demand maps. Returns false if the fault is not resolved by a
+ * demand map; in particular a fault on a page that is already
+ * mapped fails the mint, as the copy of the cap exists.
+ */
+static bool
+resolve_demand_fault(seL4_Word badge, seL4_Word fault_addr)
+{
+    seL4_Error err;
+
+    for (seL4_Word i = demand_map_info.first[badge]; i < demand_map_info.first[badge + 1]; i++) {
+        struct demand_map *map = &demand_map_info.maps[i];
+        if (fault_addr < map->vaddr || fault_addr - map->vaddr >= map->page_count << map->page_size_bits) {
+            continue;
+        }
+
+        seL4_Word page = (fault_addr - map->vaddr) >> map->page_size_bits;
+        seL4_CapRights_t rights = {{ map->rights }};
+        err = seL4_CNode_Mint(
+            demand_map_info.cnode,
+            map->map_cap + page,
+            demand_map_info.cnode_depth,
+            demand_map_info.cnode,
+            map->page_cap + page,
+            demand_map_info.cnode_depth,
+            rights,
+            0
+        );
+        if (err != seL4_NoError) {
+            return false;
+        }
+
+        err = seL4_ARM_Page_Map(
+            map->map_cap + page,
+            map->vspace_cap,
+            map->vaddr + (page << map->page_size_bits),
+            rights,
+            map->attrs
+        );
+        if (err != seL4_NoError) {
+            puts("MON|ERROR: unable to map demand page\n");
+            return false;
+        }
+
+        return true;
+    }
+
+    return false;
+}
+
 static void
 monitor(void)
 {
@@ -375,6 +531,13 @@ monitor(void)
         tag = seL4_Recv(fault_ep, &badge, reply);
         label = seL4_MessageInfo_get_label(tag);
 
+        if (label == seL4_Fault_VMFault && badge < MAX_PDS &&
+            resolve_demand_fault(badge, seL4_GetMR(seL4_VMFault_Addr))) {
+            /* Resume the PD; it retries the access. */
+            seL4_Send(reply, seL4_MessageInfo_new(0, 0, 0, 0));
+            continue;
+        }
+
         seL4_Word tcb_cap = tcbs[badge];
 
         puts("received message ");
@@ -592,9 +755,17 @@ main(seL4_BootInfo *bi)
     }
     puts("MON|INFO: completed bootstrap invocations\n");
 
-    offset = 0;
-    for (unsigned idx = 0; idx < system_invocation_count; idx++) {
-        offset = perform_invocation(system_invocation_data, offset, idx);
+    if (system_invocation_encoding == INVOCATION_ENCODING_VARINT) {
+        const uint8_t *cursor = (const uint8_t *)system_invocation_data;
+        for (unsigned idx = 0; idx < system_invocation_count; idx++) {
+            cursor = decode_invocation(cursor, invocation_buffer);
+            perform_invocation(invocation_buffer, 0, idx);
+        }
+    } else {
+        offset = 0;
+        for (unsigned idx = 0; idx < system_invocation_count; idx++) {
+            offset = perform_invocation(system_invocation_data, offset, idx);
+        }
     }
 
     puts("MON|INFO: completed system invocations\n");
@@ -38,6 +38,7 @@ The following abreviations are used in the source code:
 """
 import sys
 from argparse import ArgumentParser
+from bisect import bisect_left, bisect_right
 from pathlib import Path
 from dataclasses import dataclass
 from struct import pack, Struct
@@ -45,13 +46,14 @@ from os import environ
 from math import log2, ceil
 from sys import argv, executable, stderr
 
-from typing import Dict, List, Optional, Tuple, Union
+from typing import AbstractSet, Dict, List, Optional, Set, Tuple, Union
 
 from sel4coreplat.elf import ElfFile
-from sel4coreplat.util import kb, mb, lsb, msb, round_up, round_down, mask_bits, is_power_of_two, MemoryRegion, UserError
+from sel4coreplat.util import kb, mb, lsb, msb, round_up, round_down, is_power_of_two, aligned_blocks, arithmetic_runs, AllocationPolicy, DisjointMemoryRegion, Fragmentation, MemoryRegion, UserError
 from sel4coreplat.sel4 import (
     Sel4Aarch64Regs,
     Sel4Invocation,
+    Sel4InvocationTable,
     Sel4AsidPoolAssign,
     Sel4PageUpperDirectoryMap,
     Sel4PageDirectoryMap,
@@ -69,6 +71,7 @@ from sel4coreplat.sel4 import (
     Sel4IrqControlGet,
     Sel4IrqHandlerSetNotification,
     Sel4SchedControlConfigureFlags,
+    allocate_rootserver_objects,
     emulate_kernel_boot,
     emulate_kernel_boot_partial,
     UntypedObject,
@@ -87,6 +90,7 @@ from sel4coreplat.sel4 import (
     SEL4_PAGE_DIRECTORY_OBJECT,
     SEL4_SMALL_PAGE_OBJECT,
     SEL4_LARGE_PAGE_OBJECT,
+    SEL4_HUGE_PAGE_OBJECT,
     SEL4_PAGE_TABLE_OBJECT,
     SLOT_BITS,
     SLOT_SIZE,
@@ -104,12 +108,17 @@ from sel4coreplat.sel4 import (
     SEL4_ARM_PARITY_ENABLED,
     SEL4_ARM_PAGE_CACHEABLE,
     SEL4_LARGE_PAGE_SIZE,
-    SEL4_PAGE_TABLE_SIZE,
+    SEL4_HUGE_PAGE_SIZE,
+    SEL4_SMALL_PAGE_SIZE,
     SEL4_OBJECT_TYPE_NAMES,
+    INVOCATION_ENCODING_RAW,
+    INVOCATION_ENCODING_VARINT,
 )
 from sel4coreplat.sysxml import ProtectionDomain, xml2system, SystemDescription, PlatformDescription
 from sel4coreplat.sysxml import SysMap, SysMemoryRegion # This shouldn't be needed here as such
 from sel4coreplat.loader import Loader
+from sel4coreplat.replay import MonitorReplay, ReplayError, ReplayResult
+from sel4coreplat.bootcost import BOARD_CALIBRATION, PHASES, board_calibration, estimate_boot_cost
 
 # This is a workaround for: https://github.com/indygreg/PyOxidizer/issues/307
 # Basically, pyoxidizer generates code that results in argv[0] being set to None.
@@ -120,7 +129,7 @@ if argv[0] is None:
 
 
 default_platform_description = PlatformDescription(
-    page_sizes = (0x1_000, 0x200_000)
+    page_sizes = (SEL4_SMALL_PAGE_SIZE, SEL4_LARGE_PAGE_SIZE, SEL4_HUGE_PAGE_SIZE)
 )
 
 @dataclass
@@ -131,10 +140,19 @@ class MonitorConfig:
     bootstrap_invocation_count_symbol_name: str
     bootstrap_invocation_data_symbol_name: str
     system_invocation_count_symbol_name: str
+    system_invocation_encoding_symbol_name: str
+    system_invocation_data_symbol_name: str
+    demand_map_info_symbol_name: str
+    demand_map_header_struct: Struct
+    demand_map_object_struct: Struct
+    max_pds: int
 
     def max_untyped_objects(self, symbol_size: int) -> int:
         return (symbol_size - self.untyped_info_header_struct.size) // self.untyped_info_object_struct.size
 
+    def max_demand_maps(self, symbol_size: int) -> int:
+        return (symbol_size - self.demand_map_header_struct.size) // self.demand_map_object_struct.size
+
 # The monitor config is fixed (unless the monitor C code
 # changes the definitions of struct, or the name.
 # While this is fixed, we dynamically determine the
@@ -148,6 +166,12 @@ MONITOR_CONFIG = MonitorConfig(
     bootstrap_invocation_count_symbol_name = "bootstrap_invocation_count",
     bootstrap_invocation_data_symbol_name = "bootstrap_invocation_data",
     system_invocation_count_symbol_name = "system_invocation_count",
+    system_invocation_encoding_symbol_name = "system_invocation_encoding",
+    system_invocation_data_symbol_name = "system_invocation_data",
+    demand_map_info_symbol_name = "demand_map_info",
+    demand_map_header_struct = Struct("<QQ65Q"),
+    demand_map_object_struct = Struct("<QQQQQQQQ"),
+    max_pds = 64,
 )
 
 # Will be either the notification or endpoint cap
@@ -159,17 +183,202 @@ MONITOR_EP_CAP_IDX = 5
 BASE_OUTPUT_NOTIFICATION_CAP = 10
 BASE_OUTPUT_ENDPOINT_CAP = BASE_OUTPUT_NOTIFICATION_CAP + 64
 BASE_IRQ_CAP = BASE_OUTPUT_ENDPOINT_CAP + 64
-MAX_SYSTEM_INVOCATION_SIZE = mb(128)
-PD_CAPTABLE_BITS = 12
+# The monitor maps the system invocation data at INVOCATION_WINDOW_VADDR,
+# below its image, when it fits. Otherwise the data is mapped at
+# INVOCATION_WINDOW_HIGH_VADDR (clear of the IPC buffer and boot info
+# frames the kernel maps after the image). The monitor indexes the
+# invocation data with a 32-bit word offset.
+INVOCATION_WINDOW_VADDR = 0x8000_0000
+INVOCATION_WINDOW_HIGH_VADDR = 0x1_0000_0000
+MAX_SYSTEM_INVOCATION_SIZE = mb(16 * 1024)
+# Largest CNode needed by a PD: an IRQ cap for channel 62 is in slot 200.
 PD_CAP_SIZE = 256
-PD_CAP_BITS = int(log2(PD_CAP_SIZE))
 PD_SCHEDCONTEXT_SIZE = (1 << 8)
 
 
+def pd_needs_reply(pd: ProtectionDomain) -> bool:
+    """Return True if the PD needs a reply object: only a PD receiving on
+    an endpoint (i.e. one providing a protected procedure) can be called."""
+    return pd.pp or pd.passive
+
+
+def pd_cnode_size(pd: ProtectionDomain, system: SystemDescription) -> int:
+    """Return the number of slots in the smallest CNode that holds all the
+    caps minted into the PD's CSpace."""
+    cap_idxs = [INPUT_CAP_IDX, VSPACE_CAP_IDX]
+    if pd_needs_reply(pd):
+        cap_idxs.append(REPLY_CAP_IDX)
+    if pd.passive:
+        cap_idxs.append(MONITOR_EP_CAP_IDX)
+    cap_idxs += [BASE_IRQ_CAP + sysirq.id_ for sysirq in pd.irqs]
+    for cc in system.channels:
+        for pd_name, id_, other_pd_name in ((cc.pd_a, cc.id_a, cc.pd_b), (cc.pd_b, cc.id_b, cc.pd_a)):
+            if pd_name != pd.name:
+                continue
+            cap_idxs.append(BASE_OUTPUT_NOTIFICATION_CAP + id_)
+            if system.pd_by_name[other_pd_name].pp:
+                cap_idxs.append(BASE_OUTPUT_ENDPOINT_CAP + id_)
+
+    size = 2
+    while size <= max(cap_idxs):
+        size *= 2
+    assert size <= PD_CAP_SIZE
+    return size
+
+
+# The system CSpace is made up of leaf CNodes with (at most)
+# 2^SYSTEM_CNODE_LEAF_BITS slots each.
+SYSTEM_CNODE_LEAF_BITS = 10
+
+
+def system_cnode_slots(cap_count: int) -> int:
+    """Return the number of system CSpace slots to provide for 'cap_count'
+    caps: a power of two if they fit in a single leaf CNode, otherwise
+    a whole number of leaf CNodes."""
+    leaf_size = 1 << SYSTEM_CNODE_LEAF_BITS
+    if cap_count <= leaf_size:
+        return max(2, 1 << (cap_count - 1).bit_length())
+    return round_up(cap_count, leaf_size)
+
+
+@dataclass(frozen=True)
+class SystemCSpace:
+    """The layout of the system CSpace.
+
+    Slot 1 of the root CNode holds the top CNode (2^top_bits slots), the
+    first 'leaf_count' slots of which hold the leaf CNodes (2^leaf_bits
+    slots each). System cap slot 's' is slot s % 2^leaf_bits of leaf
+    s // 2^leaf_bits, and has the cap address 'cap_address_mask | s'.
+    """
+    cap_address_bits: int
+    top_bits: int
+    leaf_bits: int
+    leaf_count: int
+
+    @classmethod
+    def for_slots(cls, cap_address_bits: int, slots: int) -> "SystemCSpace":
+        assert slots == system_cnode_slots(slots)
+        leaf_bits = min(SYSTEM_CNODE_LEAF_BITS, int(log2(slots)))
+        leaf_count = slots >> leaf_bits
+        top_bits = max(1, (leaf_count - 1).bit_length())
+        return cls(cap_address_bits, top_bits, leaf_bits, leaf_count)
+
+    @property
+    def slots(self) -> int:
+        return self.leaf_count << self.leaf_bits
+
+    @property
+    def cap_address_mask(self) -> int:
+        return 1 << (self.cap_address_bits - 1)
+
+    @property
+    def top_guard(self) -> int:
+        """Guard size of the top CNode; the root CNode resolves one bit."""
+        return self.cap_address_bits - 1 - self.top_bits - self.leaf_bits
+
+    def retype_destinations(self, cap_slot: int, count: int, fan_out_limit: int) -> List[Tuple[int, int, int, int]]:
+        """Split a retype of 'count' objects into the slots from 'cap_slot'
+        into (node_index, node_depth, node_offset, num_objects) for each
+        retype: the slots of one retype must be in a single leaf CNode,
+        and there can be at most 'fan_out_limit' of them."""
+        leaf_size = 1 << self.leaf_bits
+        destinations = []
+        while count > 0:
+            num_objects = min(count, fan_out_limit, leaf_size - cap_slot % leaf_size)
+            destinations.append((
+                (self.cap_address_mask | cap_slot) >> self.leaf_bits,
+                self.cap_address_bits - self.leaf_bits,
+                cap_slot % leaf_size,
+                num_objects,
+            ))
+            cap_slot += num_objects
+            count -= num_objects
+        return destinations
+
+
 def mr_page_bytes(mr: SysMemoryRegion) -> int:
     return 0x1000 if mr.page_size is None else mr.page_size
 
 
+def spans_large_page(base: int, end: int) -> bool:
+    """Return True if [base, end) contains a whole, aligned, large page."""
+    return round_up(base, SEL4_LARGE_PAGE_SIZE) + SEL4_LARGE_PAGE_SIZE <= end
+
+
+def promote_large_pages(
+        memory_regions: Tuple[SysMemoryRegion, ...],
+        pd_maps: Dict[ProtectionDomain, Tuple[SysMap, ...]],
+        contiguous_mrs: AbstractSet[str] = frozenset(),
+    ) -> Tuple[Tuple[SysMemoryRegion, ...], Dict[ProtectionDomain, Tuple[SysMap, ...]]]:
+    """Use large pages for memory regions wherever size and alignment allow.
+
+    Only memory regions without an explicit page size are promoted. A
+    memory region can only use large pages if each of its mappings (and
+    its physical address, if fixed) has the same offset from a large page
+    boundary.
+
+    The parts of a promoted memory region are allocated separately, so
+    they are only physically contiguous if the memory region has a fixed
+    physical address. Memory regions in 'contiguous_mrs' (e.g. those
+    whose physical address is given to a PD with a setvar) are not
+    promoted unless their physical address is fixed.
+
+    A promoted memory region is split into up to three parts: small pages
+    up to the first large page boundary, large pages, and small pages
+    for the remainder. The first part keeps the name of the memory
+    region, and each mapping is split in the same way.
+    """
+    offsets: Dict[str, Set[int]] = {}
+    for maps in pd_maps.values():
+        for mp in maps:
+            offsets.setdefault(mp.mr, set()).add(mp.vaddr % SEL4_LARGE_PAGE_SIZE)
+
+    promoted_mrs: List[SysMemoryRegion] = []
+    # (offset, part) for each split memory region
+    parts_by_name: Dict[str, List[Tuple[int, SysMemoryRegion]]] = {}
+    for mr in memory_regions:
+        mr_offsets = offsets.get(mr.name, set())
+        if mr.phys_addr is not None:
+            mr_offsets = mr_offsets | {mr.phys_addr % SEL4_LARGE_PAGE_SIZE}
+        if mr.page_size_explicit or mr.page_size != SEL4_SMALL_PAGE_SIZE or len(mr_offsets) > 1 or (mr.phys_addr is None and mr.name in contiguous_mrs):
+            promoted_mrs.append(mr)
+            continue
+
+        offset = min(mr_offsets, default=0)
+        head = (SEL4_LARGE_PAGE_SIZE - offset) % SEL4_LARGE_PAGE_SIZE
+        body = round_down(mr.size - head, SEL4_LARGE_PAGE_SIZE) if mr.size > head else 0
+        if body == 0:
+            promoted_mrs.append(mr)
+            continue
+
+        parts: List[Tuple[int, SysMemoryRegion]] = []
+        for part_offset, part_size, page_size in (
+                (0, head, SEL4_SMALL_PAGE_SIZE),
+                (head, body, SEL4_LARGE_PAGE_SIZE),
+                (head + body, mr.size - head - body, SEL4_SMALL_PAGE_SIZE),
+            ):
+            if part_size == 0:
+                continue
+            name = mr.name if len(parts) == 0 else f"{mr.name} (+0x{part_offset:x})"
+            phys_addr = None if mr.phys_addr is None else mr.phys_addr + part_offset
+            parts.append((part_offset, SysMemoryRegion(name, part_size, page_size, part_size // page_size, phys_addr)))
+        parts_by_name[mr.name] = parts
+        promoted_mrs += [part for _, part in parts]
+
+    promoted_maps: Dict[ProtectionDomain, Tuple[SysMap, ...]] = {}
+    for pd, maps in pd_maps.items():
+        promoted_pd_maps: List[SysMap] = []
+        for mp in maps:
+            if mp.mr not in parts_by_name:
+                promoted_pd_maps.append(mp)
+                continue
+            for part_offset, part in parts_by_name[mp.mr]:
+                promoted_pd_maps.append(SysMap(part.name, mp.vaddr + part_offset, mp.perms, mp.cached, mp.element, mp.demand))
+        promoted_maps[pd] = tuple(promoted_pd_maps)
+
+    return tuple(promoted_mrs), promoted_maps
+
+
 @dataclass(frozen=True)
 class KernelAllocation:
     untyped_cap_address: int  # Fixme: possibly this is an object, not an int?
@@ -182,6 +391,7 @@ class UntypedAllocator:
     untyped_object: UntypedObject
     allocation_point: int
     allocations: List[KernelAllocation]
+    alignment_waste: int = 0
 
     @property
     def base(self) -> int:
@@ -191,6 +401,10 @@ class UntypedAllocator:
     def end(self) -> int:
         return self.untyped_object.region.end
 
+    @property
+    def free(self) -> int:
+        return self.end - (self.base + self.allocation_point)
+
 class KernelObjectAllocator:
     """Allocator for kernel objects.
 
@@ -202,8 +416,20 @@ class KernelObjectAllocator:
     policy (basically a bump allocator with alignment).
 
     The only 'choice' this allocator has is which untyped object
-    to use. The current algorithm is simply first fit: the first
-    untyped that has sufficient space. This is not optimal.
+    to use. This is determined by the policy:
+
+    FIRST_FIT: the first untyped that has sufficient space.
+    BEST_FIT: the untyped that wastes the least space aligning the
+        allocation (ties are broken as per first fit).
+
+    The untyped objects are indexed by a max tree of their free space,
+    so a lookup skips runs of untyped objects without enough space in
+    O(log n). An untyped with enough space may still not fit the
+    allocation once it is aligned; the search then continues after it.
+
+    'snapshot' and 'rollback' allow allocations to be undone (e.g. to try
+    an alternative). Taking a snapshot is O(1); rolling back undoes each
+    allocation made since the snapshot.
 
     Note: The allocator does not generate the Retype invocations;
     this must be done with more knowledge (specifically the destination
@@ -213,29 +439,151 @@ class KernelObjectAllocator:
     as the allocations are made.
 
     """
-    def __init__(self, kernel_boot_info: KernelBootInfo) -> None:
+    def __init__(self, kernel_boot_info: KernelBootInfo, policy: AllocationPolicy = AllocationPolicy.FIRST_FIT) -> None:
+        if policy not in (AllocationPolicy.FIRST_FIT, AllocationPolicy.BEST_FIT):
+            raise Exception(f"Unsupported kernel object allocation policy: {policy}")
+        self._policy = policy
         self._allocation_idx = 0
-        self._untyped = []
+        self._untyped: List[UntypedAllocator] = []
+        # (index, allocation_point, alignment_waste) of the untyped before
+        # each allocation
+        self._undo: List[Tuple[int, int, int]] = []
         for ut in kernel_boot_info.untyped_objects:
             if ut.is_device:
                 # Kernel allocator can only allocate out of normal memory
                 # device memory can't be used for kernel objects
                 continue
             self._untyped.append(UntypedAllocator(ut, 0, []))
+        # Max tree of the free space of each untyped: node i covers
+        # nodes 2i and 2i + 1, and the leaves start at self._leaves
+        self._leaves = 1 << max(len(self._untyped) - 1, 0).bit_length()
+        self._free_tree = [0] * self._leaves + [ut.free for ut in self._untyped]
+        self._free_tree += [0] * (2 * self._leaves - len(self._free_tree))
+        for node in range(self._leaves - 1, 0, -1):
+            self._free_tree[node] = max(self._free_tree[2 * node], self._free_tree[2 * node + 1])
+
+    @property
+    def untyped(self) -> List[UntypedAllocator]:
+        return self._untyped
+
+    def snapshot(self) -> int:
+        """Return a snapshot of the current state for use with 'rollback'."""
+        return len(self._undo)
+
+    def rollback(self, snapshot: int) -> None:
+        """Undo the allocations made since 'snapshot' was taken.
+
+        Snapshots taken after 'snapshot' are no longer valid."""
+        assert snapshot <= len(self._undo)
+        while len(self._undo) > snapshot:
+            idx, allocation_point, alignment_waste = self._undo.pop()
+            ut = self._untyped[idx]
+            ut.allocation_point = allocation_point
+            ut.alignment_waste = alignment_waste
+            self._update(idx)
+            ut.allocations.pop()
+            self._allocation_idx -= 1
+
+    def _update(self, idx: int) -> None:
+        tree = self._free_tree
+        node = self._leaves + idx
+        tree[node] = self._untyped[idx].free
+        while node > 1:
+            node //= 2
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+
+    def _first_with_free(self, start: int, required: int) -> Optional[int]:
+        """Return the index of the first untyped at or after 'start' with
+        at least 'required' bytes free, or None if there is none."""
+        tree = self._free_tree
+
+        def search(node: int, node_start: int, node_end: int) -> Optional[int]:
+            if node_end <= start or tree[node] < required:
+                return None
+            if node >= self._leaves:
+                return node_start
+            mid = (node_start + node_end) // 2
+            found = search(2 * node, node_start, mid)
+            return found if found is not None else search(2 * node + 1, mid, node_end)
+
+        return search(1, 0, self._leaves)
 
     def alloc(self, size: int, count: int = 1) -> KernelAllocation:
         assert is_power_of_two(size)
-        for ut in self._untyped:
-            # See if this fits
+        best = self._find(size, count)
+        if best is None:
+            raise Exception("Can't alloc - nos pace")
+
+        waste, idx, start = best
+        return self._commit(idx, start, count * size, waste)
+
+    def _find(self, size: int, count: int) -> Optional[Tuple[int, int, int]]:
+        """Find the untyped to allocate from (as per the policy).
+
+        Returns (waste, index, start), or None if no untyped has space."""
+        required = count * size
+        # (waste, index, start) of the chosen untyped
+        best: Optional[Tuple[int, int, int]] = None
+        idx = self._first_with_free(0, required)
+        while idx is not None:
+            ut = self._untyped[idx]
+            # See if this fits once aligned
             start = round_up(ut.base + ut.allocation_point, size)
-            if start + (count * size) <= ut.end:
-                ut.allocation_point = (start - ut.base) + (count * size)
-                self._allocation_idx += 1
-                allocation = KernelAllocation(ut.untyped_object.cap, start, self._allocation_idx)
-                ut.allocations.append(allocation)
-                return allocation
-
-        raise Exception("Can't alloc - nos pace")
+            if start + required <= ut.end:
+                candidate = (start - (ut.base + ut.allocation_point), idx, start)
+                if best is None or candidate < best:
+                    best = candidate
+                # Untyped are visited in index order, so no later untyped
+                # can improve on this for first fit, or on no waste.
+                if self._policy == AllocationPolicy.FIRST_FIT or candidate[0] == 0:
+                    break
+            idx = self._first_with_free(idx + 1, required)
+
+        return best
+
+    def _commit(self, idx: int, start: int, required: int, waste: int) -> KernelAllocation:
+        ut = self._untyped[idx]
+        self._undo.append((idx, ut.allocation_point, ut.alignment_waste))
+        ut.allocation_point = (start - ut.base) + required
+        ut.alignment_waste += waste
+        self._update(idx)
+        self._allocation_idx += 1
+        allocation = KernelAllocation(ut.untyped_object.cap, start, self._allocation_idx)
+        ut.allocations.append(allocation)
+        return allocation
+
+    def alloc_batch(self, size: int, count: int) -> List[Tuple[KernelAllocation, int]]:
+        """Allocate 'count' objects of 'size' bytes, possibly from multiple untyped.
+
+        Returns a list of (allocation, number of objects). If the objects fit
+        in a single untyped this is the same as 'alloc'. Otherwise the objects
+        are split across untyped objects, using the untyped with space for the
+        most objects first.
+        """
+        assert is_power_of_two(size)
+        best = self._find(size, count)
+        if best is not None:
+            waste, idx, start = best
+            return [(self._commit(idx, start, count * size, waste), count)]
+
+        # (capacity, -index, start, waste) for each untyped with space for at least one object
+        candidates = []
+        for idx, ut in enumerate(self._untyped):
+            start = round_up(ut.base + ut.allocation_point, size)
+            capacity = (ut.end - start) // size if start < ut.end else 0
+            if capacity > 0:
+                candidates.append((capacity, -idx, start, start - (ut.base + ut.allocation_point)))
+        if sum(candidate[0] for candidate in candidates) < count:
+            raise Exception("Can't alloc - nos pace")
+
+        allocations = []
+        for capacity, neg_idx, start, waste in sorted(candidates, reverse=True):
+            chunk = min(capacity, count)
+            allocations.append((self._commit(-neg_idx, start, chunk * size, waste), chunk))
+            count -= chunk
+            if count == 0:
+                break
+        return allocations
 
 
 def invocation_to_str(inv: Sel4Invocation, cap_lookup: Dict[int, str]) -> str:
@@ -342,10 +690,216 @@ def virt_mem_region_from_elf(elf: ElfFile, alignment: int) -> MemoryRegion:
     return virt_mem_regions_from_elf(elf, alignment)[0]
 
 
-class PageOverlap(Exception):
+# Encoded size (in words) of a paging structure map invocation: the
+# command word, then the service, vspace cap and two message registers.
+# A repeated invocation adds an increment for each of the four words.
+TABLE_MAP_WORDS = 5
+TABLE_MAP_REPEAT_WORDS = TABLE_MAP_WORDS + 4
+
+
+def table_map_runs(descriptors: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """Group the (pd_idx, vaddr) descriptors of paging structure objects,
+    which are allocated in descriptor order, into map invocations.
+
+    Returns (first descriptor, count, descriptor step) for each
+    invocation; descriptor first + i * step is mapped by iteration i.
+
+    Within a PD the runs of vaddrs with a constant stride are grouped.
+    Consecutive PDs with the same layout are instead grouped by vaddr,
+    across the PDs, when that produces fewer words.
+    """
+    # (pd_idx, first descriptor, vaddrs) for each PD
+    pd_layouts: List[Tuple[int, int, List[int]]] = []
+    for idx, (pd_idx, vaddr) in enumerate(descriptors):
+        if len(pd_layouts) == 0 or pd_layouts[-1][0] != pd_idx:
+            pd_layouts.append((pd_idx, idx, []))
+        pd_layouts[-1][2].append(vaddr)
+
+    runs: List[Tuple[int, int, int]] = []
+    layout_idx = 0
+    while layout_idx < len(pd_layouts):
+        pd_idx, first, vaddrs = pd_layouts[layout_idx]
+        end_idx = layout_idx + 1
+        while (end_idx < len(pd_layouts) and
+               pd_layouts[end_idx][0] == pd_idx + end_idx - layout_idx and
+               pd_layouts[end_idx][2] == vaddrs):
+            end_idx += 1
+        pd_count = end_idx - layout_idx
+
+        pd_runs = arithmetic_runs(vaddrs, TABLE_MAP_WORDS, TABLE_MAP_REPEAT_WORDS)
+        pd_words = sum(TABLE_MAP_WORDS if length == 1 else TABLE_MAP_REPEAT_WORDS for _, length in pd_runs)
+        if pd_count > 1 and len(vaddrs) * TABLE_MAP_REPEAT_WORDS < pd_count * pd_words:
+            runs += [(first + idx, pd_count, len(vaddrs)) for idx in range(len(vaddrs))]
+        else:
+            for _, pd_first, _ in pd_layouts[layout_idx:end_idx]:
+                runs += [(pd_first + start, length, 1) for start, length in pd_runs]
+        layout_idx = end_idx
+
+    return runs
+
+
+class PageOverlap(UserError):
     pass
 
 
+@dataclass(frozen=True)
+class VSpaceMapping:
+    """A range of a protection domain's virtual address space mapped with
+    pages of 'page_size' bytes. 'map' is None for the IPC buffer."""
+    base: int
+    size: int
+    page_size: int
+    map: Optional[SysMap]
+
+    @property
+    def end(self) -> int:
+        return self.base + self.size
+
+    def __str__(self) -> str:
+        if self.map is None:
+            return f"IPC buffer at 0x{self.base:x}"
+        if self.map.element is None:
+            return f"ELF segment '{self.map.mr}' at 0x{self.base:x}"
+        return f"map of '{self.map.mr}' at 0x{self.base:x} @ {self.map.element._loc_str}"  # type: ignore
+
+
+def vspace_index(
+        pd_name: str,
+        ipc_buffer_vaddr: int,
+        maps: Tuple[SysMap, ...],
+        mr_by_name: Dict[str, SysMemoryRegion],
+    ) -> List[VSpaceMapping]:
+    """Return the mappings in a protection domain's virtual address space
+    (the IPC buffer and 'maps') sorted by virtual address.
+
+    Raises PageOverlap if any two mappings overlap.
+    """
+    index = [VSpaceMapping(ipc_buffer_vaddr, 0x1000, 0x1000, None)]
+    for mp in maps:
+        mr = mr_by_name[mp.mr]
+        index.append(VSpaceMapping(mp.vaddr, mr.page_count * mr_page_bytes(mr), mr_page_bytes(mr), mp))
+    index.sort(key=lambda mapping: mapping.base)
+
+    # Once sorted, only neighbours need to be checked: if the mappings
+    # before 'mapping' are disjoint, 'prev' is the one that ends last.
+    for prev, mapping in zip(index, index[1:]):
+        if overlaps((prev.base, prev.size), (mapping.base, mapping.size)):
+            raise PageOverlap(f"Error: {mapping} overlaps {prev} in protection domain '{pd_name}'")
+
+    return index
+
+
+PADDING_GREEDY = "greedy"
+PADDING_FIXED = "fixed"
+PADDING_HYBRID = "hybrid"
+
+
+def paging_structure_vaddrs(index: List[VSpaceMapping]) -> Tuple[List[int], List[int], List[int]]:
+    """Return the base addresses of the page upper directories, page
+    directories and page tables needed for the mappings in 'index'.
+
+    Every mapping needs a page upper directory. Mappings with huge pages
+    are made in the page upper directory, so only the other mappings
+    need page directories, and only mappings with small pages need page
+    tables.
+    """
+    vaddr_ranges = [(mapping.base, mapping.end) for mapping in index]
+    directory_vaddr_ranges = [(mapping.base, mapping.end) for mapping in index if mapping.page_size != SEL4_HUGE_PAGE_SIZE]
+    small_page_vaddr_ranges = [(mapping.base, mapping.end) for mapping in index if mapping.page_size == SEL4_SMALL_PAGE_SIZE]
+    return (
+        aligned_blocks(vaddr_ranges, 12 + 9 + 9 + 9),
+        aligned_blocks(directory_vaddr_ranges, 12 + 9 + 9),
+        aligned_blocks(small_page_vaddr_ranges, 12 + 9),
+    )
+
+
+def paging_structure_names(kind: str, system: SystemDescription, structures: List[Tuple[int, int]]) -> List[str]:
+    """Return the names of paging structures given as (pd index, vaddr) pairs."""
+    pd_names = [pd.name for pd in system.protection_domains]
+    return [f"{kind}: PD={pd_names[pd_idx]} VADDR=0x{vaddr:x}" for pd_idx, vaddr in structures]
+
+
+@dataclass(frozen=True)
+class PaddingPlan:
+    """The untyped objects used to pad a device untyped from 'base' to 'base + size'.
+
+    groups is a list of (size_bits, count) retypes in address order. A
+    group may contain more objects than the fan out limit; it is split
+    into multiple retypes when emitted.
+    """
+    strategy: str
+    base: int
+    size: int
+    groups: Tuple[Tuple[int, int], ...]
+    fan_out_limit: int
+
+    @property
+    def invocations(self) -> int:
+        return sum(ceil(count / self.fan_out_limit) for _, count in self.groups)
+
+    @property
+    def caps(self) -> int:
+        return sum(count for _, count in self.groups)
+
+
+def _greedy_padding(base: int, size: int) -> List[int]:
+    """Return the size bits of the largest objects possible respecting
+    alignment and size restrictions."""
+    padding = []
+    while size > 0:
+        size_bits = min(lsb(base), msb(size))
+        padding.append(size_bits)
+        base += 1 << size_bits
+        size -= 1 << size_bits
+    return padding
+
+
+def padding_plans(base: int, size: int, fan_out_limit: int) -> List[PaddingPlan]:
+    """Return the possible ways of padding 'size' bytes at 'base'.
+
+    We are restricted in how we can pad:
+    1: Untyped objects must be power-of-two sized.
+    2: Untyped objects must be aligned to their size.
+
+    There are three strategies:
+    greedy: use the largest objects possible, one retype for each.
+    fixed: use a single object size, so that the objects can be created
+           in batches. This creates more objects (caps), but requires fewer
+           invocations.
+    hybrid: the greedy objects, but neighbouring objects are split into
+            objects of the smaller size when this allows them to be
+            created by a single retype.
+    """
+    greedy = _greedy_padding(base, size)
+
+    fixed_bits = min(lsb(base), lsb(size))
+    fixed = ((fixed_bits, size >> fixed_bits), )
+
+    hybrid: List[Tuple[int, int]] = []
+    for size_bits in greedy:
+        run = (size_bits, 1)
+        while hybrid:
+            prev_bits, prev_count = hybrid[-1]
+            merged_bits = min(prev_bits, run[0])
+            merged_count = (prev_count << (prev_bits - merged_bits)) + (run[1] << (run[0] - merged_bits))
+            if merged_count > fan_out_limit:
+                break
+            hybrid.pop()
+            run = (merged_bits, merged_count)
+        hybrid.append(run)
+
+    return [
+        PaddingPlan(PADDING_GREEDY, base, size, tuple((size_bits, 1) for size_bits in greedy), fan_out_limit),
+        PaddingPlan(PADDING_FIXED, base, size, fixed, fan_out_limit),
+        PaddingPlan(PADDING_HYBRID, base, size, tuple(hybrid), fan_out_limit),
+    ]
+
+
+def choose_padding(base: int, size: int, fan_out_limit: int) -> PaddingPlan:
+    """Choose the padding plan with the fewest invocations, then the fewest caps."""
+    return min(padding_plans(base, size, fan_out_limit), key=lambda plan: (plan.invocations, plan.caps))
+
+
 class FixedUntypedAlloc:
     def __init__(self, ut: UntypedObject) -> None:
         self._ut = ut
@@ -425,30 +979,34 @@ class InitSystem:
             self,
             kernel_config: KernelConfig,
             cnode_cap: int,
-            cnode_mask: int,
+            cspace: SystemCSpace,
             first_available_cap_slot: int,
             kernel_object_allocator: KernelObjectAllocator,
             kernel_boot_info: KernelBootInfo,
-            invocations: List[Sel4Invocation],
+            invocations: Sel4InvocationTable,
             cap_address_names: Dict[int, str],
         ):
         self._cnode_cap = cnode_cap
-        self._cnode_mask = cnode_mask
+        self._cspace = cspace
+        self._cnode_mask = cspace.cap_address_mask
         self._kernel_config = kernel_config
         self._kao = kernel_object_allocator
         self._invocations = invocations
         self._cap_slot = first_available_cap_slot
         self._last_fixed_address = 0
         self._device_untyped = sorted([FixedUntypedAlloc(ut) for ut in kernel_boot_info.untyped_objects if ut.is_device])
+        # Index of the device untyped by base address (for lookup by address)
+        # and by cap (for lookup by untyped object).
+        self._device_untyped_bases = [ut._ut.region.base for ut in self._device_untyped]
+        self._device_untyped_by_cap = {ut._ut.cap: ut for ut in self._device_untyped}
         self._cap_address_names = cap_address_names
         self._objects: List[KernelObject] = []
+        self.padding: List[PaddingPlan] = []
 
     def reserve(self, allocations: List[Tuple[UntypedObject, int]]) -> None:
         for alloc_ut, alloc_phys_addr in allocations:
-            for ut in self._device_untyped:
-                if alloc_ut == ut._ut:
-                    break
-            else:
+            ut = self._device_untyped_by_cap.get(alloc_ut.cap)
+            if ut is None or ut._ut != alloc_ut:
                 raise Exception(f"Allocation {alloc_ut} ({alloc_phys_addr:x}) not in any device untyped")
 
             if not (ut._ut.region.base <= alloc_phys_addr <= ut._ut.region.end):
@@ -457,21 +1015,38 @@ class InitSystem:
             ut.watermark = alloc_phys_addr
 
 
+    def _find_device_untyped(self, phys_address: int) -> FixedUntypedAlloc:
+        idx = bisect_right(self._device_untyped_bases, phys_address) - 1
+        if idx < 0 or phys_address not in self._device_untyped[idx]:
+            raise Exception(f"{phys_address=:x} not in any device untyped")
+        return self._device_untyped[idx]
+
     def allocate_fixed_objects(self, phys_address: int, object_type: int, count: int, names: List[str]) -> List[KernelObject]:
         """
+        Allocate 'count' physically contiguous objects starting at 'phys_address'.
+
+        The objects are created with as few retypes as possible: one for each
+        device untyped the objects fall in (limited by the fan out limit, and
+        split where the cap slots cross into another system leaf CNode).
 
         Note: Fixed objects must be allocated in order!
         """
         assert phys_address >= self._last_fixed_address
         assert object_type in FIXED_OBJECT_SIZES
         assert count == len(names)
-        alloc_size = FIXED_OBJECT_SIZES[object_type]
 
-        for ut in self._device_untyped:
-            if phys_address in ut:
-                break
-        else:
-            raise Exception(f"{phys_address=:x} not in any device untyped")
+        kernel_objects: List[KernelObject] = []
+        while len(kernel_objects) < count:
+            kernel_objects += self._allocate_fixed_run(phys_address, object_type, names[len(kernel_objects):])
+            phys_address = self._last_fixed_address
+
+        self._objects += kernel_objects
+        return kernel_objects
+
+    def _allocate_fixed_run(self, phys_address: int, object_type: int, names: List[str]) -> List[KernelObject]:
+        """Allocate as many of the objects as possible with a single retype."""
+        alloc_size = FIXED_OBJECT_SIZES[object_type]
+        ut = self._find_device_untyped(phys_address)
 
         if phys_address < ut.watermark:
             raise Exception(f"{phys_address=:x} is below watermark")
@@ -479,104 +1054,125 @@ class InitSystem:
         if ut.watermark != phys_address:
             # If the watermark isn't at the right spot, then we need to
             # create padding objects until it is.
-            padding_required = phys_address - ut.watermark
-            # We are restricted in how much we can pad:
-            # 1: Untyped objects must be power-of-two sized.
-            # 2: Untyped objects must be aligned to their size.
-            padding_sizes = []
-            # We have two potential approaches for how we pad.
-            # 1: Use largest objects possible respecting alignment
-            # and size restrictions.
-            # 2: Use a fixed size object multiple times. This will
-            # create more objects, but as same sized objects can be
-            # create in a batch, required fewer invocations.
-            # For now we choose #1
-            wm = ut.watermark
-            while padding_required > 0:
-                wm_lsb = lsb(wm)
-                sz_msb = msb(padding_required)
-                pad_object_size = 1 << min(wm_lsb, sz_msb)
-                padding_sizes.append(pad_object_size)
-                wm += pad_object_size
-                padding_required -= pad_object_size
-
-            for sz in padding_sizes:
-                self._invocations.append(Sel4UntypedRetype(
-                        ut._ut.cap,
-                        SEL4_UNTYPED_OBJECT,
-                        int(log2(sz)),
-                        self._cnode_cap,
-                        1,
-                        1,
-                        self._cap_slot,
-                        1
-                ))
-                self._cap_slot += 1
-
-        object_cap = self._cap_slot
-        self._cap_slot += 1
+            padding = choose_padding(ut.watermark, phys_address - ut.watermark, self._kernel_config.fan_out_limit)
+            for size_bits, count in padding.groups:
+                for node_index, node_depth, node_offset, num_objects in self._cspace.retype_destinations(self._cap_slot, count, self._kernel_config.fan_out_limit):
+                    self._invocations.append(Sel4UntypedRetype(
+                            ut._ut.cap,
+                            SEL4_UNTYPED_OBJECT,
+                            size_bits,
+                            self._cnode_cap,
+                            node_index,
+                            node_depth,
+                            node_offset,
+                            num_objects
+                    ))
+                self._cap_slot += count
+            self.padding.append(padding)
+
+        count = min(len(names), (ut._ut.region.end - phys_address) // alloc_size)
+        assert count > 0
+        node_index, node_depth, node_offset, count = self._cspace.retype_destinations(self._cap_slot, count, self._kernel_config.fan_out_limit)[0]
+        base_cap_slot = self._cap_slot
+        self._cap_slot += count
         self._invocations.append(Sel4UntypedRetype(
                 ut._ut.cap,
                 object_type,
                 0,
                 self._cnode_cap,
-                1,
-                1,
-                object_cap,
-                1
+                node_index,
+                node_depth,
+                node_offset,
+                count
         ))
 
-        ut.watermark = phys_address + alloc_size
-        self._last_fixed_address = phys_address + alloc_size
-        cap_address = self._cnode_mask | object_cap
-        self._cap_address_names[cap_address] = names[0]
-        kernel_objects = [KernelObject(object_type, object_cap, cap_address, phys_address, names[0])]
-        self._objects += kernel_objects
+        ut.watermark = phys_address + count * alloc_size
+        self._last_fixed_address = phys_address + count * alloc_size
+        kernel_objects = []
+        for idx in range(count):
+            cap_address = self._cnode_mask | (base_cap_slot + idx)
+            self._cap_address_names[cap_address] = names[idx]
+            kernel_objects.append(KernelObject(object_type, base_cap_slot + idx, cap_address, phys_address + idx * alloc_size, names[idx]))
         return kernel_objects
 
     def allocate_objects(self, object_type: int, names: List[str], size: Optional[int] = None) -> List[KernelObject]:
-        count = len(names)
+        base_cap_slot = self._cap_slot
+        self._cap_slot += len(names)
+        kernel_objects = self._allocate_objects_at(object_type, names, size, base_cap_slot)
+        self._objects += kernel_objects
+        return kernel_objects
+
+    def allocate_objects_planned(self, requests: List[Tuple[int, List[str], Optional[int]]]) -> List[List[KernelObject]]:
+        """Allocate the objects for a set of (object_type, names, size) requests.
+
+        Cap slots are assigned in request order, so the objects for each
+        request have contiguous cap slots. However, the objects are allocated
+        (and the retype invocations generated) in size-descending order. As
+        object sizes are powers of two this avoids the alignment holes that
+        occur when a small object is followed by a larger one in the same
+        untyped.
+        """
+        base_cap_slots = []
+        for _, names, _ in requests:
+            base_cap_slots.append(self._cap_slot)
+            self._cap_slot += len(names)
+
+        order = sorted(range(len(requests)), key=lambda idx: -self._object_sizes(requests[idx][0], requests[idx][2])[0])
+        allocated: Dict[int, List[KernelObject]] = {}
+        for idx in order:
+            object_type, names, size = requests[idx]
+            allocated[idx] = self._allocate_objects_at(object_type, names, size, base_cap_slots[idx])
+
+        results = [allocated[idx] for idx in range(len(requests))]
+        for kernel_objects in results:
+            self._objects += kernel_objects
+        return results
+
+    def _object_sizes(self, object_type: int, size: Optional[int]) -> Tuple[int, int]:
+        """Return the allocation size and the size passed to retype."""
         if object_type in FIXED_OBJECT_SIZES:
             assert size is None
-            alloc_size = FIXED_OBJECT_SIZES[object_type]
-            api_size = 0
+            return FIXED_OBJECT_SIZES[object_type], 0
         elif object_type in (SEL4_CNODE_OBJECT, SEL4_SCHEDCONTEXT_OBJECT):
             assert size is not None
             assert is_power_of_two(size)
-            api_size = int(log2(size))
-            alloc_size = size * SLOT_SIZE
+            return size * SLOT_SIZE, int(log2(size))
         else:
             raise Exception(f"Invalid object type: {object_type}")
-        allocation = self._kao.alloc(alloc_size, count)
-        base_cap_slot = self._cap_slot
-        self._cap_slot += count
-        to_alloc = count
+
+    def _allocate_objects_at(self, object_type: int, names: List[str], size: Optional[int], base_cap_slot: int) -> List[KernelObject]:
+        count = len(names)
+        alloc_size, api_size = self._object_sizes(object_type, size)
+        if count == 0:
+            return []
+        # The objects may be split across multiple untyped objects, in
+        # which case there is a group of retypes for each untyped. The
+        # cap slots remain contiguous.
+        kernel_objects: List[KernelObject] = []
         alloc_cap_slot = base_cap_slot
-        while to_alloc:
-            call_count = min(to_alloc, self._kernel_config.fan_out_limit)
-            self._invocations.append(Sel4UntypedRetype(
-                    allocation.untyped_cap_address,
-                    object_type,
-                    api_size,
-                    self._cnode_cap,
-                    1,
-                    1,
-                    alloc_cap_slot,
-                    call_count
-            ))
-            to_alloc -= call_count
-            alloc_cap_slot += call_count
-        kernel_objects = []
-        phys_addr = allocation.phys_addr
-        for idx in range(count):
-            cap_slot = base_cap_slot + idx
-            cap_address = self._cnode_mask | cap_slot
-            name = names[idx]
-            self._cap_address_names[cap_address] = name
-            kernel_objects.append(KernelObject(object_type, cap_slot, cap_address, phys_addr, name))
-            phys_addr += alloc_size
+        for allocation, allocation_count in self._kao.alloc_batch(alloc_size, count):
+            for node_index, node_depth, node_offset, num_objects in self._cspace.retype_destinations(alloc_cap_slot, allocation_count, self._kernel_config.fan_out_limit):
+                self._invocations.append(Sel4UntypedRetype(
+                        allocation.untyped_cap_address,
+                        object_type,
+                        api_size,
+                        self._cnode_cap,
+                        node_index,
+                        node_depth,
+                        node_offset,
+                        num_objects
+                ))
+
+            phys_addr = allocation.phys_addr
+            for _ in range(allocation_count):
+                cap_slot = alloc_cap_slot
+                cap_address = self._cnode_mask | cap_slot
+                name = names[cap_slot - base_cap_slot]
+                self._cap_address_names[cap_address] = name
+                kernel_objects.append(KernelObject(object_type, cap_slot, cap_address, phys_addr, name))
+                phys_addr += alloc_size
+                alloc_cap_slot += 1
 
-        self._objects += kernel_objects
         return kernel_objects
 
 
@@ -590,12 +1186,72 @@ class Region:
         return f"<Region name={self.name} addr=0x{self.addr:x} size={len(self.data)}>"
 
 
+@dataclass(frozen=True)
+class DemandMap:
+    """A mapping that the monitor makes when the PD first faults on it.
+
+    The page objects (page_cap_address onwards) are created at boot,
+    but the copies of their caps (map_cap_address onwards) are only
+    minted, and mapped, by the monitor one page at a time.
+    """
+    badge: int
+    vaddr: int
+    page_count: int
+    page_size: int
+    page_cap_address: int
+    map_cap_address: int
+    vspace_cap_address: int
+    rights: int
+    attrs: int
+
+    @property
+    def end(self) -> int:
+        return self.vaddr + self.page_count * self.page_size
+
+
+def pack_demand_maps(demand_maps: List[DemandMap], cnode_cap: int, cnode_depth: int) -> bytes:
+    """Encode the monitor's fault-resolution table.
+
+    The maps are grouped by the badge of the PD's fault endpoint; the
+    header holds the index of the first map of each badge, so that the
+    monitor only searches the faulting PD's maps.
+    """
+    demand_maps = sorted(demand_maps, key=lambda dm: (dm.badge, dm.vaddr))
+    badges = [dm.badge for dm in demand_maps]
+    first = [bisect_left(badges, badge) for badge in range(MONITOR_CONFIG.max_pds + 1)]
+    header = MONITOR_CONFIG.demand_map_header_struct.pack(cnode_cap, cnode_depth, *first)
+    return header + b''.join(
+        MONITOR_CONFIG.demand_map_object_struct.pack(
+            dm.vaddr,
+            dm.page_count,
+            int(log2(dm.page_size)),
+            dm.page_cap_address,
+            dm.map_cap_address,
+            dm.vspace_cap_address,
+            dm.rights,
+            dm.attrs,
+        )
+        for dm in demand_maps
+    )
+
+
+@dataclass(frozen=True)
+class PlacementResult:
+    # None for the placement chosen by the layout optimiser
+    policy: Optional[AllocationPolicy]
+    reserved_region: MemoryRegion
+    initial_task_phys_region: MemoryRegion
+    untyped_count: int
+    largest_untyped: int
+    fragmentation: Fragmentation
+
+
 @dataclass
 class BuiltSystem:
     number_of_system_caps: int
     invocation_data_size: int
-    bootstrap_invocations: List[Sel4Invocation]
-    system_invocations: List[Sel4Invocation]
+    bootstrap_invocations: Sel4InvocationTable
+    system_invocations: Sel4InvocationTable
     kernel_boot_info: KernelBootInfo
     reserved_region: MemoryRegion
     fault_ep_cap_address: int
@@ -608,6 +1264,245 @@ class BuiltSystem:
     kernel_objects: List[KernelObject]
     initial_task_virt_region: MemoryRegion
     initial_task_phys_region: MemoryRegion
+    untyped_allocators: List[UntypedAllocator]
+    padding: List[PaddingPlan]
+    invocation_table_vaddr: int
+    root_cnode_cap_address: int
+    demand_maps: List[DemandMap]
+    placement: PlacementResult
+
+
+def place_reserved_and_initial_task(
+        available_memory: DisjointMemoryRegion,
+        reserved_size: int,
+        initial_task_size: int,
+        policy: AllocationPolicy,
+        reserved_align: int = 1,
+    ) -> Tuple[MemoryRegion, MemoryRegion]:
+    """Allocate the reserved region and the initial task's physical memory.
+
+    The kernel relies on the reserved region being below the initial
+    task, so the initial task is only placed above the reserved region.
+    """
+    try:
+        reserved_base = available_memory.allocate(reserved_size, policy, align=reserved_align)
+        initial_task_phys_base = available_memory.allocate(initial_task_size, policy, min_base=reserved_base + reserved_size)
+    except ValueError:
+        raise UserError(f"Error: unable to place reserved region (0x{reserved_size:x} bytes) and initial task (0x{initial_task_size:x} bytes) using the {policy.value} policy")
+    assert reserved_base < initial_task_phys_base
+    return (
+        MemoryRegion(reserved_base, reserved_base + reserved_size),
+        MemoryRegion(initial_task_phys_base, initial_task_phys_base + initial_task_size),
+    )
+
+
+def _evaluate_placement(
+        kernel_config: KernelConfig,
+        kernel_elf: ElfFile,
+        available_memory: DisjointMemoryRegion,
+        policy: Optional[AllocationPolicy],
+        reserved_region: MemoryRegion,
+        initial_task_phys_region: MemoryRegion,
+        initial_task_virt_region: MemoryRegion,
+    ) -> PlacementResult:
+    """Determine the untyped objects the kernel creates for a placement.
+
+    'available_memory' is the memory left after the placement.
+    """
+    kernel_boot_info = emulate_kernel_boot(
+        kernel_config,
+        kernel_elf,
+        initial_task_phys_region,
+        initial_task_virt_region,
+        reserved_region,
+    )
+    return _placement_result(policy, reserved_region, initial_task_phys_region, kernel_boot_info, available_memory.fragmentation())
+
+
+def _placement_result(
+        policy: Optional[AllocationPolicy],
+        reserved_region: MemoryRegion,
+        initial_task_phys_region: MemoryRegion,
+        kernel_boot_info: KernelBootInfo,
+        fragmentation: Fragmentation,
+    ) -> PlacementResult:
+    normal_untyped = [ut for ut in kernel_boot_info.untyped_objects if not ut.is_device]
+    return PlacementResult(
+        policy,
+        reserved_region,
+        initial_task_phys_region,
+        len(normal_untyped),
+        max(ut.region.size for ut in normal_untyped),
+        fragmentation,
+    )
+
+
+def compare_placement_policies(
+        kernel_config: KernelConfig,
+        kernel_elf: ElfFile,
+        reserved_size: int,
+        initial_task_virt_region: MemoryRegion,
+        reserved_align: int = 1,
+    ) -> List[Optional[PlacementResult]]:
+    """Determine the memory left behind by each placement policy.
+
+    The result is in the order of AllocationPolicy, with None where a
+    policy is unable to place the regions.
+    """
+    results: List[Optional[PlacementResult]] = []
+    available_memory = emulate_kernel_boot_partial(kernel_config, kernel_elf)
+    snapshot = available_memory.snapshot()
+    for policy in AllocationPolicy:
+        available_memory.rollback(snapshot)
+        try:
+            reserved_region, initial_task_phys_region = place_reserved_and_initial_task(
+                available_memory,
+                reserved_size,
+                initial_task_virt_region.size,
+                policy,
+                reserved_align,
+            )
+        except UserError:
+            results.append(None)
+            continue
+        results.append(_evaluate_placement(
+            kernel_config,
+            kernel_elf,
+            available_memory,
+            policy,
+            reserved_region,
+            initial_task_phys_region,
+            initial_task_virt_region,
+        ))
+    return results
+
+
+# Number of candidate layouts the optimiser evaluates with a full
+# kernel boot emulation.
+OPTIMISER_CANDIDATES = 8
+
+
+def _placement_candidates(memory: DisjointMemoryRegion, size: int, align: int, min_base: int = 0) -> List[int]:
+    """Return candidate base addresses for placing 'size' bytes in 'memory'.
+
+    The kernel splits free memory into power-of-two sized, aligned
+    untyped objects. Placing a region at the start or end of one of
+    those objects avoids splitting the memory any further, so these are
+    the candidates.
+    """
+    candidates = set()
+    for region in memory.regions():
+        for block in region.aligned_power_of_two_regions():
+            for base in (block.base, block.end - size):
+                if base >= max(region.base, min_base) and base + size <= region.end and base % align == 0:
+                    candidates.add(base)
+    return sorted(candidates)
+
+
+def optimise_placement(
+        kernel_config: KernelConfig,
+        kernel_elf: ElfFile,
+        reserved_size: int,
+        initial_task_virt_region: MemoryRegion,
+        reserved_align: int = 1,
+    ) -> PlacementResult:
+    """Choose the placement of the reserved region and initial task that
+    results in the fewest untyped objects, and then the largest untyped
+    object.
+
+    The layouts are first ranked by the untyped objects that the reserved
+    region and remaining free memory (after the kernel has allocated the
+    rootserver objects) are split into; the best of those (and the layout
+    of each placement policy) are then evaluated with a full kernel boot
+    emulation.
+    """
+    initial_task_size = initial_task_virt_region.size
+    align = kernel_config.minimum_page_size
+    memory = emulate_kernel_boot_partial(kernel_config, kernel_elf)
+    initial_snapshot = memory.snapshot()
+
+    ranked: List[Tuple[int, int, int, int]] = []
+    for reserved_base in _placement_candidates(memory, reserved_size, max(align, reserved_align)):
+        memory.rollback(initial_snapshot)
+        reserved_region = MemoryRegion(reserved_base, reserved_base + reserved_size)
+        memory.remove_region(reserved_region.base, reserved_region.end)
+        reserved_snapshot = memory.snapshot()
+        for initial_task_base in _placement_candidates(memory, initial_task_size, align, min_base=reserved_region.end):
+            memory.rollback(reserved_snapshot)
+            memory.remove_region(initial_task_base, initial_task_base + initial_task_size)
+            try:
+                allocate_rootserver_objects(memory, initial_task_virt_region)
+            except Exception:
+                continue
+            untyped = memory.aligned_power_of_two_regions()
+            untyped_count = len(reserved_region.aligned_power_of_two_regions()) + len(untyped)
+            largest_untyped = max((ut.size for ut in untyped), default=0)
+            ranked.append((untyped_count, -largest_untyped, reserved_base, initial_task_base))
+    ranked.sort()
+
+    layouts = [(reserved_base, initial_task_base) for _, _, reserved_base, initial_task_base in ranked[:OPTIMISER_CANDIDATES]]
+    for policy in AllocationPolicy:
+        memory.rollback(initial_snapshot)
+        try:
+            reserved_region, initial_task_phys_region = place_reserved_and_initial_task(
+                memory,
+                reserved_size,
+                initial_task_size,
+                policy,
+                reserved_align,
+            )
+        except UserError:
+            continue
+        layouts.append((reserved_region.base, initial_task_phys_region.base))
+
+    if len(layouts) == 0:
+        raise UserError(f"Error: unable to place reserved region (0x{reserved_size:x} bytes) and initial task (0x{initial_task_size:x} bytes)")
+
+    best: Optional[PlacementResult] = None
+    best_total = 0
+    for reserved_base, initial_task_base in layouts:
+        reserved_region = MemoryRegion(reserved_base, reserved_base + reserved_size)
+        initial_task_phys_region = MemoryRegion(initial_task_base, initial_task_base + initial_task_size)
+        memory.rollback(initial_snapshot)
+        memory.remove_region(reserved_region.base, reserved_region.end)
+        memory.remove_region(initial_task_phys_region.base, initial_task_phys_region.end)
+        result = _evaluate_placement(
+            kernel_config,
+            kernel_elf,
+            memory,
+            None,
+            reserved_region,
+            initial_task_phys_region,
+            initial_task_virt_region,
+        )
+        # The reserved region is given to the monitor as device untyped
+        # objects, so these count against the untyped limit as well.
+        total = result.untyped_count + len(reserved_region.aligned_power_of_two_regions())
+        if best is None or (total, -result.largest_untyped) < (best_total, -best.largest_untyped):
+            best = result
+            best_total = total
+
+    assert best is not None
+    return best
+
+
+def invocation_table_alignment(invocation_table_size: int) -> int:
+    """Return the physical alignment required for the invocation table.
+
+    An invocation table of at least a large page is mapped with large
+    pages, so must be aligned to a large page.
+    """
+    return SEL4_LARGE_PAGE_SIZE if invocation_table_size >= SEL4_LARGE_PAGE_SIZE else 1
+
+
+def invocation_window_vaddr(initial_task_virt_region: MemoryRegion, invocation_table_size: int) -> int:
+    """Return the virtual address at which the monitor maps the system
+    invocation data."""
+    if INVOCATION_WINDOW_VADDR + invocation_table_size <= initial_task_virt_region.base:
+        return INVOCATION_WINDOW_VADDR
+    if initial_task_virt_region.end > INVOCATION_WINDOW_HIGH_VADDR - SEL4_HUGE_PAGE_SIZE:
+        raise UserError(f"Error: monitor image (ends at 0x{initial_task_virt_region.end:x}) overlaps the invocation window")
+    return INVOCATION_WINDOW_HIGH_VADDR
 
 
 def _get_full_path(filename: Path, search_paths: List[Path]) -> Path:
@@ -627,9 +1522,14 @@ def build_system(
         invocation_table_size: int,
         system_cnode_size: int,
         search_paths: List[Path],
+        compress_invocations: bool = False,
+        placement_policy: AllocationPolicy = AllocationPolicy.FIRST_FIT,
+        kernel_object_policy: AllocationPolicy = AllocationPolicy.FIRST_FIT,
+        optimise_layout: bool = False,
+        large_pages: bool = False,
     ) -> BuiltSystem:
     """Build system as description by the inputs, with a 'BuiltSystem' object as the output."""
-    assert is_power_of_two(system_cnode_size)
+    assert system_cnode_size == system_cnode_slots(system_cnode_size)
     assert invocation_table_size % kernel_config.minimum_page_size == 0
     assert invocation_table_size <= MAX_SYSTEM_INVOCATION_SIZE
 
@@ -643,8 +1543,6 @@ def build_system(
     cap_address_names[INIT_ASID_POOL_CAP_ADDRESS] = "ASID Pool: init"
     cap_address_names[IRQ_CONTROL_CAP_ADDRESS] = "IRQ Control"
 
-    system_cnode_bits = int(log2(system_cnode_size))
-
     # Emulate kernel boot
 
     ## Determine physical memory region used by the monitor
@@ -668,24 +1566,43 @@ def build_system(
         for elf in pd_elf_files.values()
     ])
     reserved_size = invocation_table_size + pd_elf_size
+    if large_pages:
+        # ELF segments that can use large pages must be placed so that their
+        # physical address has the same offset from a large page boundary as
+        # their virtual address, which requires up to a large page of padding.
+        reserved_size += SEL4_LARGE_PAGE_SIZE * sum(
+            1
+            for elf in pd_elf_files.values()
+            for segment in elf.segments
+            if segment.loadable and spans_large_page(segment.virt_addr, segment.virt_addr + segment.mem_size)
+        )
+
+    initial_task_virt_region = virt_mem_region_from_elf(monitor_elf, kernel_config.minimum_page_size)
 
     # Now that the size is determine, find a free region in the physical memory
     # space.
-    available_memory = emulate_kernel_boot_partial(
-        kernel_config,
-        kernel_elf,
-    )
-
-    reserved_base = available_memory.allocate(reserved_size)
-    initial_task_phys_base = available_memory.allocate(initial_task_size)
-    # The kernel relies on this ordering. The previous allocation functions do *NOT* enforce
-    # this though, should fix that.
-    assert reserved_base < initial_task_phys_base
-
-    initial_task_phys_region = MemoryRegion(initial_task_phys_base, initial_task_phys_base + initial_task_size)
-    initial_task_virt_region = virt_mem_region_from_elf(monitor_elf, kernel_config.minimum_page_size)
+    # The invocation table is at the start of the reserved region.
+    reserved_align = invocation_table_alignment(invocation_table_size)
+    if optimise_layout:
+        optimised_placement = optimise_placement(kernel_config, kernel_elf, reserved_size, initial_task_virt_region, reserved_align)
+        reserved_region = optimised_placement.reserved_region
+        initial_task_phys_region = optimised_placement.initial_task_phys_region
+        fragmentation = optimised_placement.fragmentation
+    else:
+        available_memory = emulate_kernel_boot_partial(
+            kernel_config,
+            kernel_elf,
+        )
 
-    reserved_region = MemoryRegion(reserved_base, reserved_base + reserved_size)
+        reserved_region, initial_task_phys_region = place_reserved_and_initial_task(
+            available_memory,
+            reserved_size,
+            initial_task_size,
+            placement_policy,
+            reserved_align,
+        )
+        fragmentation = available_memory.fragmentation()
+    reserved_base = reserved_region.base
 
     # Now that the reserved region has been allocated we can determine the specific
     # region of physical memory required for the inovcation table itself, and
@@ -738,13 +1655,20 @@ def build_system(
         initial_task_virt_region,
         reserved_region
     )
+    placement = _placement_result(
+        None if optimise_layout else placement_policy,
+        reserved_region,
+        initial_task_phys_region,
+        kernel_boot_info,
+        fragmentation,
+    )
 
     for ut in kernel_boot_info.untyped_objects:
         dev_str = " (device)" if ut.is_device else ""
         cap_address_names[ut.cap] = f"Untyped @ 0x{ut.region.base:x}:0x{ut.region.size:x}{dev_str}"
 
     # X. The kernel boot info allows us to create an allocator for kernel objects
-    kao = KernelObjectAllocator(kernel_boot_info)
+    kao = KernelObjectAllocator(kernel_boot_info, kernel_object_policy)
 
     # 2. Now that the available resources are known it is possible to proceed with the
     # monitor task boot strap.
@@ -755,49 +1679,95 @@ def build_system(
     #   2. Making the system invocation table available in the monitor's address
     #   space.
 
-    # 2.1 The monitor's CSpace consists of two CNodes: a/ the initial task CNode
+    # 2.1 The monitor's CSpace consists of: a/ the initial task CNode
     # which consists of all the fixed initial caps along with caps for the
-    # object create during kernel bootstrap, and b/ the system CNode, which
+    # object create during kernel bootstrap, and b/ the system CSpace, which
     # contains caps to all objects that will be created in this process.
-    # The system CNode is of `system_cnode_size`. (Note: see also description
-    # on how `system_cnode_size` is iteratively determined).
+    # The system CSpace has `system_cnode_size` slots. (Note: see also
+    # description on how `system_cnode_size` is iteratively determined).
+    #
+    # The system CSpace is itself two levels: a top CNode, with a cap to
+    # a fixed size leaf CNode in each of its first slots (see SystemCSpace).
+    # Growing the system CSpace adds a leaf CNode, rather than doubling a
+    # single CNode, so the memory used tracks the number of caps.
+    #
+    # None of these CNodes are available at startup and must be created (by
+    # retyping memory from an untyped object). Once created the CNodes must be
+    # aranged as a tree such that the slots in all CNodes are addressable.
     #
-    # The system CNode is not available at startup and must be created (by retyping
-    # memory from an untyped object). Once created the two CNodes must be aranged
-    # as a tree such that the slots in both CNodes are addressable.
+    # A new root CNode shall become the root of the CSpace. The initial CNode shall
+    # be copied to slot zero of the root CNode, and the top CNode to slot one.
+    # In this manner all caps in the initial CNode will keep their original cap
+    # addresses. This isn't required but it makes allocation, debugging and
+    # reasoning about the system more straight forward.
     #
-    # The system CNode shall become the root of the CSpace. The initial CNode shall
-    # be copied to slot zero of the system CNode. In this manner all caps in the initial
-    # CNode will keep their original cap addresses. This isn't required but it makes
-    # allocation, debugging and reasoning about the system more straight forward.
+    # The guards shall be selected so the least significant bits are used. The
+    # guard for the top CNode shall be:
     #
-    # The guard shall be selected so the least significant bits are used. The guard
-    # for the root shall be:
+    #   64 - root cnode bits - top cnode bits - leaf cnode bits
     #
-    #   64 - system cnode bits - initial cnode bits
+    # The guard for the initial CNode is selected the same way, and the leaf
+    # CNodes have no guard.
     #
-    # The guard for the initial CNode will be zero.
+    # 2.1.1: Allocate the leaf CNodes and the *top* CNode. These are the cnodes
+    # that will have enough slots for all required caps.
     #
-    # 2.1.1: Allocate the *root* CNode. It is two entries:
+    # They are allocated before the (much smaller) root CNode so the
+    # root CNode doesn't create an alignment hole before it.
+    system_cspace = SystemCSpace.for_slots(kernel_config.cap_address_bits, system_cnode_size)
+    leaf_cnode_allocations = kao.alloc_batch((1 << system_cspace.leaf_bits) * (1 << SLOT_BITS), system_cspace.leaf_count)
+    top_cnode_allocation = kao.alloc((1 << system_cspace.top_bits) * (1 << SLOT_BITS))
+    system_cnode_cap = kernel_boot_info.first_available_cap + 1
+    cap_address_names[system_cnode_cap] = "CNode: system"
+    leaf_cnode_cap = kernel_boot_info.first_available_cap + 2
+    assert leaf_cnode_cap + system_cspace.leaf_count <= 1 << kernel_config.init_cnode_bits
+    for idx in range(system_cspace.leaf_count):
+        cap_address_names[leaf_cnode_cap + idx] = f"CNode: system leaf #{idx}"
+
+    # 2.1.2: Allocate the *root* CNode. It is two entries:
     #  slot 0: the existing init cnode
-    #  slot 1: our main system cnode
+    #  slot 1: our top system cnode
     root_cnode_bits = 1
     root_cnode_allocation = kao.alloc((1 << root_cnode_bits) * (1 << SLOT_BITS))
     root_cnode_cap =  kernel_boot_info.first_available_cap
     cap_address_names[root_cnode_cap] = "CNode: root"
 
-    # 2.1.2: Allocate the *system* CNode. It is the cnodes that
-    # will have enough slots for all required caps.
-    system_cnode_allocation = kao.alloc(system_cnode_size * (1 << SLOT_BITS))
-    system_cnode_cap = kernel_boot_info.first_available_cap + 1
-    cap_address_names[system_cnode_cap] = "CNode: system"
-
     # 2.1.3: Now that we've allocated the space for these we generate
-    # the actual systems calls.
+    # the actual systems calls (in the same order as the allocations).
     #
-    # First up create the root cnode
-    bootstrap_invocations: List[Sel4Invocation] = []
+    # First up create our new system Cnodes. We will place them into
+    # temporary cap slots in the initial CNode to start with.
+    bootstrap_invocations = Sel4InvocationTable()
+
+    cap_slot = leaf_cnode_cap
+    for allocation, allocation_count in leaf_cnode_allocations:
+        while allocation_count > 0:
+            num_objects = min(allocation_count, kernel_config.fan_out_limit)
+            bootstrap_invocations.append(Sel4UntypedRetype(
+                allocation.untyped_cap_address,
+                SEL4_CNODE_OBJECT,
+                system_cspace.leaf_bits,
+                INIT_CNODE_CAP_ADDRESS,
+                0,
+                0,
+                cap_slot,
+                num_objects
+            ))
+            cap_slot += num_objects
+            allocation_count -= num_objects
+
+    bootstrap_invocations.append(Sel4UntypedRetype(
+        top_cnode_allocation.untyped_cap_address,
+        SEL4_CNODE_OBJECT,
+        system_cspace.top_bits,
+        INIT_CNODE_CAP_ADDRESS,
+        0,
+        0,
+        system_cnode_cap,
+        1
+    ))
 
+    # Then the root cnode
     bootstrap_invocations.append(Sel4UntypedRetype(
             root_cnode_allocation.untyped_cap_address,
             SEL4_CNODE_OBJECT,
@@ -841,24 +1811,11 @@ def build_system(
         0
     ))
 
-    # 2.1.6: Now we can create our new system Cnode. We will place it into
-    # a temporary cap slot in the initial CNode to start with.
-    bootstrap_invocations.append(Sel4UntypedRetype(
-        system_cnode_allocation.untyped_cap_address,
-        SEL4_CNODE_OBJECT,
-        system_cnode_bits,
-        INIT_CNODE_CAP_ADDRESS,
-        0,
-        0,
-        system_cnode_cap,
-        1
-    ))
-
-    # 2.1.7: Now that the we have create the object, we can 'mutate' it
-    # to the correct place:
-    # Slot #1 of the new root cnode
-    guard = kernel_config.cap_address_bits - root_cnode_bits - system_cnode_bits
-    system_cap_address_mask = 1 << (kernel_config.cap_address_bits - 1)
+    # 2.1.6: Now that the we have created the system CNodes, we can 'mutate' them
+    # to the correct place: the top CNode to slot #1 of the new root cnode, and
+    # the leaf CNodes to the first slots of the top CNode.
+    assert root_cnode_bits == 1
+    system_cap_address_mask = system_cspace.cap_address_mask
     bootstrap_invocations.append(Sel4CnodeMint(
         root_cnode_cap,
         1,
@@ -867,8 +1824,20 @@ def build_system(
         system_cnode_cap,
         kernel_config.cap_address_bits,
         SEL4_RIGHTS_ALL,
-        guard
+        system_cspace.top_guard
     ))
+    invocation = Sel4CnodeMint(
+        system_cnode_cap,
+        0,
+        system_cspace.top_bits,
+        INIT_CNODE_CAP_ADDRESS,
+        leaf_cnode_cap,
+        kernel_config.cap_address_bits,
+        SEL4_RIGHTS_ALL,
+        0
+    )
+    invocation.repeat(system_cspace.leaf_count, dest_index=1, src_obj=1)
+    bootstrap_invocations.append(invocation)
 
     # 2.2 At this point it is necessary to get the frames containing the
     # main system invocations into the virtual address space. (Remember the
@@ -886,80 +1855,109 @@ def build_system(
     # of the reserved region. We can retype multiple frames as a time (
     # which reduces the number of invocations we need). However, it is possible
     # that the region spans multiple untyped objects.
-    # At this point in time we assume we will map the area using the minimum
-    # page size. It would be good in the future to use super pages (when
-    # it makes sense to - this would reduce memory usage, and the number of
-    # invocations required to set up the address space
-    pages_required= invocation_table_size // kernel_config.minimum_page_size
-    remaining_pages = pages_required
+    # If the invocation table is at least a large page it is aligned to
+    # a large page (see invocation_table_alignment), and is mapped with
+    # large pages, using the minimum page size only for the remainder.
+    # This reduces the number of bootstrap invocations, and the page tables
+    # required.
+    large_pages_required = invocation_table_size // SEL4_LARGE_PAGE_SIZE
+    pages_required = (invocation_table_size % SEL4_LARGE_PAGE_SIZE) // kernel_config.minimum_page_size
+    assert large_pages_required == 0 or invocation_table_region.base % SEL4_LARGE_PAGE_SIZE == 0
     invocation_table_allocations = []
     phys_addr = invocation_table_region.base
     base_page_cap = 0
-    for pta in range(base_page_cap, base_page_cap + pages_required):
+    for pta in range(base_page_cap, base_page_cap + large_pages_required):
+        cap_address_names[system_cap_address_mask | pta] = "LargePage: monitor invocation table"
+    for pta in range(base_page_cap + large_pages_required, base_page_cap + large_pages_required + pages_required):
         cap_address_names[system_cap_address_mask | pta] = "SmallPage: monitor invocation table"
 
     cap_slot = base_page_cap
+    remaining = {SEL4_LARGE_PAGE_OBJECT: large_pages_required, SEL4_SMALL_PAGE_OBJECT: pages_required}
     for ut in (ut for ut in kernel_boot_info.untyped_objects if ut.is_device):
-        ut_pages = ut.region.size // kernel_config.minimum_page_size
-        retype_page_count = min(ut_pages, remaining_pages)
-        assert retype_page_count <= kernel_config.fan_out_limit
-        bootstrap_invocations.append(Sel4UntypedRetype(
-                ut.cap,
-                SEL4_SMALL_PAGE_OBJECT,
-                0,
-                root_cnode_cap,
-                1,
-                1,
-                cap_slot,
-                retype_page_count
-        ))
-
-        remaining_pages -= retype_page_count
-        cap_slot += retype_page_count
-        phys_addr += retype_page_count * kernel_config.minimum_page_size
+        for page_object, page_size in ((SEL4_LARGE_PAGE_OBJECT, SEL4_LARGE_PAGE_SIZE), (SEL4_SMALL_PAGE_OBJECT, kernel_config.minimum_page_size)):
+            if remaining[page_object] == 0:
+                continue
+            retype_page_count = min((ut.region.end - phys_addr) // page_size, remaining[page_object])
+            if retype_page_count > 0:
+                for node_index, node_depth, node_offset, num_objects in system_cspace.retype_destinations(cap_slot, retype_page_count, kernel_config.fan_out_limit):
+                    bootstrap_invocations.append(Sel4UntypedRetype(
+                            ut.cap,
+                            page_object,
+                            0,
+                            root_cnode_cap,
+                            node_index,
+                            node_depth,
+                            node_offset,
+                            num_objects
+                    ))
+
+                remaining[page_object] -= retype_page_count
+                cap_slot += retype_page_count
+                phys_addr += retype_page_count * page_size
+            if remaining[page_object] > 0:
+                # The untyped is full
+                break
         invocation_table_allocations.append((ut, phys_addr))
-        if remaining_pages == 0:
+        if sum(remaining.values()) == 0:
             break
 
-    # 2.2.1: Now that physical pages have been allocated it is possible to setup
+    # 2.2.2: Now that physical pages have been allocated it is possible to setup
     # the virtual memory objects so that the pages can be mapped into virtual memory
-    # At this point we map into the arbitrary address of 0x0.8000.0000 (i.e.: 2GiB)
-    # We arbitrary limit the maximum size to be 128MiB. This allows for at least 1 million
-    # invocations to occur at system startup. This should be enough for any reasonable
-    # sized system.
+    # The pages are mapped at the invocation window (see invocation_window_vaddr):
+    # the arbitrary address of 0x0.8000.0000 (i.e.: 2GiB), below the monitor's image,
+    # if the invocation table fits there, otherwise at a higher address.
     #
-    # Before mapping it is necessary to install page tables that can cover the region.
-    page_tables_required = round_up(invocation_table_size, SEL4_LARGE_PAGE_SIZE) // SEL4_LARGE_PAGE_SIZE
-    page_table_allocation = kao.alloc(SEL4_PAGE_TABLE_SIZE, page_tables_required)
-    base_page_table_cap = cap_slot
-
-    for pta in range(base_page_table_cap, base_page_table_cap + page_tables_required):
-        cap_address_names[system_cap_address_mask | pta] = "PageTable: monitor"
+    # Before mapping the pages it is necessary to install the paging structures
+    # that cover them, other than those the kernel already created for the monitor's
+    # image. (A window below the image only needs page tables for the small pages.)
+    invocation_table_vaddr = invocation_window_vaddr(initial_task_virt_region, invocation_table_size)
+    vaddr = invocation_table_vaddr
+    window_end = vaddr + invocation_table_size
+    small_pages_vaddr = vaddr + large_pages_required * SEL4_LARGE_PAGE_SIZE
+    for object_type, table_map_cls, object_field, object_name, bits, window_ranges in (
+        (SEL4_PAGE_UPPER_DIRECTORY_OBJECT, Sel4PageUpperDirectoryMap, "page_upper_directory", "PageUpperDirectory", 12 + 9 + 9 + 9, [(vaddr, window_end)]),
+        (SEL4_PAGE_DIRECTORY_OBJECT, Sel4PageDirectoryMap, "page_directory", "PageDirectory", 12 + 9 + 9, [(vaddr, window_end)]),
+        (SEL4_PAGE_TABLE_OBJECT, Sel4PageTableMap, "page_table", "PageTable", 12 + 9, [(small_pages_vaddr, window_end)] if pages_required > 0 else []),
+    ):
+        monitor_blocks = set(aligned_blocks([(initial_task_virt_region.base, initial_task_virt_region.end)], bits))
+        table_vaddrs = [block for block in aligned_blocks(window_ranges, bits) if block not in monitor_blocks]
+        if len(table_vaddrs) == 0:
+            continue
 
-    assert page_tables_required <= kernel_config.fan_out_limit
-    bootstrap_invocations.append(Sel4UntypedRetype(
-            page_table_allocation.untyped_cap_address,
-            SEL4_PAGE_TABLE_OBJECT,
-            0,
-            root_cnode_cap,
-            1,
-            1,
-            cap_slot,
-            page_tables_required
-    ))
-    cap_slot += page_tables_required
+        base_table_cap = cap_slot
+        for pta in range(base_table_cap, base_table_cap + len(table_vaddrs)):
+            cap_address_names[system_cap_address_mask | pta] = f"{object_name}: monitor"
+
+        for allocation, allocation_count in kao.alloc_batch(FIXED_OBJECT_SIZES[object_type], len(table_vaddrs)):
+            for node_index, node_depth, node_offset, num_objects in system_cspace.retype_destinations(cap_slot, allocation_count, kernel_config.fan_out_limit):
+                bootstrap_invocations.append(Sel4UntypedRetype(
+                        allocation.untyped_cap_address,
+                        object_type,
+                        0,
+                        root_cnode_cap,
+                        node_index,
+                        node_depth,
+                        node_offset,
+                        num_objects
+                ))
+            cap_slot += allocation_count
 
-    # Now that the page tables are allocated they can be mapped into vspace
-    vaddr = 0x8000_0000
-    invocation = Sel4PageTableMap(system_cap_address_mask | base_page_table_cap, INIT_VSPACE_CAP_ADDRESS, vaddr, SEL4_ARM_DEFAULT_VMATTRIBUTES)
-    invocation.repeat(page_tables_required, page_table=1, vaddr=SEL4_LARGE_PAGE_SIZE)
-    bootstrap_invocations.append(invocation)
+        # Now that the paging structures are allocated they can be mapped into vspace
+        for first, count in arithmetic_runs(table_vaddrs, 1, 1):
+            invocation = table_map_cls(system_cap_address_mask | (base_table_cap + first), INIT_VSPACE_CAP_ADDRESS, table_vaddrs[first], SEL4_ARM_DEFAULT_VMATTRIBUTES)
+            if count > 1:
+                invocation.repeat(count, **{object_field: 1, "vaddr": table_vaddrs[first + 1] - table_vaddrs[first]})
+            bootstrap_invocations.append(invocation)
 
     # Finally, once the page tables are allocated the pages can be mapped
-    vaddr = 0x8000_0000
-    invocation = Sel4PageMap(system_cap_address_mask | base_page_cap, INIT_VSPACE_CAP_ADDRESS, vaddr, SEL4_RIGHTS_READ, SEL4_ARM_DEFAULT_VMATTRIBUTES | SEL4_ARM_EXECUTE_NEVER)
-    invocation.repeat(pages_required, page=1, vaddr=kernel_config.minimum_page_size)
-    bootstrap_invocations.append(invocation)
+    if large_pages_required > 0:
+        invocation = Sel4PageMap(system_cap_address_mask | base_page_cap, INIT_VSPACE_CAP_ADDRESS, vaddr, SEL4_RIGHTS_READ, SEL4_ARM_DEFAULT_VMATTRIBUTES | SEL4_ARM_EXECUTE_NEVER)
+        invocation.repeat(large_pages_required, page=1, vaddr=SEL4_LARGE_PAGE_SIZE)
+        bootstrap_invocations.append(invocation)
+    if pages_required > 0:
+        invocation = Sel4PageMap(system_cap_address_mask | (base_page_cap + large_pages_required), INIT_VSPACE_CAP_ADDRESS, small_pages_vaddr, SEL4_RIGHTS_READ, SEL4_ARM_DEFAULT_VMATTRIBUTES | SEL4_ARM_EXECUTE_NEVER)
+        invocation.repeat(pages_required, page=1, vaddr=kernel_config.minimum_page_size)
+        bootstrap_invocations.append(invocation)
 
 
     # 3. Now we can start setting up the system based on the information
@@ -992,6 +1990,11 @@ def build_system(
             if not segment.loadable:
                 continue
 
+            base_vaddr = round_down(segment.virt_addr, kernel_config.minimum_page_size)
+            end_vaddr = round_up(segment.virt_addr + segment.mem_size, kernel_config.minimum_page_size)
+            if large_pages and spans_large_page(segment.virt_addr, segment.virt_addr + segment.mem_size):
+                phys_addr_next += (base_vaddr - phys_addr_next) % SEL4_LARGE_PAGE_SIZE
+
             regions.append(Region(f"PD-ELF {pd.name}-{seg_idx}", phys_addr_next, segment.data))
 
             perms = ""
@@ -1002,11 +2005,9 @@ def build_system(
             if segment.is_executable:
                 perms += "x"
 
-            base_vaddr = round_down(segment.virt_addr, kernel_config.minimum_page_size)
-            end_vaddr = round_up(segment.virt_addr + segment.mem_size, kernel_config.minimum_page_size)
             aligned_size = end_vaddr - base_vaddr
             name = f"ELF:{pd.name}-{seg_idx}"
-            mr = SysMemoryRegion(name, aligned_size, 0x1000, aligned_size // 0x1000, phys_addr_next)
+            mr = SysMemoryRegion(name, aligned_size, 0x1000, aligned_size // 0x1000, phys_addr_next, page_size_explicit=False)
             seg_idx += 1
             phys_addr_next += aligned_size
             extra_mrs.append(mr)
@@ -1015,14 +2016,22 @@ def build_system(
             pd_extra_maps[pd] += (mp, )
 
     all_mrs = system.memory_regions + tuple(extra_mrs)
+    pd_maps = {pd: pd.maps + pd_extra_maps[pd] for pd in system.protection_domains}
+    if large_pages:
+        # A PD given the physical address of a memory region (e.g. for
+        # DMA) expects the whole memory region to be contiguous.
+        region_paddr_mrs = {setvar.region_paddr for pd in system.protection_domains for setvar in pd.setvars if setvar.region_paddr is not None}
+        all_mrs, pd_maps = promote_large_pages(all_mrs, pd_maps, region_paddr_mrs)
     all_mr_by_name = {mr.name: mr for mr in all_mrs}
 
-    system_invocations: List[Sel4Invocation] = []
-    init_system = InitSystem(kernel_config, root_cnode_cap, system_cap_address_mask, cap_slot, kao, kernel_boot_info, system_invocations, cap_address_names)
+    # Consecutive invocations with a constant stride are folded into
+    # repeated invocations as they are appended.
+    system_invocations = Sel4InvocationTable(fold=True)
+    init_system = InitSystem(kernel_config, root_cnode_cap, system_cspace, cap_slot, kao, kernel_boot_info, system_invocations, cap_address_names)
     init_system.reserve(invocation_table_allocations)
 
-    SUPPORTED_PAGE_SIZES = (0x1_000, 0x200_000)
-    SUPPORTED_PAGE_OBJECTS = (SEL4_SMALL_PAGE_OBJECT, SEL4_LARGE_PAGE_OBJECT)
+    SUPPORTED_PAGE_SIZES = (SEL4_SMALL_PAGE_SIZE, SEL4_LARGE_PAGE_SIZE, SEL4_HUGE_PAGE_SIZE)
+    SUPPORTED_PAGE_OBJECTS = (SEL4_SMALL_PAGE_OBJECT, SEL4_LARGE_PAGE_OBJECT, SEL4_HUGE_PAGE_OBJECT)
     PAGE_OBJECT_BY_SIZE = dict(zip(SUPPORTED_PAGE_SIZES, SUPPORTED_PAGE_OBJECTS))
     # 3.1 Work out how many regular (non-fixed) page objects are required
     page_names_by_size: Dict[int, List[str]] = {
@@ -1035,10 +2044,103 @@ def build_system(
         page_size_human = human_size_strict(mr.page_size)
         page_names_by_size[mr.page_size] +=  [f"Page({page_size_human}): MR={mr.name} #{idx}" for idx in range(mr.page_count)]
 
-    page_objects: Dict[int, List[KernelObject]] = {}
+    # 3.2 Work out the other (non-fixed) objects required
+    tcb_names = [f"TCB: PD={pd.name}" for pd in system.protection_domains]
+    schedcontext_names = [f"SchedContext: PD={pd.name}" for pd in system.protection_domains]
+    pp_protection_domains = [pd for pd in system.protection_domains if pd.pp]
+    endpoint_names = ["EP: Monitor Fault"] + [f"EP: PD={pd.name}" for pd in pp_protection_domains]
+    reply_protection_domains = [pd for pd in system.protection_domains if pd_needs_reply(pd)]
+    reply_names = ["Reply: Monitor"]+ [f"Reply: PD={pd.name}" for pd in reply_protection_domains]
+    notification_names = [f"Notification: PD={pd.name}" for pd in system.protection_domains]
+
+    # Determine number of upper directory / directory / page table objects required
+    #
+    # Upper directory (level 3 table) is based on how many 512 GiB parts of the address
+    # space is covered (normally just 1!).
+    #
+    # Page directory (level 2 table) is based on how many 1,024 MiB parts of
+    # the address space is covered
+    #
+    # Page table (level 3 table) is based on how many 2 MiB parts of the
+    # address space is covered (excluding any 2MiB regions covered by large
+    # pages).
+    #
+    # Huge (1 GiB) pages are mapped directly in the upper directory, so the
+    # 1,024 MiB parts covered by huge pages don't need a page directory.
+
+    uds = []
+    ds = []
+    pts = []
+    for pd_idx, pd in enumerate(system.protection_domains):
+        ipc_buffer_vaddr, _ = pd_elf_files[pd].find_symbol("__sel4_ipc_buffer_obj")
+        index = vspace_index(pd.name, ipc_buffer_vaddr, pd_maps[pd], all_mr_by_name)
+        ud_vaddrs, d_vaddrs, pt_vaddrs = paging_structure_vaddrs(index)
+        uds += [(pd_idx, vaddr) for vaddr in ud_vaddrs]
+        ds += [(pd_idx, vaddr) for vaddr in d_vaddrs]
+        pts += [(pd_idx, vaddr) for vaddr in pt_vaddrs]
+
+    vspace_names = [f"VSpace: PD={pd.name}" for pd in system.protection_domains]
+    ud_names = paging_structure_names("PageUpperDirectory", system, uds)
+    d_names = paging_structure_names("PageDirectory", system, ds)
+    pt_names = paging_structure_names("PageTable", system, pts)
+    # Each PD's CNode is sized to fit the caps minted into it. There is
+    # a request for each distinct size.
+    cnode_sizes = [pd_cnode_size(pd, system) for pd in system.protection_domains]
+    cnode_request_sizes = sorted(set(cnode_sizes), reverse=True)
+    cnode_names = {
+        size: [f"CNode: PD={pd.name}" for pd, pd_size in zip(system.protection_domains, cnode_sizes) if pd_size == size]
+        for size in cnode_request_sizes
+    }
+
+    # 3.3 Allocate all the non-fixed objects together, so that they can
+    # be placed in the untyped objects without alignment holes.
+    object_requests: List[Tuple[int, List[str], Optional[int]]] = [
+        (page_object, page_names_by_size[page_size], None)
+        for page_size, page_object in reversed(list(zip(SUPPORTED_PAGE_SIZES, SUPPORTED_PAGE_OBJECTS)))
+    ]
+    object_requests += [
+        (SEL4_TCB_OBJECT, tcb_names, None),
+        (SEL4_SCHEDCONTEXT_OBJECT, schedcontext_names, PD_SCHEDCONTEXT_SIZE),
+        (SEL4_REPLY_OBJECT, reply_names, None),
+        (SEL4_ENDPOINT_OBJECT, endpoint_names, None),
+        (SEL4_NOTIFICATION_OBJECT, notification_names, None),
+        (SEL4_VSPACE_OBJECT, vspace_names, None),
+        (SEL4_PAGE_UPPER_DIRECTORY_OBJECT, ud_names, None),
+        (SEL4_PAGE_DIRECTORY_OBJECT, d_names, None),
+        (SEL4_PAGE_TABLE_OBJECT, pt_names, None),
+    ]
+    object_requests += [(SEL4_CNODE_OBJECT, cnode_names[size], size) for size in cnode_request_sizes]
+    allocated_objects = init_system.allocate_objects_planned(object_requests)
+    page_objects: Dict[int, List[KernelObject]] = {
+        page_size: allocated_objects[idx]
+        for idx, page_size in enumerate(reversed(SUPPORTED_PAGE_SIZES))
+    }
+    (
+        tcb_objects,
+        schedcontext_objects,
+        reply_objects,
+        endpoint_objects,
+        notification_objects,
+        vspace_objects,
+        ud_objects,
+        d_objects,
+        pt_objects,
+    ) = allocated_objects[len(SUPPORTED_PAGE_SIZES):-len(cnode_request_sizes)]
+    cnode_objects_by_size = {
+        size: iter(objects)
+        for size, objects in zip(cnode_request_sizes, allocated_objects[-len(cnode_request_sizes):])
+    }
+    cnode_objects = [next(cnode_objects_by_size[size]) for size in cnode_sizes]
+    cnode_bits = [int(log2(size)) for size in cnode_sizes]
 
-    for page_size, page_object in reversed(list(zip(SUPPORTED_PAGE_SIZES, SUPPORTED_PAGE_OBJECTS))):
-        page_objects[page_size] = init_system.allocate_objects(page_object, page_names_by_size[page_size])
+    tcb_caps = [tcb_obj.cap_addr for tcb_obj in tcb_objects]
+    schedcontext_caps = [sc.cap_addr for sc in schedcontext_objects]
+    reply_object = reply_objects[0]
+    pd_reply_objects = dict(zip(reply_protection_domains, reply_objects[1:]))
+    fault_ep_endpoint_object = endpoint_objects[0]
+    pp_ep_endpoint_objects = dict(zip(pp_protection_domains, endpoint_objects[1:]))
+    notification_objects_by_pd = dict(zip(system.protection_domains, notification_objects))
+    notification_caps = [ntfn.cap_addr for ntfn in notification_objects]
 
     ipc_buffer_objects = page_objects[0x1000][:len(system.protection_domains)]
 
@@ -1052,7 +2154,7 @@ def build_system(
         mr_pages[mr] = [page_objects[mr.page_size][i] for i in range(idx, idx + mr.page_count)]
         pg_idx[mr.page_size] += mr.page_count
 
-    # 3.2 Now allocate all the fixed mRs
+    # 3.4 Now allocate all the fixed mRs
 
     # First we need to find all the requested pages and sorted them
     fixed_pages = []
@@ -1066,98 +2168,31 @@ def build_system(
 
     fixed_pages.sort()
 
-    # FIXME: At this point we can recombine them into
-    # groups to optimize allocation
-
+    # Recombine the pages into runs of physically contiguous pages of the
+    # same size, so each run can be created with a single retype (per
+    # untyped).
+    fixed_page_runs: List[List[Tuple[int, SysMemoryRegion]]] = []
     for phys_addr, mr in fixed_pages:
         if mr.page_size not in SUPPORTED_PAGE_SIZES:
             raise Exception(f"Invalid page_size: 0x{mr.page_size:x} for mr {mr}")
-        obj_type = PAGE_OBJECT_BY_SIZE[mr.page_size]
-        obj_type_name = f"Page({human_size_strict(mr.page_size)})"
-        name = f"{obj_type_name}: MR={mr.name} @ {phys_addr:x}"
-        page = init_system.allocate_fixed_objects(phys_addr, obj_type, 1, names=[name])[0]
-        mr_pages[mr].append(page)
-
-    tcb_names = [f"TCB: PD={pd.name}" for pd in system.protection_domains]
-    tcb_objects = init_system.allocate_objects(SEL4_TCB_OBJECT, tcb_names)
-    tcb_caps = [tcb_obj.cap_addr for tcb_obj in tcb_objects]
-    schedcontext_names = [f"SchedContext: PD={pd.name}" for pd in system.protection_domains]
-    schedcontext_objects = init_system.allocate_objects(SEL4_SCHEDCONTEXT_OBJECT, schedcontext_names, size=PD_SCHEDCONTEXT_SIZE)
-    schedcontext_caps = [sc.cap_addr for sc in schedcontext_objects]
-    pp_protection_domains = [pd for pd in system.protection_domains if pd.pp]
-    endpoint_names = ["EP: Monitor Fault"] + [f"EP: PD={pd.name}" for pd in pp_protection_domains]
-    reply_names = ["Reply: Monitor"]+ [f"Reply: PD={pd.name}" for pd in system.protection_domains]
-    reply_objects = init_system.allocate_objects(SEL4_REPLY_OBJECT, reply_names)
-    reply_object = reply_objects[0]
-    # FIXME: Probably only need reply objects for PPs
-    pd_reply_objects = reply_objects[1:]
-    endpoint_objects = init_system.allocate_objects(SEL4_ENDPOINT_OBJECT, endpoint_names)
-    fault_ep_endpoint_object = endpoint_objects[0]
-    pp_ep_endpoint_objects = dict(zip(pp_protection_domains, endpoint_objects[1:]))
-    notification_names = [f"Notification: PD={pd.name}" for pd in system.protection_domains]
-    notification_objects = init_system.allocate_objects(SEL4_NOTIFICATION_OBJECT, notification_names)
-    notification_objects_by_pd = dict(zip(system.protection_domains, notification_objects))
-    notification_caps = [ntfn.cap_addr for ntfn in notification_objects]
-
-    # Determine number of upper directory / directory / page table objects required
-    #
-    # Upper directory (level 3 table) is based on how many 512 GiB parts of the address
-    # space is covered (normally just 1!).
-    #
-    # Page directory (level 2 table) is based on how many 1,024 MiB parts of
-    # the address space is covered
-    #
-    # Page table (level 3 table) is based on how many 2 MiB parts of the
-    # address space is covered (excluding any 2MiB regions covered by large
-    # pages).
-
-    uds = []
-    ds = []
-    pts = []
-    for pd_idx, pd in enumerate(system.protection_domains):
-        ipc_buffer_vaddr, _ = pd_elf_files[pd].find_symbol("__sel4_ipc_buffer_obj")
-        upper_directory_vaddrs = set()
-        directory_vaddrs = set()
-        page_table_vaddrs = set()
-
-        # For each page, in each map determine we determine
-        # which upper directory, directory and page table is resides
-        # in, and then page sure this is set
-        vaddrs = [(ipc_buffer_vaddr, 0x1000)]
-        for map in (pd.maps + pd_extra_maps[pd]):
-            mr = all_mr_by_name[map.mr]
-            vaddr = map.vaddr
-            for _ in range(mr.page_count):
-                vaddrs.append((vaddr, mr.page_size))
-                vaddr += mr_page_bytes(mr)
-
-        for vaddr, page_size in vaddrs:
-            upper_directory_vaddrs.add(mask_bits(vaddr, 12 + 9 + 9 + 9))
-            directory_vaddrs.add(mask_bits(vaddr, 12 + 9 + 9))
-            if page_size == 0x1_000:
-                page_table_vaddrs.add(mask_bits(vaddr, 12 + 9))
-        uds += [(pd_idx, vaddr) for vaddr in sorted(upper_directory_vaddrs)]
-        ds += [(pd_idx, vaddr) for vaddr in sorted(directory_vaddrs)]
-        pts += [(pd_idx, vaddr) for vaddr in sorted(page_table_vaddrs)]
-
-    pd_names = [pd.name for p in system.protection_domains]
-    vspace_names = [f"VSpace: PD={pd.name}" for pd in system.protection_domains]
-
-    vspace_objects = init_system.allocate_objects(SEL4_VSPACE_OBJECT, vspace_names)
-
-    ud_names = [f"PageUpperDirectory: PD={pd_names[pd_idx]} VADDR=0x{vaddr:x}" for pd_idx, vaddr in uds]
-    ud_objects = init_system.allocate_objects(SEL4_PAGE_UPPER_DIRECTORY_OBJECT, ud_names)
-
-    d_names = [f"PageDirectory: PD={pd_names[pd_idx]} VADDR=0x{vaddr:x}" for pd_idx, vaddr in ds]
-    d_objects = init_system.allocate_objects(SEL4_PAGE_DIRECTORY_OBJECT, d_names)
+        if fixed_page_runs:
+            last_phys_addr, last_mr = fixed_page_runs[-1][-1]
+            if last_mr.page_size == mr.page_size and last_phys_addr + last_mr.page_size == phys_addr:
+                fixed_page_runs[-1].append((phys_addr, mr))
+                continue
+        fixed_page_runs.append([(phys_addr, mr)])
 
-    pt_names = [f"PageTable: PD={pd_names[pd_idx]} VADDR=0x{vaddr:x}" for pd_idx, vaddr in pts]
-    pt_objects = init_system.allocate_objects(SEL4_PAGE_TABLE_OBJECT, pt_names)
+    for run in fixed_page_runs:
+        run_phys_addr, run_mr = run[0]
+        obj_type = PAGE_OBJECT_BY_SIZE[run_mr.page_size]
+        obj_type_name = f"Page({human_size_strict(run_mr.page_size)})"
+        names = [f"{obj_type_name}: MR={mr.name} @ {phys_addr:x}" for phys_addr, mr in run]
+        pages = init_system.allocate_fixed_objects(run_phys_addr, obj_type, len(run), names=names)
+        for (_, mr), page in zip(run, pages):
+            mr_pages[mr].append(page)
 
-    # Create CNodes - all CNode objects are the same size: 128 slots.
-    cnode_names = [f"CNode: PD={pd.name}" for pd in system.protection_domains]
-    cnode_objects = init_system.allocate_objects(SEL4_CNODE_OBJECT, cnode_names, size=PD_CAP_SIZE)
     cnode_objects_by_pd = dict(zip(system.protection_domains, cnode_objects))
+    cnode_bits_by_pd = dict(zip(system.protection_domains, cnode_bits))
 
     cap_slot = init_system._cap_slot
 
@@ -1193,8 +2228,9 @@ def build_system(
     # Mint copies of required pages, while also determing what's required
     # for later mapping
     page_descriptors = []
+    demand_maps: List[DemandMap] = []
     for pd_idx, pd in enumerate(system.protection_domains):
-        for mp in (pd.maps + pd_extra_maps[pd]):
+        for mp in pd_maps[pd]:
             vaddr = mp.vaddr
             mr = all_mr_by_name[mp.mr] #system.mr_by_name[mp.mr]
             rights = 0
@@ -1211,7 +2247,24 @@ def build_system(
             assert len(mr_pages[mr]) > 0
             assert_objects_adjacent(mr_pages[mr])
 
-            invocation = Sel4CnodeMint(system_cnode_cap, cap_slot, system_cnode_bits, root_cnode_cap, mr_pages[mr][0].cap_addr, kernel_config.cap_address_bits, rights, 0)
+            # Demand maps keep their cap slots, but the monitor mints
+            # and maps each page when the PD first faults on it.
+            if mp.demand:
+                demand_maps.append(DemandMap(
+                    pd_idx + 1,
+                    vaddr,
+                    len(mr_pages[mr]),
+                    mr_page_bytes(mr),
+                    mr_pages[mr][0].cap_addr,
+                    system_cap_address_mask | cap_slot,
+                    vspace_objects[pd_idx].cap_addr,
+                    rights,
+                    attrs,
+                ))
+                cap_slot += len(mr_pages[mr])
+                continue
+
+            invocation = Sel4CnodeMint(root_cnode_cap, system_cap_address_mask | cap_slot, kernel_config.cap_address_bits, root_cnode_cap, mr_pages[mr][0].cap_addr, kernel_config.cap_address_bits, rights, 0)
             invocation.repeat(len(mr_pages[mr]), dest_index=1, src_obj=1)
             system_invocations.append(invocation)
 
@@ -1237,9 +2290,9 @@ def build_system(
             badged_cap_address = system_cap_address_mask | cap_slot
             system_invocations.append(
                 Sel4CnodeMint(
-                    system_cnode_cap,
-                    cap_slot,
-                    system_cnode_bits,
+                    root_cnode_cap,
+                    badged_cap_address,
+                    kernel_config.cap_address_bits,
                     root_cnode_cap,
                     notification_obj.cap_addr,
                     kernel_config.cap_address_bits,
@@ -1250,7 +2303,7 @@ def build_system(
             badged_irq_caps[pd].append(badged_cap_address)
             cap_slot += 1
 
-    invocation = Sel4CnodeMint(system_cnode_cap, cap_slot, system_cnode_bits, root_cnode_cap, fault_ep_endpoint_object.cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 1)
+    invocation = Sel4CnodeMint(root_cnode_cap, system_cap_address_mask | cap_slot, kernel_config.cap_address_bits, root_cnode_cap, fault_ep_endpoint_object.cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 1)
     invocation.repeat(len(system.protection_domains), dest_index=1, badge=1)
     system_invocations.append(invocation)
     badged_fault_ep = system_cap_address_mask | cap_slot
@@ -1261,12 +2314,11 @@ def build_system(
     ## Minting in the address space
     for pd, notification_obj, cnode_obj in zip(system.protection_domains, notification_objects, cnode_objects):
         obj = pp_ep_endpoint_objects[pd] if pd.pp else notification_obj
-        assert INPUT_CAP_IDX < PD_CAP_SIZE
         system_invocations.append(
             Sel4CnodeMint(
                 cnode_obj.cap_addr,
                 INPUT_CAP_IDX,
-                PD_CAP_BITS,
+                cnode_bits_by_pd[pd],
                 root_cnode_cap,
                 obj.cap_addr,
                 kernel_config.cap_address_bits,
@@ -1274,27 +2326,25 @@ def build_system(
                 0)
         )
 
-    assert REPLY_CAP_IDX < PD_CAP_SIZE
-    invocation = Sel4CnodeMint(cnode_objects[0].cap_addr, REPLY_CAP_IDX, PD_CAP_BITS, root_cnode_cap, pd_reply_objects[0].cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 1)
-    invocation.repeat(len(system.protection_domains), cnode=1, src_obj=1)
-    system_invocations.append(invocation)
+    # Only PDs that can be called have a reply object. Consecutive mints
+    # (with the same CNode size) are folded into a repeated invocation.
+    for pd, pd_reply_object in pd_reply_objects.items():
+        system_invocations.append(Sel4CnodeMint(cnode_objects_by_pd[pd].cap_addr, REPLY_CAP_IDX, cnode_bits_by_pd[pd], root_cnode_cap, pd_reply_object.cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 1))
 
     ## Mint access to the vspace cap
-    assert VSPACE_CAP_IDX < PD_CAP_SIZE
-    invocation = Sel4CnodeMint(cnode_objects[0].cap_addr, VSPACE_CAP_IDX, PD_CAP_BITS, root_cnode_cap, vspace_objects[0].cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 0)
-    invocation.repeat(len(system.protection_domains), cnode=1, src_obj=1)
-    system_invocations.append(invocation)
+    for cnode_obj, bits, vspace_obj in zip(cnode_objects, cnode_bits, vspace_objects):
+        system_invocations.append(Sel4CnodeMint(cnode_obj.cap_addr, VSPACE_CAP_IDX, bits, root_cnode_cap, vspace_obj.cap_addr, kernel_config.cap_address_bits, SEL4_RIGHTS_ALL, 0))
 
     ## Mint access to interrupt handlers in the PD Cspace
     for cnode_obj, pd in zip(cnode_objects, system.protection_domains):
         for sysirq, irq_cap_address in zip(pd.irqs, irq_cap_addresses[pd]):
             cap_idx = BASE_IRQ_CAP + sysirq.id_
-            assert cap_idx < PD_CAP_SIZE
+            assert cap_idx < 1 << cnode_bits_by_pd[pd]
             system_invocations.append(
                 Sel4CnodeMint(
                     cnode_obj.cap_addr,
                     cap_idx,
-                    PD_CAP_BITS,
+                    cnode_bits_by_pd[pd],
                     root_cnode_cap,
                     irq_cap_address,
                     kernel_config.cap_address_bits,
@@ -1315,13 +2365,13 @@ def build_system(
         # Set up the notification baps
         pd_a_cap_idx = BASE_OUTPUT_NOTIFICATION_CAP + cc.id_a
         pd_a_badge = 1 << cc.id_b
-        #pd_a.cnode.mint(pd_a_cap_idx, PD_CAPTABLE_BITS, sel4.init_cnode, pd_b.notification, 64, SEL4_RIGHTS_ALL, pd_a_badge)
-        assert pd_a_cap_idx < PD_CAP_SIZE
+        #pd_a.cnode.mint(pd_a_cap_idx, cnode_bits_by_pd[pd_a], sel4.init_cnode, pd_b.notification, 64, SEL4_RIGHTS_ALL, pd_a_badge)
+        assert pd_a_cap_idx < 1 << cnode_bits_by_pd[pd_a]
         system_invocations.append(
             Sel4CnodeMint(
                 pd_a_cnode_obj.cap_addr,
                 pd_a_cap_idx,
-                PD_CAP_BITS,
+                cnode_bits_by_pd[pd_a],
                 root_cnode_cap,
                 pd_b_notification_obj.cap_addr,
                 kernel_config.cap_address_bits,
@@ -1331,13 +2381,13 @@ def build_system(
 
         pd_b_cap_idx = BASE_OUTPUT_NOTIFICATION_CAP + cc.id_b
         pd_b_badge = 1 << cc.id_a
-        #pd_b.cnode.mint(pd_b_cap_idx, PD_CAPTABLE_BITS, sel4.init_cnode, pd_a.notification, 64, SEL4_RIGHTS_ALL, pd_b_badge)
-        assert pd_b_cap_idx < PD_CAP_SIZE
+        #pd_b.cnode.mint(pd_b_cap_idx, cnode_bits_by_pd[pd_b], sel4.init_cnode, pd_a.notification, 64, SEL4_RIGHTS_ALL, pd_b_badge)
+        assert pd_b_cap_idx < 1 << cnode_bits_by_pd[pd_b]
         system_invocations.append(
             Sel4CnodeMint(
                 pd_b_cnode_obj.cap_addr,
                 pd_b_cap_idx,
-                PD_CAP_BITS,
+                cnode_bits_by_pd[pd_b],
                 root_cnode_cap,
                 pd_a_notification_obj.cap_addr,
                 kernel_config.cap_address_bits,
@@ -1349,14 +2399,14 @@ def build_system(
         if pd_b.pp:
             pd_a_cap_idx = BASE_OUTPUT_ENDPOINT_CAP + cc.id_a
             pd_a_badge = (1 << 63) | cc.id_b
-            # pd_a.cnode.mint(pd_a_cap_idx, PD_CAPTABLE_BITS, sel4.init_cnode, pd_b.endpoint, 64, SEL4_RIGHTS_ALL, pd_a_badge)
+            # pd_a.cnode.mint(pd_a_cap_idx, cnode_bits_by_pd[pd_a], sel4.init_cnode, pd_b.endpoint, 64, SEL4_RIGHTS_ALL, pd_a_badge)
             assert pd_b_endpoint_obj is not None
-            assert pd_a_cap_idx < PD_CAP_SIZE
+            assert pd_a_cap_idx < 1 << cnode_bits_by_pd[pd_a]
             system_invocations.append(
                 Sel4CnodeMint(
                     pd_a_cnode_obj.cap_addr,
                     pd_a_cap_idx,
-                    PD_CAP_BITS,
+                    cnode_bits_by_pd[pd_a],
                     root_cnode_cap,
                     pd_b_endpoint_obj.cap_addr,
                     kernel_config.cap_address_bits,
@@ -1367,14 +2417,14 @@ def build_system(
         if pd_a.pp:
             pd_b_cap_idx = BASE_OUTPUT_ENDPOINT_CAP + cc.id_b
             pd_b_badge = (1 << 63) | cc.id_a
-            #pd_b.cnode.mint(pd_b_cap_idx, PD_CAPTABLE_BITS, sel4.init_cnode, pd_a.endpoint, 64, SEL4_RIGHTS_ALL, pd_b_badge)
+            #pd_b.cnode.mint(pd_b_cap_idx, cnode_bits_by_pd[pd_b], sel4.init_cnode, pd_a.endpoint, 64, SEL4_RIGHTS_ALL, pd_b_badge)
             assert pd_a_endpoint_obj is not None
-            assert pd_b_cap_idx < PD_CAP_SIZE
+            assert pd_b_cap_idx < 1 << cnode_bits_by_pd[pd_b]
             system_invocations.append(
                 Sel4CnodeMint(
                     pd_b_cnode_obj.cap_addr,
                     pd_b_cap_idx,
-                    PD_CAP_BITS,
+                    cnode_bits_by_pd[pd_b],
                     root_cnode_cap,
                     pd_a_endpoint_obj.cap_addr,
                     kernel_config.cap_address_bits,
@@ -1388,7 +2438,7 @@ def build_system(
             system_invocations.append(Sel4CnodeMint(
                                         cnode_obj.cap_addr, 
                                         MONITOR_EP_CAP_IDX, 
-                                        PD_CAP_BITS, 
+                                        cnode_bits_by_pd[pd], 
                                         root_cnode_cap, 
                                         fault_ep_endpoint_object.cap_addr, 
                                         kernel_config.cap_address_bits,
@@ -1404,21 +2454,25 @@ def build_system(
 
 
     # Initialise the VSpaces -- assign them all the the initial asid pool.
-    for map_cls, descriptors, objects in [
-        (Sel4PageUpperDirectoryMap, uds, ud_objects),
-        (Sel4PageDirectoryMap, ds, d_objects),
-        (Sel4PageTableMap, pts, pt_objects),
+    for map_cls, object_field, descriptors, objects in [
+        (Sel4PageUpperDirectoryMap, "page_upper_directory", uds, ud_objects),
+        (Sel4PageDirectoryMap, "page_directory", ds, d_objects),
+        (Sel4PageTableMap, "page_table", pts, pt_objects),
     ]:
-        for ((pd_idx, vaddr), obj) in zip(descriptors, objects):
-            vspace_obj = vspace_objects[pd_idx]
-            system_invocations.append(
-                map_cls(
-                    obj.cap_addr,
-                    vspace_obj.cap_addr,
-                    vaddr,
-                    SEL4_ARM_DEFAULT_VMATTRIBUTES
-                )
+        if len(objects) > 0:
+            assert_objects_adjacent(objects)
+        for first, count, step in table_map_runs(descriptors):
+            pd_idx, vaddr = descriptors[first]
+            invocation = map_cls(
+                objects[first].cap_addr,
+                vspace_objects[pd_idx].cap_addr,
+                vaddr,
+                SEL4_ARM_DEFAULT_VMATTRIBUTES
             )
+            if count > 1:
+                next_pd_idx, next_vaddr = descriptors[first + step]
+                invocation.repeat(count, **{object_field: step, "vspace": next_pd_idx - pd_idx, "vaddr": next_vaddr - vaddr})
+            system_invocations.append(invocation)
 
     # Now maps all the pages
     for page_cap_address, pd_idx, vaddr, rights, attrs, count, vaddr_incr in page_descriptors:
@@ -1461,9 +2515,9 @@ def build_system(
         system_invocations.append(Sel4TcbSetSchedParams(tcb_obj.cap_addr, INIT_TCB_CAP_ADDRESS, pd.priority, pd.priority, schedcontext_obj.cap_addr, fault_ep_endpoint_object.cap_addr))
 
     # set vspace / cspace (SetSpace)
-    invocation = Sel4TcbSetSpace(tcb_objects[0].cap_addr, badged_fault_ep, cnode_objects[0].cap_addr, kernel_config.cap_address_bits - PD_CAP_BITS, vspace_objects[0].cap_addr, 0)
-    invocation.repeat(len(system.protection_domains), tcb=1, fault_ep=1, cspace_root=1, vspace_root=1)
-    system_invocations.append(invocation)
+    # The guard skips the CPtr bits not resolved by the PD's CNode.
+    for idx, (tcb_obj, cnode_obj, bits, vspace_obj) in enumerate(zip(tcb_objects, cnode_objects, cnode_bits, vspace_objects)):
+        system_invocations.append(Sel4TcbSetSpace(tcb_obj.cap_addr, badged_fault_ep + idx, cnode_obj.cap_addr, kernel_config.cap_address_bits - bits, vspace_obj.cap_addr, 0))
 
     # set IPC buffer
     for tcb_obj, pd, ipc_buffer_obj in zip(tcb_objects, system.protection_domains, ipc_buffer_objects):
@@ -1495,10 +2549,6 @@ def build_system(
 
     # And now we are done. We have all the invocations
 
-    system_invocation_data = b''
-    for system_invocation in system_invocations:
-        system_invocation_data += system_invocation._get_raw_invocation()
-
 
     for pd in system.protection_domains:
         # Could use pd.elf_file.write_symbol here to update variables if required.
@@ -1513,7 +2563,7 @@ def build_system(
                         break
                 else:
                     raise Exception(f"can't find region: {setvar.region_paddr}")
-                value = mr_pages[mr][0].phys_addr
+                value = mr_pages[all_mr_by_name[mr.name]][0].phys_addr
             elif setvar.vaddr is not None:
                 value = setvar.vaddr
             try:
@@ -1523,7 +2573,7 @@ def build_system(
 
     return BuiltSystem(
         number_of_system_caps = final_cap_slot, #init_system._cap_slot,
-        invocation_data_size = len(system_invocation_data),
+        invocation_data_size = system_invocations.compact_encoded_size if compress_invocations else system_invocations.encoded_size,
         bootstrap_invocations = bootstrap_invocations,
         system_invocations = system_invocations,
         kernel_boot_info = kernel_boot_info,
@@ -1538,6 +2588,12 @@ def build_system(
         kernel_objects = init_system._objects,
         initial_task_phys_region = initial_task_phys_region,
         initial_task_virt_region = initial_task_virt_region,
+        untyped_allocators = kao.untyped,
+        padding = init_system.padding,
+        invocation_table_vaddr = invocation_table_vaddr,
+        root_cnode_cap_address = root_cnode_cap,
+        demand_maps = demand_maps,
+        placement = placement,
     )
 
 
@@ -1569,6 +2625,13 @@ def main() -> int:
     parser.add_argument("--board", required=True, choices=available_boards)
     parser.add_argument("--config", required=True)
     parser.add_argument("--search-path", nargs='*', type=Path)
+    parser.add_argument("--compress-invocations", action="store_true")
+    parser.add_argument("--replay", action="store_true")
+    parser.add_argument("--placement-policy", choices=[policy.value for policy in AllocationPolicy], default=AllocationPolicy.FIRST_FIT.value)
+    parser.add_argument("--kernel-object-policy", choices=[AllocationPolicy.FIRST_FIT.value, AllocationPolicy.BEST_FIT.value], default=AllocationPolicy.FIRST_FIT.value)
+    parser.add_argument("--optimise-layout", action="store_true")
+    parser.add_argument("--compare-placement", action="store_true")
+    parser.add_argument("--large-pages", action="store_true")
     args = parser.parse_args()
 
     board_path = boards_path / args.board
@@ -1637,6 +2700,11 @@ def main() -> int:
             invocation_table_size,
             system_cnode_size,
             search_paths,
+            args.compress_invocations,
+            AllocationPolicy(args.placement_policy),
+            AllocationPolicy(args.kernel_object_policy),
+            args.optimise_layout,
+            args.large_pages,
         )
         print(f"BUILT: {system_cnode_size=} {built_system.number_of_system_caps=} {invocation_table_size=} {built_system.invocation_data_size=}")
         if (built_system.number_of_system_caps <= system_cnode_size and
@@ -1645,7 +2713,7 @@ def main() -> int:
 
         # Recalculate the sizes for the next iteration
         new_invocation_table_size = round_up(built_system.invocation_data_size, kernel_config.minimum_page_size)
-        new_system_cnode_size = 2 ** int(ceil(log2(built_system.number_of_system_caps)))
+        new_system_cnode_size = system_cnode_slots(built_system.number_of_system_caps)
 
         invocation_table_size = max(invocation_table_size, new_invocation_table_size)
         system_cnode_size = max(system_cnode_size, new_system_cnode_size)
@@ -1677,9 +2745,7 @@ def main() -> int:
 
     _, bootstrap_invocation_data_size = monitor_elf.find_symbol(MONITOR_CONFIG.bootstrap_invocation_data_symbol_name)
 
-    bootstrap_invocation_data = b''
-    for bootstrap_invocation in built_system.bootstrap_invocations:
-        bootstrap_invocation_data += bootstrap_invocation._get_raw_invocation()
+    bootstrap_invocation_data = built_system.bootstrap_invocations.encode()
 
     if len(bootstrap_invocation_data) > bootstrap_invocation_data_size:
         print("INTERNAL ERROR: bootstrap invocations too large", file=stderr)
@@ -1694,13 +2760,52 @@ def main() -> int:
     monitor_elf.write_symbol(MONITOR_CONFIG.system_invocation_count_symbol_name, pack("<Q", len(built_system.system_invocations)))
     monitor_elf.write_symbol(MONITOR_CONFIG.bootstrap_invocation_data_symbol_name, bootstrap_invocation_data)
 
-    system_invocation_data = b''
-    for system_invocation in built_system.system_invocations:
-        system_invocation_data += system_invocation._get_raw_invocation()
+    if args.compress_invocations:
+        system_invocation_encoding = INVOCATION_ENCODING_VARINT
+        system_invocation_data = built_system.system_invocations.encode_compact()
+    else:
+        system_invocation_encoding = INVOCATION_ENCODING_RAW
+        system_invocation_data = built_system.system_invocations.encode()
+    monitor_elf.write_symbol(MONITOR_CONFIG.system_invocation_encoding_symbol_name, pack("<Q", system_invocation_encoding))
+    monitor_elf.write_symbol(MONITOR_CONFIG.system_invocation_data_symbol_name, pack("<Q", built_system.invocation_table_vaddr))
+
+    # Optionally check the invocations by replaying them (as the monitor
+    # will decode them) against a model of the kernel.
+    replay_result: Optional[ReplayResult] = None
+    if args.replay:
+        replay = MonitorReplay(kernel_config, built_system.kernel_boot_info, built_system.initial_task_virt_region)
+        try:
+            replay_result = replay.replay(
+                bootstrap_invocation_data,
+                len(built_system.bootstrap_invocations),
+                system_invocation_data,
+                len(built_system.system_invocations),
+                system_invocation_encoding,
+            )
+        except ReplayError as e:
+            print(f"INTERNAL ERROR: replay failed: {e}", file=stderr)
+            raise UserError("replay of monitor invocations failed")
 
     regions: List[Tuple[int, Union[bytes, bytearray]]] = [(built_system.reserved_region.base, system_invocation_data)]
     regions += [(r.addr, r.data) for r in built_system.regions]
 
+    # Estimate the time taken by the loader and monitor to boot the system
+    loader_region_sizes = [len(segment.data) for segment in kernel_elf.segments if segment.loadable]
+    loader_region_sizes += [len(segment.data) for segment in monitor_elf.segments]
+    loader_region_sizes += [len(data) for _, data in regions]
+    boot_cost = estimate_boot_cost(
+        board_calibration(args.board),
+        bootstrap_invocation_data,
+        len(built_system.bootstrap_invocations),
+        system_invocation_data,
+        len(built_system.system_invocations),
+        built_system.cap_lookup,
+        kernel_config.cap_address_bits,
+        {ut.cap for ut in built_system.kernel_boot_info.untyped_objects if ut.is_device},
+        loader_region_sizes,
+        system_invocation_encoding,
+    )
+
     tcb_caps = built_system.tcb_caps
     sched_caps = built_system.sched_caps
     ntfn_caps = built_system.ntfn_caps
@@ -1715,6 +2820,13 @@ def main() -> int:
         names_array[idx * 16:idx * 16+len(nm)] = nm
     monitor_elf.write_symbol("pd_names", names_array)
 
+    _, demand_map_info_size = monitor_elf.find_symbol(MONITOR_CONFIG.demand_map_info_symbol_name)
+    max_demand_maps = MONITOR_CONFIG.max_demand_maps(demand_map_info_size)
+    if len(built_system.demand_maps) > max_demand_maps:
+        raise UserError(f"Too many demand maps: monitor ({monitor_elf_path}) supports {max_demand_maps:,d} maps. System has {len(built_system.demand_maps):,d} maps.")
+    demand_map_info_data = pack_demand_maps(built_system.demand_maps, built_system.root_cnode_cap_address, kernel_config.cap_address_bits)
+    monitor_elf.write_symbol(MONITOR_CONFIG.demand_map_info_symbol_name, demand_map_info_data)
+
 
     # B: The loader
 
@@ -1723,6 +2835,22 @@ def main() -> int:
     # physical memory
     cap_lookup = built_system.cap_lookup
 
+    # Comparing the placement policies emulates the kernel boot for
+    # each of them, so is only done on request.
+    placements: List[Tuple[str, Optional[PlacementResult]]] = []
+    if args.compare_placement:
+        placements += [(policy.value, placement) for policy, placement in zip(AllocationPolicy, compare_placement_policies(
+            kernel_config,
+            kernel_elf,
+            built_system.reserved_region.size,
+            built_system.initial_task_virt_region,
+            invocation_table_alignment(invocation_table_size),
+        ))]
+    if args.optimise_layout:
+        placements.append(("optimised", built_system.placement))
+    elif not args.compare_placement:
+        placements.append((args.placement_policy, built_system.placement))
+
     # Reporting
     with args.report.open("w") as f:
         f.write("# Kernel Boot Info\n\n")
@@ -1739,16 +2867,75 @@ def main() -> int:
         f.write(f"     virtual memory : {built_system.initial_task_virt_region}\n")
         f.write(f"     physical memory: {built_system.initial_task_phys_region}\n")
         f.write("\n")
+        f.write("# Memory Placement\n\n")
+        f.write(f"     policy             : {'optimised' if args.optimise_layout else args.placement_policy}\n")
+        f.write("\n")
+        f.write(f"     {'policy':12s} {'reserved base':>14s} {'initial task':>14s} {'untyped':>8s} {'largest untyped':>16s} {'free regions':>13s} {'largest free':>14s}\n")
+        for name, placement in placements:
+            if placement is None:
+                f.write(f"     {name:12s} unable to place\n")
+                continue
+            f.write(f"     {name:12s} {placement.reserved_region.base:14x} {placement.initial_task_phys_region.base:14x} "
+                    f"{placement.untyped_count:8,d} {placement.largest_untyped:16,d} {placement.fragmentation.regions:13,d} "
+                    f"{placement.fragmentation.largest_region:14,d}\n")
+        f.write("\n")
         f.write("# Allocated Kernel Objects Summary\n\n")
         f.write(f"     # of allocated objects: {len(built_system.kernel_objects):,d}\n")
         f.write("\n")
+        f.write("# Kernel Object Untyped Usage\n\n")
+        f.write(f"     policy             : {args.kernel_object_policy}\n")
+        f.write(f"     alignment waste    : {sum(allocator.alignment_waste for allocator in built_system.untyped_allocators):,d} bytes\n")
+        f.write("\n")
+        for allocator in built_system.untyped_allocators:
+            if allocator.allocations:
+                f.write(f"     cap=0x{allocator.untyped_object.cap:x} {allocator.untyped_object.region} used={allocator.allocation_point:,d} free={allocator.free:,d} waste={allocator.alignment_waste:,d}\n")
+        f.write("\n")
+        f.write("# Device Untyped Padding\n\n")
+        for strategy in (PADDING_GREEDY, PADDING_FIXED, PADDING_HYBRID):
+            chosen = [padding for padding in built_system.padding if padding.strategy == strategy]
+            f.write(f"     {strategy:19s}: {len(chosen):6,d} gaps {sum(p.invocations for p in chosen):6,d} invocations {sum(p.caps for p in chosen):6,d} caps\n")
+        f.write("\n")
+        for padding in built_system.padding:
+            f.write(f"     0x{padding.base:x}-0x{padding.base + padding.size:x} {padding.strategy} invocations={padding.invocations} caps={padding.caps}\n")
+        f.write("\n")
         f.write("# Bootstrap Kernel Invocations Summary\n\n")
         f.write(f"     # of invocations   : {len(built_system.bootstrap_invocations):10,d}\n")
+        f.write(f"     # of system calls  : {built_system.bootstrap_invocations.call_count:10,d}\n")
         f.write(f"     size of invocations: {len(bootstrap_invocation_data):10,d}\n")
         f.write("\n")
         f.write("# System Kernel Invocations Summary\n\n")
         f.write(f"     # of invocations   : {len(built_system.system_invocations):10,d}\n")
+        f.write(f"     # of system calls  : {built_system.system_invocations.call_count:10,d}\n")
         f.write(f"     size of invocations: {len(system_invocation_data):10,d}\n")
+        if args.compress_invocations:
+            raw_size = built_system.system_invocations.encoded_size
+            f.write(f"     uncompressed size  : {raw_size:10,d}\n")
+            f.write(f"     compression ratio  : {raw_size / len(system_invocation_data):10.2f}\n")
+        f.write("\n")
+        if replay_result is not None:
+            f.write("# Replay Summary\n\n")
+            f.write(f"     # of system calls  : {replay_result.total_calls:10,d}\n")
+            f.write(f"     bytes retyped      : {replay_result.bytes_retyped:10,d}\n")
+            for object_type, count in sorted(replay_result.objects_created.items()):
+                f.write(f"     {SEL4_OBJECT_TYPE_NAMES[object_type]:38s}: {count:10,d}\n")
+            for phase, calls in (("bootstrap", replay_result.bootstrap_calls), ("system", replay_result.system_calls)):
+                for label, count in sorted(calls.items()):
+                    f.write(f"     {phase:9s} {label.name:28s}: {count:10,d}\n")
+            f.write("\n")
+        f.write("# Estimated Boot Cost\n\n")
+        f.write(f"     board calibration  : {args.board if args.board in BOARD_CALIBRATION else 'default'}\n")
+        f.write(f"     loader copy        : {boot_cost.loader_cost / 1000:12,.1f} us ({boot_cost.loader_bytes:,d} bytes)\n")
+        for phase in PHASES:
+            f.write(f"     {phase:19s}: {boot_cost.phase_costs[phase] / 1000:12,.1f} us ({boot_cost.phase_calls[phase]:,d} calls)\n")
+        f.write(f"     memory zeroed      : {boot_cost.zeroed_bytes:15,d} bytes\n")
+        f.write(f"     total              : {boot_cost.total_cost / 1000:12,.1f} us\n")
+        f.write("\n")
+        f.write("     Top protection domains:\n")
+        for name, cost in boot_cost.top_pds(10):
+            f.write(f"         {name:40s} {cost / 1000:12,.1f} us\n")
+        f.write("     Top memory regions:\n")
+        for name, cost in boot_cost.top_mrs(10):
+            f.write(f"         {name:40s} {cost / 1000:12,.1f} us\n")
         f.write("\n")
         f.write("# Allocated Kernel Objects Detail\n\n")
         for ko in built_system.kernel_objects:
@@ -0,0 +1,157 @@
+#
+# Copyright 2021, Breakaway Consulting Pty. Ltd.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+"""Micro-benchmark for invocation encoding throughput.
+
+Builds synthetic invocation streams for every Sel4Invocation subclass,
+with and without repeats, and measures the time taken to build and
+encode the invocation table, the encoding throughput and the peak
+memory used.
+
+Only the standard library is used, so this can be run on any host:
+
+    python -m sel4coreplat.benchmark --output results.json
+
+Results are written as JSON so that runs can be compared.
+"""
+import json
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from time import perf_counter
+
+from typing import List, Optional, Type, Union
+
+from sel4coreplat.sel4 import Sel4Aarch64Regs, Sel4Invocation, Sel4InvocationTable
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000, 1_000_000)
+DEFAULT_REPEAT_COUNT = 64
+
+
+def invocation_classes() -> List[Type[Sel4Invocation]]:
+    return sorted(Sel4Invocation.__subclasses__(), key=lambda cls: cls.__name__)
+
+
+def synthetic_invocation(cls: Type[Sel4Invocation], idx: int) -> Sel4Invocation:
+    """Create an invocation with plausible field values.
+
+    The first field (the service cap) varies with 'idx' so that
+    consecutive invocations are distinct.
+    """
+    values: List[Union[int, Sel4Aarch64Regs]] = []
+    for field_idx, f in enumerate(fields(cls)):
+        if f.type is bool:
+            values.append(True)
+        elif f.type is Sel4Aarch64Regs:
+            values.append(Sel4Aarch64Regs(pc=0x200000 + idx, sp=0x1000_0000, x0=idx))
+        elif field_idx == 0:
+            values.append((1 << 63) | (0x100 + idx))
+        else:
+            values.append(field_idx)
+    return cls(*values)
+
+
+def _build(cls: Type[Sel4Invocation], calls: int, repeat_count: Optional[int]) -> Sel4InvocationTable:
+    table = Sel4InvocationTable()
+    if repeat_count is None:
+        for idx in range(calls):
+            table.append(synthetic_invocation(cls, idx))
+    else:
+        service = cls._word_names()[0]
+        for idx in range(0, calls, repeat_count):
+            invocation = synthetic_invocation(cls, idx)
+            invocation.repeat(min(repeat_count, calls - idx), **{service: 1})
+            table.append(invocation)
+    return table
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    invocation: str
+    repeat: bool
+    calls: int
+    invocations: int
+    bytes: int
+    build_seconds: float
+    encode_seconds: float
+    bytes_per_second: Optional[float]
+    compact_encode_seconds: float
+    peak_memory_bytes: int
+
+
+def run_benchmark(cls: Type[Sel4Invocation], calls: int, repeat_count: Optional[int]) -> BenchmarkResult:
+    start = perf_counter()
+    table = _build(cls, calls, repeat_count)
+    build_seconds = perf_counter() - start
+
+    start = perf_counter()
+    data = table.encode()
+    encode_seconds = perf_counter() - start
+
+    start = perf_counter()
+    compact_data = table.encode_compact()
+    compact_encode_seconds = perf_counter() - start
+    del table, data, compact_data
+
+    # Peak memory is measured in a separate run as tracing
+    # allocations significantly slows down the build.
+    tracemalloc.start()
+    try:
+        table = _build(cls, calls, repeat_count)
+        data = table.encode()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(
+        invocation=cls.__name__,
+        repeat=repeat_count is not None,
+        calls=calls,
+        invocations=len(table),
+        bytes=len(data),
+        build_seconds=build_seconds,
+        encode_seconds=encode_seconds,
+        bytes_per_second=len(data) / encode_seconds if encode_seconds > 0 else None,
+        compact_encode_seconds=compact_encode_seconds,
+        peak_memory_bytes=peak_memory,
+    )
+
+
+def main() -> int:
+    parser = ArgumentParser("sel4coreplat.benchmark")
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--scales", nargs='*', type=int, default=list(DEFAULT_SCALES))
+    parser.add_argument("--repeat-count", type=int, default=DEFAULT_REPEAT_COUNT)
+    parser.add_argument("--invocation", nargs='*', choices=[cls.__name__ for cls in invocation_classes()])
+    args = parser.parse_args()
+
+    classes = [cls for cls in invocation_classes() if args.invocation is None or cls.__name__ in args.invocation]
+
+    results = []
+    for calls in args.scales:
+        for cls in classes:
+            for repeat_count in (None, args.repeat_count):
+                result = run_benchmark(cls, calls, repeat_count)
+                results.append(result)
+                print(f"{result.invocation:35s} {'repeat' if result.repeat else 'single':6s} {calls:10,d} calls "
+                      f"{result.build_seconds:8.3f}s build {result.encode_seconds:8.3f}s encode "
+                      f"{result.bytes:12,d} bytes {result.peak_memory_bytes:14,d} peak")
+
+    with args.output.open("w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "repeat_count": args.repeat_count,
+            "results": [asdict(result) for result in results],
+        }, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
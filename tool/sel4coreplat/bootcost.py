@@ -0,0 +1,240 @@
+#
+# Copyright 2021, Breakaway Consulting Pty. Ltd.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+"""Estimate the boot time cost of a generated system.
+
+The estimate is made from the invocations the monitor performs and the
+regions the loader copies into place. A repeated invocation is costed
+once and multiplied by its repeat count. It is attributed to the PD and
+memory region named by its first call, unless its last call names a
+different one (e.g. a run of page table maps that crosses PDs), in which
+case each call is attributed separately. Each invocation label has a per-call cost; untyped retypes
+additionally pay a per-byte cost for zeroing the memory of the created
+objects (the kernel does not zero device memory, or memory retyped
+into untyped objects).
+
+The costs come from a small per-board calibration table. The values are
+estimates: they are useful for comparing system descriptions (e.g. 4KiB
+versus 2MiB pages for a large memory region) rather than for predicting
+an exact boot time.
+"""
+import re
+from dataclasses import dataclass, field
+
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sel4coreplat.sel4 import Sel4Label, INVOCATION_ENCODING_RAW, SEL4_UNTYPED_OBJECT
+from sel4coreplat.replay import InvocationCall, InvocationRecord, decode_records, invocation_words, retype_object_size
+
+PHASE_BOOTSTRAP = "bootstrap"
+PHASE_RETYPE = "retype"
+PHASE_MINT = "mint"
+PHASE_MAP = "map"
+PHASE_TCB = "tcb setup"
+PHASE_OTHER = "other"
+
+PHASES = (PHASE_BOOTSTRAP, PHASE_RETYPE, PHASE_MINT, PHASE_MAP, PHASE_TCB, PHASE_OTHER)
+
+_LABEL_PHASES = {
+    Sel4Label.UntypedRetype: PHASE_RETYPE,
+    Sel4Label.CNodeCopy: PHASE_MINT,
+    Sel4Label.CNodeMint: PHASE_MINT,
+    Sel4Label.CNodeMutate: PHASE_MINT,
+    Sel4Label.ARMASIDPoolAssign: PHASE_MAP,
+    Sel4Label.ARMPageUpperDirectoryMap: PHASE_MAP,
+    Sel4Label.ARMPageDirectoryMap: PHASE_MAP,
+    Sel4Label.ARMPageTableMap: PHASE_MAP,
+    Sel4Label.ARMPageMap: PHASE_MAP,
+    Sel4Label.TCBSetSchedParams: PHASE_TCB,
+    Sel4Label.TCBSetSpace: PHASE_TCB,
+    Sel4Label.TCBSetIPCBuffer: PHASE_TCB,
+    Sel4Label.TCBResume: PHASE_TCB,
+    Sel4Label.TCBWriteRegisters: PHASE_TCB,
+    Sel4Label.TCBBindNotification: PHASE_TCB,
+    Sel4Label.SchedControlConfigureFlags: PHASE_TCB,
+}
+
+# Words of an untyped retype (service, then the object type, size bits
+# and number of objects) that determine how much memory is zeroed
+_RETYPE_SIZE_WORDS = (0, 2, 3, 7)
+
+_PD_RE = re.compile(r"PD=(\S+)")
+_MR_RE = re.compile(r"MR=(\S+)")
+
+
+@dataclass(frozen=True)
+class CostCalibration:
+    """Costs (in nanoseconds) used for the boot cost estimate."""
+    default_call_cost: float
+    call_costs: Dict[Sel4Label, float]
+    zero_cost_per_byte: float
+    copy_cost_per_byte: float
+
+    def call_cost(self, label: Sel4Label) -> float:
+        return self.call_costs.get(label, self.default_call_cost)
+
+
+# Calibration for a generic Cortex-A53 class core. Boards without an
+# entry in the table below use this calibration.
+DEFAULT_CALIBRATION = CostCalibration(
+    default_call_cost=1000,
+    call_costs={
+        Sel4Label.UntypedRetype: 2500,
+        Sel4Label.CNodeCopy: 700,
+        Sel4Label.CNodeMint: 700,
+        Sel4Label.CNodeMutate: 700,
+        Sel4Label.ARMASIDPoolAssign: 1500,
+        Sel4Label.ARMPageUpperDirectoryMap: 1800,
+        Sel4Label.ARMPageDirectoryMap: 1800,
+        Sel4Label.ARMPageTableMap: 1800,
+        Sel4Label.ARMPageMap: 1500,
+        Sel4Label.TCBWriteRegisters: 1500,
+    },
+    zero_cost_per_byte=0.25,
+    copy_cost_per_byte=0.5,
+)
+
+BOARD_CALIBRATION = {
+    # Cortex-A35 @ 1.2GHz
+    "tqma8xqp1gb": CostCalibration(
+        default_call_cost=1400,
+        call_costs={
+            Sel4Label.UntypedRetype: 3500,
+            Sel4Label.CNodeCopy: 1000,
+            Sel4Label.CNodeMint: 1000,
+            Sel4Label.CNodeMutate: 1000,
+            Sel4Label.ARMASIDPoolAssign: 2000,
+            Sel4Label.ARMPageUpperDirectoryMap: 2500,
+            Sel4Label.ARMPageDirectoryMap: 2500,
+            Sel4Label.ARMPageTableMap: 2500,
+            Sel4Label.ARMPageMap: 2100,
+            Sel4Label.TCBWriteRegisters: 2100,
+        },
+        zero_cost_per_byte=0.4,
+        copy_cost_per_byte=0.8,
+    ),
+    # Cortex-A53 @ 1.2GHz
+    "zcu102": DEFAULT_CALIBRATION,
+}
+
+
+def board_calibration(board: str) -> CostCalibration:
+    return BOARD_CALIBRATION.get(board, DEFAULT_CALIBRATION)
+
+
+@dataclass
+class BootCostEstimate:
+    """Estimated boot cost in nanoseconds."""
+    phase_costs: Dict[str, float] = field(default_factory=lambda: {phase: 0.0 for phase in PHASES})
+    phase_calls: Dict[str, int] = field(default_factory=lambda: {phase: 0 for phase in PHASES})
+    zeroed_bytes: int = 0
+    loader_bytes: int = 0
+    loader_cost: float = 0.0
+    pd_costs: Dict[str, float] = field(default_factory=dict)
+    mr_costs: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def monitor_cost(self) -> float:
+        return sum(self.phase_costs.values())
+
+    @property
+    def total_cost(self) -> float:
+        return self.monitor_cost + self.loader_cost
+
+    def top_pds(self, n: int) -> List[Tuple[str, float]]:
+        return sorted(self.pd_costs.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    def top_mrs(self, n: int) -> List[Tuple[str, float]]:
+        return sorted(self.mr_costs.items(), key=lambda x: x[1], reverse=True)[:n]
+
+
+def _call_names(call: InvocationCall, cap_lookup: Dict[int, str], cap_address_bits: int) -> Iterable[str]:
+    """Return the names of the objects involved in a system call."""
+    yield cap_lookup.get(call.service, "")
+    for cap in call.caps:
+        yield cap_lookup.get(cap, "")
+    if call.label == Sel4Label.UntypedRetype:
+        # Created objects are named by the cap address of the first slot
+        # they are created in: the CNode at node_index (resolved to
+        # node_depth bits), slot node_offset
+        _, _, node_index, node_depth, node_offset, _ = call.mrs
+        yield cap_lookup.get((node_index << (cap_address_bits - node_depth)) | node_offset, "")
+    elif call.label in (Sel4Label.CNodeCopy, Sel4Label.CNodeMint, Sel4Label.CNodeMutate):
+        yield cap_lookup.get(call.mrs[2], "")
+
+
+def estimate_boot_cost(
+        calibration: CostCalibration,
+        bootstrap_data: bytes,
+        bootstrap_count: int,
+        system_data: bytes,
+        system_count: int,
+        cap_lookup: Dict[int, str],
+        cap_address_bits: int,
+        device_untyped_caps: Set[int],
+        loader_region_sizes: Sequence[int],
+        system_encoding: int = INVOCATION_ENCODING_RAW,
+    ) -> BootCostEstimate:
+    estimate = BootCostEstimate()
+
+    def zeroed_bytes(call: InvocationCall) -> int:
+        if call.label != Sel4Label.UntypedRetype or call.service in device_untyped_caps:
+            return 0
+        object_type, size_bits, _, _, _, num_objects = call.mrs
+        if object_type == SEL4_UNTYPED_OBJECT:
+            return 0
+        return retype_object_size(object_type, size_bits) * num_objects
+
+    def add_record(phase: str, record: InvocationRecord, call: InvocationCall) -> float:
+        if record.label != Sel4Label.UntypedRetype:
+            zeroed = 0
+        elif all(record.incr[i] == 0 for i in _RETYPE_SIZE_WORDS):
+            zeroed = zeroed_bytes(call) * record.iterations
+        else:
+            zeroed = sum(zeroed_bytes(record.call(i)) for i in range(record.iterations))
+        cost = calibration.call_cost(record.label) * record.iterations + zeroed * calibration.zero_cost_per_byte
+        estimate.zeroed_bytes += zeroed
+        estimate.phase_costs[phase] += cost
+        estimate.phase_calls[phase] += record.iterations
+        return cost
+
+    def call_owners(call: InvocationCall) -> Tuple[Optional[str], Optional[str]]:
+        pd: Optional[str] = None
+        mr: Optional[str] = None
+        for name in _call_names(call, cap_lookup, cap_address_bits):
+            if pd is None:
+                m = _PD_RE.search(name)
+                pd = m.group(1) if m else None
+            if mr is None:
+                m = _MR_RE.search(name)
+                mr = m.group(1) if m else None
+        return pd, mr
+
+    def add_owner_cost(owners: Tuple[Optional[str], Optional[str]], cost: float) -> None:
+        pd, mr = owners
+        if pd is not None:
+            estimate.pd_costs[pd] = estimate.pd_costs.get(pd, 0.0) + cost
+        if mr is not None:
+            estimate.mr_costs[mr] = estimate.mr_costs.get(mr, 0.0) + cost
+
+    for record in decode_records(invocation_words(bootstrap_data), bootstrap_count):
+        add_record(PHASE_BOOTSTRAP, record, record.call(0))
+
+    for record in decode_records(invocation_words(system_data, system_encoding), system_count):
+        call = record.call(0)
+        cost = add_record(_LABEL_PHASES.get(record.label, PHASE_OTHER), record, call)
+        owners = call_owners(call)
+        if record.iterations == 1 or call_owners(record.call(record.iterations - 1)) == owners:
+            add_owner_cost(owners, cost)
+        else:
+            for i in range(record.iterations):
+                iteration_call = record.call(i)
+                iteration_cost = calibration.call_cost(record.label) + zeroed_bytes(iteration_call) * calibration.zero_cost_per_byte
+                add_owner_cost(call_owners(iteration_call), iteration_cost)
+
+    estimate.loader_bytes = sum(loader_region_sizes)
+    estimate.loader_cost = estimate.loader_bytes * calibration.copy_cost_per_byte
+
+    return estimate
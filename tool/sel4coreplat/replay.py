@@ -0,0 +1,584 @@
+#
+# Copyright 2021, Breakaway Consulting Pty. Ltd.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+"""Host-side replay of the monitor's invocation tables.
+
+The monitor executes the bootstrap and system invocation tables by
+decoding each entry (see `perform_invocation` in `monitor/src/main.c`)
+and making the corresponding seL4 system call.
+
+This module decodes the tables in exactly the same way, expanding
+repeated invocations, and replays each call against a simple model of
+the kernel: a CSpace (with guarded CNodes), untyped objects (with the
+kernel's aligned bump allocation), VSpaces and the objects that are
+created along the way.
+
+The model is deliberately simple; it checks what matters for catching
+encoding and allocation errors (caps exist and have the right type,
+destination slots are empty, untyped objects have space, paging
+structures are present before mapping) rather than modelling every
+kernel check.
+"""
+from array import array
+from dataclasses import dataclass
+from sys import byteorder
+
+from typing import Dict, Iterator, Optional, Sequence, Set, Tuple
+
+from sel4coreplat.util import MemoryRegion
+from sel4coreplat.sel4 import (
+    Sel4Label,
+    KernelConfig,
+    KernelBootInfo,
+    FIXED_OBJECT_SIZES,
+    INVOCATION_ENCODING_RAW,
+    INVOCATION_ENCODING_VARINT,
+    SLOT_BITS,
+    SEL4_UNTYPED_OBJECT,
+    SEL4_TCB_OBJECT,
+    SEL4_ENDPOINT_OBJECT,
+    SEL4_NOTIFICATION_OBJECT,
+    SEL4_CNODE_OBJECT,
+    SEL4_SCHEDCONTEXT_OBJECT,
+    SEL4_HUGE_PAGE_OBJECT,
+    SEL4_PAGE_UPPER_DIRECTORY_OBJECT,
+    SEL4_VSPACE_OBJECT,
+    SEL4_SMALL_PAGE_OBJECT,
+    SEL4_LARGE_PAGE_OBJECT,
+    SEL4_PAGE_TABLE_OBJECT,
+    SEL4_PAGE_DIRECTORY_OBJECT,
+    SEL4_RIGHTS_ALL,
+    INIT_TCB_CAP_ADDRESS,
+    INIT_CNODE_CAP_ADDRESS,
+    INIT_VSPACE_CAP_ADDRESS,
+    IRQ_CONTROL_CAP_ADDRESS,
+    INIT_ASID_POOL_CAP_ADDRESS,
+    varint_decode_invocations,
+)
+
+# Pseudo object types for caps that don't refer to retypable objects
+_IRQ_CONTROL = -1
+_IRQ_HANDLER = -2
+_ASID_POOL = -3
+_SCHED_CONTROL = -4
+_OTHER = -5
+
+_WORD_BITS = 64
+_WORD_MASK = (1 << _WORD_BITS) - 1
+
+# Bit position of the index for each level of the AArch64 page table
+_PUD_SHIFT = 39
+_PD_SHIFT = 30
+_PT_SHIFT = 21
+_PAGE_SHIFT = 12
+
+_FRAME_SHIFTS = {
+    SEL4_SMALL_PAGE_OBJECT: _PAGE_SHIFT,
+    SEL4_LARGE_PAGE_OBJECT: _PT_SHIFT,
+    SEL4_HUGE_PAGE_OBJECT: _PD_SHIFT,
+}
+
+
+class ReplayError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class InvocationCall:
+    """A single system call made by the monitor.
+
+    'index' is the index of the invocation in its table, and 'iteration'
+    is the iteration within a repeated invocation.
+    """
+    index: int
+    iteration: int
+    label: Sel4Label
+    service: int
+    caps: Tuple[int, ...]
+    mrs: Tuple[int, ...]
+
+
+def invocation_words(data: bytes, encoding: int = INVOCATION_ENCODING_RAW) -> "array[int]":
+    """Convert encoded invocation data to an array of words."""
+    if encoding == INVOCATION_ENCODING_VARINT:
+        return varint_decode_invocations(data)
+    if encoding != INVOCATION_ENCODING_RAW:
+        raise ValueError(f"Unknown invocation encoding: {encoding}")
+    if len(data) % 8 != 0:
+        raise ReplayError("invocation data is not a whole number of words")
+    words = array("Q")
+    words.frombytes(data)
+    if byteorder != "little":
+        words.byteswap()
+    return words
+
+
+@dataclass(frozen=True)
+class InvocationRecord:
+    """A (possibly repeated) invocation in an invocation table.
+
+    'base' holds the service, caps and message registers of the first
+    iteration, and 'incr' the amount each is incremented by for every
+    subsequent iteration.
+    """
+    index: int
+    iterations: int
+    label: Sel4Label
+    cap_count: int
+    base: Tuple[int, ...]
+    incr: Tuple[int, ...]
+
+    def call(self, iteration: int) -> InvocationCall:
+        values = tuple((b + d * iteration) & _WORD_MASK for b, d in zip(self.base, self.incr))
+        return InvocationCall(self.index, iteration, self.label, values[0], values[1:1 + self.cap_count], values[1 + self.cap_count:])
+
+
+def decode_records(words: Sequence[int], count: int) -> Iterator[InvocationRecord]:
+    """Decode 'count' invocations, without expanding repeated invocations."""
+    offset = 0
+    for idx in range(count):
+        if offset >= len(words):
+            raise ReplayError(f"invocation {idx}: data truncated")
+        cmd = words[offset]
+        iterations = (cmd >> 32) + 1
+        tag = cmd & 0xffff_ffff
+        cap_count = (tag >> 7) & 0x3
+        mr_count = tag & 0x7f
+        if (tag >> 9) & 0x7 != 0:
+            raise ReplayError(f"invocation {idx}: kernel invocation should never have unwrapped caps")
+        try:
+            label = Sel4Label(tag >> 12)
+        except ValueError:
+            raise ReplayError(f"invocation {idx}: invalid label {tag >> 12}")
+
+        width = 1 + cap_count + mr_count
+        base = tuple(words[offset + 1:offset + 1 + width])
+        if iterations > 1:
+            incr = tuple(words[offset + 1 + width:offset + 1 + 2 * width])
+            next_offset = offset + 1 + 2 * width
+        else:
+            incr = (0, ) * width
+            next_offset = offset + 1 + width
+        if next_offset > len(words):
+            raise ReplayError(f"invocation {idx}: data truncated")
+
+        yield InvocationRecord(idx, iterations, label, cap_count, base, incr)
+        offset = next_offset
+
+
+def decode_invocations(words: Sequence[int], count: int) -> Iterator[InvocationCall]:
+    """Decode (and expand) 'count' invocations, as perform_invocation does."""
+    for record in decode_records(words, count):
+        for i in range(record.iterations):
+            yield record.call(i)
+
+
+class _Object:
+    def __init__(self, object_type: int, paddr: int = 0) -> None:
+        self.object_type = object_type
+        self.paddr = paddr
+
+
+class _CNode(_Object):
+    def __init__(self, radix_bits: int, paddr: int = 0) -> None:
+        super().__init__(SEL4_CNODE_OBJECT, paddr)
+        self.radix_bits = radix_bits
+        self.slots: Dict[int, "_Cap"] = {}
+
+
+class _Untyped(_Object):
+    def __init__(self, paddr: int, size_bits: int, is_device: bool) -> None:
+        super().__init__(SEL4_UNTYPED_OBJECT, paddr)
+        self.size_bits = size_bits
+        self.is_device = is_device
+        self.free_index = 0
+
+
+class _VSpace(_Object):
+    def __init__(self, paddr: int = 0) -> None:
+        super().__init__(SEL4_VSPACE_OBJECT, paddr)
+        self.asid_assigned = False
+        # Paging structures present, keyed by the shift of the level
+        # they cover (e.g. a page table covers 1 << _PT_SHIFT bytes)
+        self.tables: Dict[int, Set[int]] = {_PUD_SHIFT: set(), _PD_SHIFT: set(), _PT_SHIFT: set()}
+        # Frames mapped, keyed by the shift of the frame size
+        self.frames: Dict[int, Set[int]] = {shift: set() for shift in _FRAME_SHIFTS.values()}
+
+
+class _PagingObject(_Object):
+    def __init__(self, object_type: int, paddr: int = 0) -> None:
+        super().__init__(object_type, paddr)
+        self.mapped = False
+
+
+class _IrqHandler(_Object):
+    def __init__(self, irq: int) -> None:
+        super().__init__(_IRQ_HANDLER)
+        self.irq = irq
+
+
+@dataclass
+class _Cap:
+    obj: _Object
+    rights: int = SEL4_RIGHTS_ALL
+    badge: int = 0
+    guard: int = 0
+    guard_bits: int = 0
+    mapped: bool = False
+
+
+@dataclass
+class ReplayResult:
+    bootstrap_calls: Dict[Sel4Label, int]
+    system_calls: Dict[Sel4Label, int]
+    objects_created: Dict[int, int]
+    bytes_retyped: int
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.bootstrap_calls.values()) + sum(self.system_calls.values())
+
+
+def retype_object_size(object_type: int, size_bits: int) -> int:
+    """Return the size of an object created by an untyped retype."""
+    if object_type in FIXED_OBJECT_SIZES:
+        return FIXED_OBJECT_SIZES[object_type]
+    elif object_type == SEL4_CNODE_OBJECT:
+        return 1 << (size_bits + SLOT_BITS)
+    elif object_type in (SEL4_UNTYPED_OBJECT, SEL4_SCHEDCONTEXT_OBJECT):
+        return 1 << size_bits
+    raise ReplayError(f"retype: invalid object type {object_type}")
+
+
+def _table_shifts(object_type: int) -> Tuple[int, int]:
+    """Return the (parent, own) level shifts for a paging structure."""
+    if object_type == SEL4_PAGE_UPPER_DIRECTORY_OBJECT:
+        return (-1, _PUD_SHIFT)
+    elif object_type == SEL4_PAGE_DIRECTORY_OBJECT:
+        return (_PUD_SHIFT, _PD_SHIFT)
+    elif object_type == SEL4_PAGE_TABLE_OBJECT:
+        return (_PD_SHIFT, _PT_SHIFT)
+    raise ReplayError(f"Not a paging structure: {object_type}")
+
+
+class MonitorReplay:
+    """Replay the monitor's invocations against a model of the kernel.
+
+    The model is seeded from the kernel boot info, in the same way the
+    kernel populates the initial task's CSpace and VSpace.
+    """
+    def __init__(
+            self,
+            kernel_config: KernelConfig,
+            kernel_boot_info: KernelBootInfo,
+            initial_task_virt_region: MemoryRegion,
+        ) -> None:
+        self._kernel_config = kernel_config
+        self._objects_created: Dict[int, int] = {}
+        self._bytes_retyped = 0
+        self._irqs: Set[int] = set()
+
+        init_cnode = _CNode(kernel_config.init_cnode_bits)
+        init_cnode_cap = _Cap(init_cnode, guard_bits=kernel_config.cap_address_bits - kernel_config.init_cnode_bits)
+        self._init_vspace = _VSpace()
+        slots = init_cnode.slots
+        slots[INIT_TCB_CAP_ADDRESS] = _Cap(_Object(SEL4_TCB_OBJECT))
+        slots[INIT_CNODE_CAP_ADDRESS] = init_cnode_cap
+        slots[INIT_VSPACE_CAP_ADDRESS] = _Cap(self._init_vspace)
+        slots[IRQ_CONTROL_CAP_ADDRESS] = _Cap(_Object(_IRQ_CONTROL))
+        slots[INIT_ASID_POOL_CAP_ADDRESS] = _Cap(_Object(_ASID_POOL))
+        for cap in range(INIT_ASID_POOL_CAP_ADDRESS + 1, kernel_boot_info.fixed_cap_count):
+            slots[cap] = _Cap(_Object(_OTHER))
+        for cap in range(kernel_boot_info.fixed_cap_count, kernel_boot_info.schedcontrol_cap):
+            slots[cap] = _Cap(_PagingObject(_OTHER))
+        slots[kernel_boot_info.schedcontrol_cap] = _Cap(_Object(_SCHED_CONTROL))
+        first_page_cap = kernel_boot_info.schedcontrol_cap + 1
+        for cap in range(first_page_cap, first_page_cap + kernel_boot_info.page_cap_count):
+            slots[cap] = _Cap(_Object(SEL4_SMALL_PAGE_OBJECT), mapped=True)
+        for ut in kernel_boot_info.untyped_objects:
+            slots[ut.cap] = _Cap(_Untyped(ut.base, ut.size_bits, ut.is_device))
+
+        # The kernel creates the paging structures covering the initial
+        # task's image, and assigns the initial VSpace to the ASID pool.
+        self._init_vspace.asid_assigned = True
+        for shift in (_PUD_SHIFT, _PD_SHIFT, _PT_SHIFT):
+            vaddr = (initial_task_virt_region.base >> shift) << shift
+            while vaddr < initial_task_virt_region.end:
+                self._init_vspace.tables[shift].add(vaddr >> shift)
+                vaddr += 1 << shift
+
+        self._cspace_root = init_cnode_cap
+
+    # CSpace addressing
+
+    def _resolve(self, root: _Cap, cptr: int, depth: int, exact: bool) -> Tuple[_CNode, int]:
+        """Resolve 'depth' bits of 'cptr' starting at the CNode 'root'.
+
+        Returns the CNode and slot index. If 'exact' the resolution
+        must consume exactly 'depth' bits (as for CNode operations),
+        otherwise resolution stops at the first non-CNode cap (as for
+        invocation lookups).
+        """
+        node_cap = root
+        bits = depth
+        while True:
+            if not isinstance(node_cap.obj, _CNode):
+                raise ReplayError(f"cap lookup of 0x{cptr:x}: invalid root (not a CNode)")
+            cnode = node_cap.obj
+            level = cnode.radix_bits + node_cap.guard_bits
+            if node_cap.guard_bits > bits:
+                raise ReplayError(f"cap lookup of 0x{cptr:x}: guard mismatch")
+            guard = (cptr >> (bits - node_cap.guard_bits)) & ((1 << node_cap.guard_bits) - 1)
+            if guard != node_cap.guard:
+                raise ReplayError(f"cap lookup of 0x{cptr:x}: guard mismatch")
+            if level > bits:
+                raise ReplayError(f"cap lookup of 0x{cptr:x}: depth mismatch")
+            offset = (cptr >> (bits - level)) & ((1 << cnode.radix_bits) - 1)
+            bits -= level
+            if bits == 0:
+                return cnode, offset
+            next_cap = cnode.slots.get(offset)
+            if next_cap is None or not isinstance(next_cap.obj, _CNode):
+                if exact:
+                    raise ReplayError(f"cap lookup of 0x{cptr:x}: depth mismatch")
+                return cnode, offset
+            node_cap = next_cap
+
+    def _lookup(self, cptr: int, expected: Optional[int] = None) -> _Cap:
+        """Look up a cap in the monitor's CSpace, checking its type."""
+        cnode, offset = self._resolve(self._cspace_root, cptr, _WORD_BITS, False)
+        cap = cnode.slots.get(offset)
+        if cap is None:
+            raise ReplayError(f"cap 0x{cptr:x}: missing capability")
+        if expected is not None and cap.obj.object_type != expected:
+            raise ReplayError(f"cap 0x{cptr:x}: expected object type {expected}, found {cap.obj.object_type}")
+        return cap
+
+    def _cnode_of(self, cap: _Cap) -> _CNode:
+        if not isinstance(cap.obj, _CNode):
+            raise ReplayError("expected a CNode cap")
+        return cap.obj
+
+    def _empty_slot(self, root: _Cap, index: int, depth: int) -> Tuple[_CNode, int]:
+        cnode, offset = self._resolve(root, index, depth, True)
+        if offset in cnode.slots:
+            raise ReplayError(f"slot 0x{index:x} (depth {depth}): delete first")
+        return cnode, offset
+
+    # Invocations
+
+    def _count_object(self, object_type: int, count: int) -> None:
+        self._objects_created[object_type] = self._objects_created.get(object_type, 0) + count
+
+    def _new_object(self, object_type: int, size_bits: int, paddr: int) -> _Object:
+        if object_type == SEL4_UNTYPED_OBJECT:
+            return _Untyped(paddr, size_bits, False)
+        if object_type == SEL4_CNODE_OBJECT:
+            return _CNode(size_bits, paddr)
+        if object_type == SEL4_VSPACE_OBJECT:
+            return _VSpace(paddr)
+        if object_type in (SEL4_PAGE_UPPER_DIRECTORY_OBJECT, SEL4_PAGE_DIRECTORY_OBJECT, SEL4_PAGE_TABLE_OBJECT):
+            return _PagingObject(object_type, paddr)
+        return _Object(object_type, paddr)
+
+    def _untyped_retype(self, call: InvocationCall) -> None:
+        ut_cap = self._lookup(call.service, SEL4_UNTYPED_OBJECT)
+        assert isinstance(ut_cap.obj, _Untyped)
+        ut = ut_cap.obj
+        root = self._lookup(call.caps[0], SEL4_CNODE_OBJECT)
+        object_type, size_bits, node_index, node_depth, node_offset, num_objects = call.mrs
+
+        object_size = retype_object_size(object_type, size_bits)
+
+        if ut.is_device and object_type not in (SEL4_UNTYPED_OBJECT, SEL4_SMALL_PAGE_OBJECT, SEL4_LARGE_PAGE_OBJECT, SEL4_HUGE_PAGE_OBJECT):
+            raise ReplayError(f"retype: object type {object_type} can not be created from device untyped")
+        if num_objects < 1 or num_objects > self._kernel_config.fan_out_limit:
+            raise ReplayError(f"retype: num_objects {num_objects} out of range")
+
+        if node_depth == 0:
+            dest = self._cnode_of(root)
+        else:
+            dest_cnode, dest_offset = self._resolve(root, node_index, node_depth, True)
+            dest_cap = dest_cnode.slots.get(dest_offset)
+            if dest_cap is None:
+                raise ReplayError(f"retype: destination 0x{node_index:x} is empty")
+            dest = self._cnode_of(dest_cap)
+        if node_offset + num_objects > (1 << dest.radix_bits):
+            raise ReplayError(f"retype: destination slots 0x{node_offset:x}+{num_objects} out of range")
+        for slot in range(node_offset, node_offset + num_objects):
+            if slot in dest.slots:
+                raise ReplayError(f"retype: destination slot 0x{slot:x} not empty")
+
+        # The kernel's allocation policy: bump allocation, aligned to the object size
+        start = -(-(ut.paddr + ut.free_index) // object_size) * object_size
+        end = start + num_objects * object_size
+        if end > ut.paddr + (1 << ut.size_bits):
+            raise ReplayError(f"retype: untyped 0x{call.service:x} has insufficient space for {num_objects} objects of 0x{object_size:x} bytes")
+        ut.free_index = end - ut.paddr
+        self._bytes_retyped += end - start
+
+        for idx, slot in enumerate(range(node_offset, node_offset + num_objects)):
+            dest.slots[slot] = _Cap(self._new_object(object_type, size_bits, start + idx * object_size))
+        self._count_object(object_type, num_objects)
+
+    def _cnode_copy(self, call: InvocationCall, badge: Optional[int]) -> None:
+        service = self._lookup(call.service, SEL4_CNODE_OBJECT)
+        dest_index, dest_depth = call.mrs[0], call.mrs[1]
+        src_obj, src_depth, rights = call.mrs[2], call.mrs[3], call.mrs[4]
+        dest_cnode, dest_offset = self._empty_slot(service, dest_index, dest_depth)
+        src_root = self._lookup(call.caps[0], SEL4_CNODE_OBJECT)
+        src_cnode, src_offset = self._resolve(src_root, src_obj, src_depth, True)
+        src = src_cnode.slots.get(src_offset)
+        if src is None:
+            raise ReplayError(f"copy: source 0x{src_obj:x} is empty")
+        cap = _Cap(src.obj, src.rights & rights, src.badge, src.guard, src.guard_bits)
+        if badge is not None:
+            if isinstance(src.obj, _CNode):
+                # For CNode caps the 'badge' is the cap data: the guard
+                cap.guard_bits = badge & 0x3f
+                cap.guard = badge >> 6
+            elif src.obj.object_type in (SEL4_ENDPOINT_OBJECT, SEL4_NOTIFICATION_OBJECT):
+                cap.badge = badge
+        dest_cnode.slots[dest_offset] = cap
+
+    def _tcb_set_space(self, call: InvocationCall) -> None:
+        self._lookup(call.service, SEL4_TCB_OBJECT)
+        fault_ep, cspace_root_cptr, vspace_root = call.caps
+        if fault_ep != 0:
+            self._lookup(fault_ep, SEL4_ENDPOINT_OBJECT)
+        cspace_root = self._lookup(cspace_root_cptr, SEL4_CNODE_OBJECT)
+        self._lookup(vspace_root, SEL4_VSPACE_OBJECT)
+        cspace_root_data = call.mrs[0]
+        if cspace_root_data != 0:
+            cspace_root = _Cap(cspace_root.obj, cspace_root.rights, 0, cspace_root_data >> 6, cspace_root_data & 0x3f)
+        if call.service == INIT_TCB_CAP_ADDRESS:
+            # The monitor is switching its own CSpace root
+            self._cspace_root = cspace_root
+
+    def _vspace(self, cptr: int) -> _VSpace:
+        cap = self._lookup(cptr, SEL4_VSPACE_OBJECT)
+        assert isinstance(cap.obj, _VSpace)
+        if not cap.obj.asid_assigned:
+            raise ReplayError(f"vspace 0x{cptr:x} has not been assigned an ASID")
+        return cap.obj
+
+    def _table_map(self, call: InvocationCall, object_type: int) -> None:
+        cap = self._lookup(call.service, object_type)
+        assert isinstance(cap.obj, _PagingObject)
+        vspace = self._vspace(call.caps[0])
+        vaddr = call.mrs[0]
+        parent_shift, shift = _table_shifts(object_type)
+        if cap.obj.mapped:
+            raise ReplayError(f"map: paging structure 0x{call.service:x} is already mapped")
+        if parent_shift > 0 and (vaddr >> parent_shift) not in vspace.tables[parent_shift]:
+            raise ReplayError(f"map: no paging structure for vaddr 0x{vaddr:x}")
+        if (vaddr >> shift) in vspace.tables[shift]:
+            raise ReplayError(f"map: paging structure already mapped at vaddr 0x{vaddr:x}")
+        if shift in vspace.frames and (vaddr >> shift) in vspace.frames[shift]:
+            raise ReplayError(f"map: frame already mapped at vaddr 0x{vaddr:x}")
+        cap.obj.mapped = True
+        vspace.tables[shift].add(vaddr >> shift)
+
+    def _page_map(self, call: InvocationCall) -> None:
+        cap = self._lookup(call.service)
+        shift = _FRAME_SHIFTS.get(cap.obj.object_type)
+        if shift is None:
+            raise ReplayError(f"map: cap 0x{call.service:x} is not a frame")
+        vspace = self._vspace(call.caps[0])
+        vaddr = call.mrs[0]
+        if vaddr & ((1 << shift) - 1):
+            raise ReplayError(f"map: vaddr 0x{vaddr:x} is not aligned")
+        if cap.mapped:
+            raise ReplayError(f"map: frame cap 0x{call.service:x} is already mapped")
+        parent_shift = {_PAGE_SHIFT: _PT_SHIFT, _PT_SHIFT: _PD_SHIFT, _PD_SHIFT: _PUD_SHIFT}[shift]
+        if (vaddr >> parent_shift) not in vspace.tables[parent_shift]:
+            raise ReplayError(f"map: no paging structure for vaddr 0x{vaddr:x}")
+        if (vaddr >> shift) in vspace.frames[shift] or (vaddr >> shift) in vspace.tables.get(shift, set()):
+            raise ReplayError(f"map: vaddr 0x{vaddr:x} already mapped")
+        cap.mapped = True
+        vspace.frames[shift].add(vaddr >> shift)
+
+    def _perform(self, call: InvocationCall) -> None:
+        label = call.label
+        if label == Sel4Label.UntypedRetype:
+            self._untyped_retype(call)
+        elif label == Sel4Label.CNodeMint:
+            self._cnode_copy(call, call.mrs[5])
+        elif label == Sel4Label.CNodeCopy:
+            self._cnode_copy(call, None)
+        elif label == Sel4Label.CNodeMutate:
+            self._cnode_copy(call, call.mrs[4])
+        elif label == Sel4Label.TCBSetSpace:
+            self._tcb_set_space(call)
+        elif label == Sel4Label.ARMASIDPoolAssign:
+            self._lookup(call.service, _ASID_POOL)
+            cap = self._lookup(call.caps[0], SEL4_VSPACE_OBJECT)
+            assert isinstance(cap.obj, _VSpace)
+            if cap.obj.asid_assigned:
+                raise ReplayError(f"vspace 0x{call.caps[0]:x} already has an ASID")
+            cap.obj.asid_assigned = True
+        elif label == Sel4Label.ARMPageUpperDirectoryMap:
+            self._table_map(call, SEL4_PAGE_UPPER_DIRECTORY_OBJECT)
+        elif label == Sel4Label.ARMPageDirectoryMap:
+            self._table_map(call, SEL4_PAGE_DIRECTORY_OBJECT)
+        elif label == Sel4Label.ARMPageTableMap:
+            self._table_map(call, SEL4_PAGE_TABLE_OBJECT)
+        elif label == Sel4Label.ARMPageMap:
+            self._page_map(call)
+        elif label == Sel4Label.IRQIssueIRQHandler:
+            self._lookup(call.service, _IRQ_CONTROL)
+            irq, dest_index, dest_depth = call.mrs
+            if irq in self._irqs:
+                raise ReplayError(f"irq {irq} already issued")
+            dest_cnode, dest_offset = self._empty_slot(self._lookup(call.caps[0], SEL4_CNODE_OBJECT), dest_index, dest_depth)
+            dest_cnode.slots[dest_offset] = _Cap(_IrqHandler(irq))
+            self._irqs.add(irq)
+        elif label == Sel4Label.IRQSetIRQHandler:
+            self._lookup(call.service, _IRQ_HANDLER)
+            self._lookup(call.caps[0], SEL4_NOTIFICATION_OBJECT)
+        elif label == Sel4Label.SchedControlConfigureFlags:
+            self._lookup(call.service, _SCHED_CONTROL)
+            self._lookup(call.caps[0], SEL4_SCHEDCONTEXT_OBJECT)
+        elif label == Sel4Label.TCBSetSchedParams:
+            self._lookup(call.service, SEL4_TCB_OBJECT)
+            self._lookup(call.caps[1], SEL4_SCHEDCONTEXT_OBJECT)
+            self._lookup(call.caps[2], SEL4_ENDPOINT_OBJECT)
+        elif label == Sel4Label.TCBSetIPCBuffer:
+            self._lookup(call.service, SEL4_TCB_OBJECT)
+            self._lookup(call.caps[0], SEL4_SMALL_PAGE_OBJECT)
+        elif label == Sel4Label.TCBBindNotification:
+            self._lookup(call.service, SEL4_TCB_OBJECT)
+            self._lookup(call.caps[0], SEL4_NOTIFICATION_OBJECT)
+        elif label in (Sel4Label.TCBWriteRegisters, Sel4Label.TCBResume):
+            self._lookup(call.service, SEL4_TCB_OBJECT)
+        else:
+            raise ReplayError(f"unsupported invocation: {label.name}")
+
+    def _replay(self, words: Sequence[int], count: int, phase: str) -> Dict[Sel4Label, int]:
+        calls: Dict[Sel4Label, int] = {}
+        for call in decode_invocations(words, count):
+            try:
+                self._perform(call)
+            except ReplayError as e:
+                raise ReplayError(f"{phase} invocation {call.index}.{call.iteration} ({call.label.name}): {e}")
+            calls[call.label] = calls.get(call.label, 0) + 1
+        return calls
+
+    def replay(
+            self,
+            bootstrap_data: bytes,
+            bootstrap_count: int,
+            system_data: bytes,
+            system_count: int,
+            system_encoding: int = INVOCATION_ENCODING_RAW,
+        ) -> ReplayResult:
+        bootstrap_calls = self._replay(invocation_words(bootstrap_data), bootstrap_count, "bootstrap")
+        system_calls = self._replay(invocation_words(system_data, system_encoding), system_count, "system")
+        return ReplayResult(
+            bootstrap_calls=bootstrap_calls,
+            system_calls=system_calls,
+            objects_created=dict(self._objects_created),
+            bytes_retyped=self._bytes_retyped,
+        )
@@ -3,9 +3,11 @@
 #
 # SPDX-License-Identifier: BSD-2-Clause
 #
-from dataclasses import dataclass, fields
+from array import array
+from dataclasses import Field, dataclass, fields
 from enum import IntEnum
-from typing import List, Optional, Set, Tuple
+from sys import byteorder
+from typing import ClassVar, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Type
 from struct import pack, Struct
 
 from sel4coreplat.util import MemoryRegion, DisjointMemoryRegion, UserError, lsb, round_down, round_up
@@ -22,6 +24,7 @@ SEL4_REPLY_SIZE = (1 << 5)
 SEL4_PAGE_TABLE_SIZE = (1 << 12)
 SEL4_PAGE_DIRECTORY_SIZE = (1 << 12)
 SEL4_PAGE_UPPER_DIRECTORY_SIZE = (1 << 12)
+SEL4_HUGE_PAGE_SIZE = (1024 * 1024 * 1024)
 SEL4_LARGE_PAGE_SIZE = (2 * 1024 * 1024)
 SEL4_SMALL_PAGE_SIZE = (4 * 1024)
 SEL4_VSPACE_SIZE = (4 * 1024)
@@ -77,6 +80,7 @@ FIXED_OBJECT_SIZES = {
     SEL4_PAGE_DIRECTORY_OBJECT: SEL4_PAGE_DIRECTORY_SIZE,
     SEL4_PAGE_TABLE_OBJECT: SEL4_PAGE_TABLE_SIZE,
 
+    SEL4_HUGE_PAGE_OBJECT: SEL4_HUGE_PAGE_SIZE,
     SEL4_LARGE_PAGE_OBJECT: SEL4_LARGE_PAGE_SIZE,
     SEL4_SMALL_PAGE_OBJECT: SEL4_SMALL_PAGE_SIZE,
 }
@@ -183,6 +187,12 @@ typedef struct seL4_UserContext_ {
     # FIXME: This is pretty terrible, but for now... explicit better than implicit
     # NOTE: We could optimize so that we can see how many register are actually set
     # in a given set to reduce space
+    names = (
+        "pc", "sp", "spsr", "x0", "x1", "x2", "x3", "x4", "x5", "x6", "x7", "x8", "x16", "x17", "x18", "x29", "x30",
+        "x9", "x10", "x11", "x12", "x13", "x14", "x15", "x19", "x20", "x21", "x22", "x23", "x24", "x25", "x26", "x27", "x28",
+        "tpidr_el0", "tpidrro_el0",
+    )
+
     def __init__(self,
         pc: Optional[int] = None,
         sp: Optional[int] = None,
@@ -377,6 +387,8 @@ class Sel4Label(IntEnum):
 ### Invocations
 
 class Sel4Invocation:
+    # Set by @dataclass on each invocation class
+    __dataclass_fields__: ClassVar[Dict[str, "Field[object]"]]
     label: Sel4Label
     _extra_caps: Tuple[str, ...]
     _object_type: str
@@ -391,12 +403,8 @@ class Sel4Invocation:
         all_args = (tag, self._service) + extra_caps + args
         base = pack(fmt, *all_args)
         if repeat_count:
-            repeat_incr = self._repeat_incr
             extra_fmt = "<Q" + ("Q" * (0 + len(extra_caps) + len(args)))
-            service: int = repeat_incr.get(fields(self)[0].name, 0)
-            cap_args: Tuple[int, ...] = tuple(repeat_incr.get(f.name, 0) for f in fields(self)[1:] if f.name in self._extra_caps)
-            val_args: Tuple[int, ...] = tuple(repeat_incr.get(f.name, 0) for f in fields(self)[1:] if f.name not in self._extra_caps)
-            extra = pack(extra_fmt, *((service, ) + cap_args + val_args))
+            extra = pack(extra_fmt, *self._repeat_words())
         else:
             extra = b''
         return base + extra
@@ -420,9 +428,37 @@ class Sel4Invocation:
         assert length < 0x80
         return label << 12 | caps << 9 | extra_caps << 7 | length
 
-    def _get_raw_invocation(self) -> bytes:
+    @classmethod
+    def _word_names(cls) -> Tuple[str, ...]:
+        """Names of the words of the invocation, in encoding order.
+
+        The encoding order is: service, extra caps, message registers.
+        """
+        names = [f.name for f in fields(cls)]
+        cap_names = tuple(nm for nm in names[1:] if nm in cls._extra_caps)
+        val_names = tuple(nm for nm in names[1:] if nm not in cls._extra_caps)
+        return (names[0], ) + cap_names + val_names
+
+    def _words(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        """Return the extra cap and message register words."""
         cap_args = tuple(val for nm, val in self._args if nm in self._extra_caps)
         val_args = tuple(val for nm, val in self._args if nm not in self._extra_caps)
+        return cap_args, val_args
+
+    def _repeat_words(self) -> Tuple[int, ...]:
+        """Return the per-iteration increment for each word of the invocation."""
+        repeat_incr = self._repeat_incr
+        return tuple(repeat_incr.get(nm, 0) for nm in self._word_names())
+
+    @classmethod
+    def _from_words(cls, service: int, caps: Tuple[int, ...], mrs: Tuple[int, ...]) -> "Sel4Invocation":
+        """Inverse of _words(); reconstruct an invocation from its words."""
+        names = cls._word_names()
+        values = dict(zip(names, (service, ) + caps + mrs))
+        return cls(**values)
+
+    def _get_raw_invocation(self) -> bytes:
+        cap_args, val_args = self._words()
         return self._generic_invocation(cap_args, val_args)
 
     def repeat(self, count: int, **kwargs: int) -> None:
@@ -510,13 +546,23 @@ class Sel4TcbWriteRegisters(Sel4Invocation):
     arch_flags: int
     regs: Sel4Aarch64Regs
 
-    def _get_raw_invocation(self) -> bytes:
+    @classmethod
+    def _word_names(cls) -> Tuple[str, ...]:
+        # Only the TCB maps directly to a field; the message registers
+        # are the flags, the register count and the registers themselves.
+        return ("tcb", "flags", "count") + Sel4Aarch64Regs.names
+
+    def _words(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
         params = (
             self.arch_flags << 8 | 1 if self.resume else 0,
             self.regs.count()
         ) + self.regs.as_tuple()
 
-        return self._generic_invocation((), params)
+        return (), params
+
+    @classmethod
+    def _from_words(cls, service: int, caps: Tuple[int, ...], mrs: Tuple[int, ...]) -> "Sel4Invocation":
+        return cls(service, bool(mrs[0] & 1), mrs[0] >> 8, Sel4Aarch64Regs(*mrs[2:]))
 
 @dataclass
 class Sel4TcbBindNotification(Sel4Invocation):
@@ -667,6 +713,307 @@ class Sel4SchedControlConfigureFlags(Sel4Invocation):
     badge: int
     flags: int
 
+MAX_REPEAT_COUNT = 1 << 32
+_WORD_MASK = (1 << 64) - 1
+
+# Encodings of the system invocation table understood by the monitor
+INVOCATION_ENCODING_RAW = 0
+INVOCATION_ENCODING_VARINT = 1
+
+
+def _varint_fold(w: int, signed: bool) -> int:
+    """Map a word to the unsigned value that is LEB128 encoded.
+
+    Words are rotated left by one bit, which maps cap addresses in the
+    system CNode (which have the top bit set) to small values. Signed
+    words (the increments of repeated invocations) are zigzag encoded
+    instead, so that small negative values map to small values.
+    """
+    if signed:
+        return ((w << 1) ^ -(w >> 63)) & _WORD_MASK
+    return ((w << 1) | (w >> 63)) & _WORD_MASK
+
+
+def _varint_unfold(v: int, signed: bool) -> int:
+    if signed:
+        return (v >> 1) ^ (-(v & 1) & _WORD_MASK)
+    return (v >> 1) | ((v & 1) << 63)
+
+
+def _varint_append(out: bytearray, words: Iterable[int], signed: bool) -> None:
+    for w in words:
+        v = _varint_fold(w, signed)
+        while v >= 0x80:
+            out.append((v & 0x7f) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def varint_encode_words(words: Iterable[int], signed: bool = False) -> bytes:
+    """Encode 64-bit words in the compact (varint) invocation encoding."""
+    out = bytearray()
+    _varint_append(out, words, signed)
+    return bytes(out)
+
+
+def varint_word_size(w: int, signed: bool = False) -> int:
+    """Size (in bytes) of a word in the compact (varint) encoding."""
+    return max(1, (_varint_fold(w, signed).bit_length() + 6) // 7)
+
+
+def varint_decode_words(data: bytes, signed: bool = False) -> "array[int]":
+    """Inverse of varint_encode_words()."""
+    words = array("Q")
+    v = 0
+    shift = 0
+    for b in data:
+        v |= (b & 0x7f) << shift
+        shift += 7
+        if not b & 0x80:
+            words.append(_varint_unfold(v, signed))
+            v = 0
+            shift = 0
+    if shift != 0:
+        raise ValueError("truncated varint data")
+    return words
+
+
+def varint_decode_invocations(data: bytes) -> "array[int]":
+    """Decode invocation data in the compact encoding to its words.
+
+    This is the inverse of Sel4InvocationTable.encode_compact(), and
+    decodes the data in the same way as the monitor: the increments of
+    a repeated invocation are signed words.
+    """
+    words = array("Q")
+    offset = 0
+
+    def decode(signed: bool) -> int:
+        nonlocal offset
+        v = 0
+        shift = 0
+        while True:
+            if offset >= len(data):
+                raise ValueError("truncated varint data")
+            b = data[offset]
+            offset += 1
+            v |= (b & 0x7f) << shift
+            shift += 7
+            if not b & 0x80:
+                return _varint_unfold(v, signed)
+
+    while offset < len(data):
+        cmd = decode(False)
+        words.append(cmd)
+        width = 1 + ((cmd >> 7) & 0x3) + (cmd & 0x7f)
+        words.extend(decode(False) for _ in range(width))
+        if cmd >> 32:
+            words.extend(decode(True) for _ in range(width))
+    return words
+
+
+class Sel4InvocationTable:
+    """A columnar store for a sequence of invocations.
+
+    Rather than keeping an object per invocation the words of each
+    invocation are appended to an array for the invocation's label.
+    A compact record index (label, row and optional repeat row)
+    preserves the order of the invocations.
+
+    Rows in the value column are: service, extra caps, message registers.
+    Rows in the repeat column are: count, followed by the per-iteration
+    increment of each value word.
+
+    If 'fold' is set, an appended invocation that continues the stride
+    of the previous invocation (with the same label) is folded into it
+    as an additional repeat iteration rather than creating a new record.
+    """
+    def __init__(self, fold: bool = False) -> None:
+        self._fold = fold
+        self._classes: List[Type[Sel4Invocation]] = []
+        self._class_idx: Dict[Type[Sel4Invocation], int] = {}
+        self._tags: List[int] = []
+        self._widths: List[int] = []
+        self._values: List["array[int]"] = []
+        self._repeats: List["array[int]"] = []
+        self._record_class = array("B")
+        self._record_row = array("I")
+        self._record_repeat = array("i")
+        self._word_count = 0
+        self._compact_size = 0
+        self._call_count = 0
+
+    def __len__(self) -> int:
+        return len(self._record_class)
+
+    @property
+    def encoded_size(self) -> int:
+        """Size (in bytes) of the encoded invocation data."""
+        return self._word_count * 8
+
+    @property
+    def compact_encoded_size(self) -> int:
+        """Size (in bytes) of the invocation data in the compact encoding."""
+        return self._compact_size
+
+    @property
+    def call_count(self) -> int:
+        """Number of system calls, after expanding repeats."""
+        return self._call_count
+
+    def _class_index(self, cls: Type[Sel4Invocation], cap_count: int, mr_count: int) -> int:
+        idx = self._class_idx.get(cls)
+        if idx is None:
+            idx = len(self._classes)
+            self._classes.append(cls)
+            self._class_idx[cls] = idx
+            self._tags.append(Sel4Invocation.message_info_new(cls.label, 0, cap_count, mr_count))
+            self._widths.append(1 + cap_count + mr_count)
+            self._values.append(array("Q"))
+            self._repeats.append(array("Q"))
+        else:
+            assert self._widths[idx] == 1 + cap_count + mr_count
+        return idx
+
+    def _try_fold(self, idx: int, words: Tuple[int, ...]) -> bool:
+        if len(self._record_class) == 0 or self._record_class[-1] != idx:
+            return False
+        width = self._widths[idx]
+        row = self._record_row[-1]
+        base = self._values[idx][row * width:(row + 1) * width]
+        repeat_row = self._record_repeat[-1]
+        tag = self._tags[idx]
+        if repeat_row < 0:
+            self._record_repeat[-1] = len(self._repeats[idx]) // (width + 1)
+            self._repeats[idx].append(2)
+            incr: Sequence[int] = [(w - b) & _WORD_MASK for w, b in zip(words, base)]
+            self._repeats[idx].extend(incr)
+            self._word_count += width
+            self._compact_size += varint_word_size(tag | (1 << 32)) - varint_word_size(tag)
+            self._compact_size += sum(varint_word_size(i, True) for i in incr)
+        else:
+            repeats = self._repeats[idx]
+            offset = repeat_row * (width + 1)
+            count = repeats[offset]
+            if count == MAX_REPEAT_COUNT:
+                return False
+            incr = repeats[offset + 1:offset + 1 + width]
+            if any((b + i * count) & _WORD_MASK != w for b, i, w in zip(base, incr, words)):
+                return False
+            repeats[offset] = count + 1
+            self._compact_size += varint_word_size(tag | (count << 32)) - varint_word_size(tag | ((count - 1) << 32))
+        self._call_count += 1
+        return True
+
+    def append(self, invocation: Sel4Invocation) -> None:
+        caps, mrs = invocation._words()
+        idx = self._class_index(type(invocation), len(caps), len(mrs))
+        words = (invocation._service, ) + caps + mrs
+        repeat_count = invocation._repeat_count if hasattr(invocation, "_repeat_count") else 1
+        assert repeat_count <= MAX_REPEAT_COUNT
+
+        if self._fold and repeat_count == 1 and self._try_fold(idx, words):
+            return
+
+        width = self._widths[idx]
+        values = self._values[idx]
+        self._record_class.append(idx)
+        self._record_row.append(len(values) // width)
+        values.extend(words)
+        self._word_count += 1 + width
+        self._compact_size += varint_word_size(self._tags[idx] | ((repeat_count - 1) << 32))
+        self._compact_size += sum(varint_word_size(w & _WORD_MASK) for w in words)
+        self._call_count += repeat_count
+        if repeat_count > 1:
+            repeats = self._repeats[idx]
+            self._record_repeat.append(len(repeats) // (width + 1))
+            repeats.append(repeat_count)
+            incr_words = [incr & _WORD_MASK for incr in invocation._repeat_words()]
+            repeats.extend(incr_words)
+            self._word_count += width
+            self._compact_size += sum(varint_word_size(incr, True) for incr in incr_words)
+        else:
+            self._record_repeat.append(-1)
+
+    def extend(self, invocations: Iterable[Sel4Invocation]) -> None:
+        for invocation in invocations:
+            self.append(invocation)
+
+    def _record(self, record_idx: int) -> Tuple[int, "array[int]", Optional["array[int]"]]:
+        """Return the class index, value words and repeat words for a record."""
+        idx = self._record_class[record_idx]
+        width = self._widths[idx]
+        row = self._record_row[record_idx]
+        values = self._values[idx][row * width:(row + 1) * width]
+        repeat_row = self._record_repeat[record_idx]
+        if repeat_row < 0:
+            return idx, values, None
+        offset = repeat_row * (width + 1)
+        return idx, values, self._repeats[idx][offset:offset + width + 1]
+
+    def __iter__(self) -> Iterator[Sel4Invocation]:
+        """Materialise each invocation in turn (e.g. for reporting)."""
+        for record_idx in range(len(self)):
+            idx, values, repeat = self._record(record_idx)
+            cls = self._classes[idx]
+            tag = self._tags[idx]
+            cap_count = (tag >> 7) & 0x3
+            invocation = cls._from_words(values[0], tuple(values[1:1 + cap_count]), tuple(values[1 + cap_count:]))
+            if repeat is not None:
+                invocation._repeat_count = repeat[0]
+                invocation._repeat_incr = {nm: incr for nm, incr in zip(cls._word_names(), repeat[1:]) if incr != 0}
+            yield invocation
+
+    def labels(self) -> Iterator[Tuple[Sel4Label, int]]:
+        """Yield the label and (expanded) call count of each record."""
+        for record_idx in range(len(self)):
+            idx = self._record_class[record_idx]
+            repeat_row = self._record_repeat[record_idx]
+            count = 1 if repeat_row < 0 else self._repeats[idx][repeat_row * (self._widths[idx] + 1)]
+            yield self._classes[idx].label, count
+
+    def _encode_words(self) -> "array[int]":
+        data = array("Q")
+        for record_idx in range(len(self)):
+            idx, values, repeat = self._record(record_idx)
+            tag = self._tags[idx]
+            if repeat is None:
+                data.append(tag)
+                data.extend(values)
+            else:
+                data.append(tag | ((repeat[0] - 1) << 32))
+                data.extend(values)
+                data.extend(repeat[1:])
+        assert len(data) == self._word_count
+        return data
+
+    def encode(self) -> bytes:
+        """Encode the invocations in the format used by the monitor."""
+        data = self._encode_words()
+        if byteorder != "little":
+            data.byteswap()
+        return data.tobytes()
+
+    def encode_compact(self) -> bytes:
+        """Encode the invocations in the compact (varint) format.
+
+        The monitor decodes this incrementally, one invocation at a time.
+        """
+        data = bytearray()
+        for record_idx in range(len(self)):
+            idx, values, repeat = self._record(record_idx)
+            tag = self._tags[idx]
+            if repeat is None:
+                _varint_append(data, (tag, ), False)
+                _varint_append(data, values, False)
+            else:
+                _varint_append(data, (tag | ((repeat[0] - 1) << 32), ), False)
+                _varint_append(data, values, False)
+                _varint_append(data, repeat[1:], True)
+        assert len(data) == self._compact_size
+        return bytes(data)
+
+
 @dataclass(frozen=True, eq=True)
 class UntypedObject:
     cap: int
@@ -777,8 +1124,9 @@ def _kernel_partial_boot(
     """
     # Determine the untyped caps of the system
     # This lets allocations happen correctly.
-    device_memory = DisjointMemoryRegion()
-    normal_memory = DisjointMemoryRegion()
+    # The kernel does not merge adjacent regions, so neither can we.
+    device_memory = DisjointMemoryRegion(coalesce=False)
+    normal_memory = DisjointMemoryRegion(coalesce=False)
 
     # Start by allocating the entire physical address space
     # as device memory.
@@ -820,6 +1168,24 @@ def emulate_kernel_boot_partial(
     return partial_info.normal_memory
 
 
+def allocate_rootserver_objects(normal_memory: DisjointMemoryRegion, initial_task_virt_region: MemoryRegion) -> MemoryRegion:
+    """Remove the memory used by the kernel for the initial task's
+    (rootserver) objects from 'normal_memory', returning the region used."""
+    initial_objects_size = calculate_rootserver_size(initial_task_virt_region)
+    initial_objects_align = _rootserver_max_size_bits()
+
+    # Find an appropriate region of normal memory to allocate the objects
+    # from; this follows the same algorithm used within the kernel boot code
+    # (or at least we hope it does!)
+    for region in reversed(normal_memory.regions()):
+        start = round_down(region.end - initial_objects_size, 1 << initial_objects_align)
+        if start >= region.base:
+            normal_memory.remove_region(start, start + initial_objects_size)
+            return MemoryRegion(start, start + initial_objects_size)
+
+    raise Exception("Couldn't find appropriate region for initial task kernel objects")
+
+
 def emulate_kernel_boot(
         kernel_config: KernelConfig,
         kernel_elf: ElfFile,
@@ -839,19 +1205,7 @@ def emulate_kernel_boot(
     normal_memory.remove_region(reserved_region.base, reserved_region.end)
 
     # Now, the tricky part! determine which memory is used for the initial task objects
-    initial_objects_size = calculate_rootserver_size(initial_task_virt_region)
-    initial_objects_align = _rootserver_max_size_bits()
-
-    # Find an appropriate region of normal memory to allocate the objects
-    # from; this follows the same algorithm used within the kernel boot code
-    # (or at least we hope it does!)
-    for region in reversed(normal_memory._regions):
-        start = round_down(region.end - initial_objects_size, 1 << initial_objects_align)
-        if start >= region.base:
-            normal_memory.remove_region(start, start + initial_objects_size)
-            break
-    else:
-        raise Exception("Couldn't find appropriate region for initial task kernel objects")
+    allocate_rootserver_objects(normal_memory, initial_task_virt_region)
 
     fixed_cap_count = 0xf
     sched_control_cap_count = 1
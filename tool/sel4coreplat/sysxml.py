@@ -64,6 +64,7 @@ class SysMap:
     perms: str  # FIXME: should make this a better typed thing
     cached: bool
     element: Optional[ET.Element]
+    demand: bool = False
 
 
 @dataclass(frozen=True, eq=True)
@@ -101,6 +102,9 @@ class SysMemoryRegion:
     page_size: int
     page_count: int
     phys_addr: Optional[int]
+    # False if the page size is the default (rather than given in the
+    # system description), in which case the tool may use larger pages.
+    page_size_explicit: bool = True
 
 
 @dataclass(frozen=True, eq=True)
@@ -220,7 +224,7 @@ def xml2mr(mr_xml: ET.Element, plat_desc: PlatformDescription) -> SysMemoryRegio
     if paddr is not None and paddr % page_size != 0:
         raise ValueError("phys_addr is not aligned to the page size")
     page_count = size // page_size
-    return SysMemoryRegion(name, size, page_size, page_count, paddr)
+    return SysMemoryRegion(name, size, page_size, page_count, paddr, page_size_str is not None)
 
 
 def xml2pd(pd_xml: ET.Element) -> ProtectionDomain:
@@ -251,12 +255,13 @@ def xml2pd(pd_xml: ET.Element) -> ProtectionDomain:
                     raise ValueError("program_image must only be specified once")
                 program_image = Path(checked_lookup(child, "path"))
             elif child.tag == "map":
-                _check_attrs(child, ("mr", "vaddr", "perms", "cached", "setvar_vaddr"))
+                _check_attrs(child, ("mr", "vaddr", "perms", "cached", "setvar_vaddr", "demand"))
                 mr = checked_lookup(child, "mr")
                 vaddr = int(checked_lookup(child, "vaddr"), base=0)
                 perms = child.attrib.get("perms", "rw")
                 cached = str_to_bool(child.attrib.get("cached", "true"))
-                maps.append(SysMap(mr, vaddr, perms, cached, child))
+                demand = str_to_bool(child.attrib.get("demand", "false"))
+                maps.append(SysMap(mr, vaddr, perms, cached, child, demand))
 
                 setvar_vaddr = child.attrib.get("setvar_vaddr")
                 if setvar_vaddr:
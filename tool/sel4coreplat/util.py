@@ -3,8 +3,10 @@
 #
 # SPDX-License-Identifier: BSD-2-Clause
 #
+from bisect import bisect_right
 from dataclasses import dataclass
-from typing import List, Optional
+from enum import Enum
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 
 class UserError(Exception):
     pass
@@ -41,6 +43,64 @@ def mask_bits(n: int, bits: int) -> int:
     return (n >> bits) << bits
 
 
+def interval_union(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Return the union of the [start, end) intervals as a sorted list
+    of disjoint, non-adjacent intervals."""
+    union: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if union and start <= union[-1][1]:
+            if end > union[-1][1]:
+                union[-1] = (union[-1][0], end)
+        else:
+            union.append((start, end))
+    return union
+
+
+def aligned_blocks(intervals: Iterable[Tuple[int, int]], bits: int) -> List[int]:
+    """Return the (sorted) base addresses of the 2^bits sized, aligned
+    blocks that the [start, end) intervals touch."""
+    blocks: List[int] = []
+    for start, end in interval_union(intervals):
+        block = max((start >> bits) << bits, blocks[-1] + (1 << bits) if blocks else 0)
+        while block < end:
+            blocks.append(block)
+            block += 1 << bits
+    return blocks
+
+
+def arithmetic_runs(values: Sequence[int], single_cost: int, repeat_cost: int) -> List[Tuple[int, int]]:
+    """Partition 'values' into consecutive runs with a constant stride,
+    returned as (start index, length) pairs.
+
+    A run of one value costs 'single_cost' and a longer run costs
+    'repeat_cost' (which must be at least 'single_cost'). The partition
+    returned has the minimum total cost.
+    """
+    # cost[i] is the minimum cost of the first i values, and last[i] the
+    # start of the final run in that partition. As cost[] never decreases
+    # the best run of two or more values ending at value i starts where
+    # the longest constant stride run ending at value i starts.
+    cost = [0]
+    last = [0]
+    run_start = 0
+    for i in range(len(values)):
+        if i >= 2 and values[i] - values[i - 1] != values[i - 1] - values[i - 2]:
+            run_start = i - 1
+        best, best_start = cost[i] + single_cost, i
+        if i >= 1 and cost[run_start] + repeat_cost < best:
+            best, best_start = cost[run_start] + repeat_cost, run_start
+        cost.append(best)
+        last.append(best_start)
+
+    runs: List[Tuple[int, int]] = []
+    end = len(values)
+    while end > 0:
+        runs.append((last[end], end - last[end]))
+        end = last[end]
+    runs.reverse()
+    return runs
+
+
 def is_power_of_two(n: int) -> bool:
     """Return True if n is a power of two."""
     assert n > 0
@@ -95,79 +155,320 @@ class MemoryRegion:
         return self.end - self.base
 
 
+class AllocationPolicy(Enum):
+    """Policies for placing an allocation in a DisjointMemoryRegion.
+
+    FIRST_FIT: lowest address region that fits.
+    BEST_FIT: smallest region that fits.
+    ALIGNED_FIT: lowest address placement aligned to the allocation's
+        size (rounded up to a power of two), falling back to smaller
+        alignments if there is no such placement.
+    MIN_UNTYPED: placement that leaves the fewest power-of-two aligned
+        regions (i.e. untyped objects) behind.
+    """
+    FIRST_FIT = "first-fit"
+    BEST_FIT = "best-fit"
+    ALIGNED_FIT = "aligned-fit"
+    MIN_UNTYPED = "min-untyped"
+
+
+@dataclass(frozen=True)
+class Fragmentation:
+    regions: int
+    free_bytes: int
+    largest_region: int
+    untyped_count: int
+
+
 class DisjointMemoryRegion:
-    def __init__(self) -> None:
-        self._regions: List[MemoryRegion] = []
-        self._check()
+    """A set of disjoint memory regions, kept sorted by base address.
+
+    The regions are stored as parallel lists of base and end addresses
+    so that a region can be found with a binary search.
+
+    If 'coalesce' is True, inserting a region adjacent to an existing
+    region extends the existing region rather than adding a new one.
+    Kernel boot emulation must *not* coalesce: the kernel creates
+    untyped objects for each region separately, so merging adjacent
+    regions would change the untyped objects.
+
+    Mutations only check the neighbours of the modified region. Set
+    'full_check' to validate the whole set after every mutation (this
+    is intended for debugging).
+
+    'snapshot' records the current state in O(1), and 'rollback' returns
+    to it. Once a snapshot has been taken each change to the lists is
+    recorded in an undo log, so rolling back costs time proportional to
+    the changes made since the snapshot, not the size of the set.
+
+    'find_free' uses a max tree of the region sizes (in address order) to
+    skip runs of regions that are too small. Resizing a region updates
+    the tree in O(log n); inserting or deleting a region shifts the
+    indices, so the tree is rebuilt on the next lookup.
+    """
+    full_check = False
+
+    def __init__(self, coalesce: bool = True) -> None:
+        self._coalesce = coalesce
+        self._bases: List[int] = []
+        self._ends: List[int] = []
+        # (index, base, end) to restore; base is None to undo an insert,
+        # and idx is negative (-idx - 1) to undo a delete.
+        self._undo: Optional[List[Tuple[int, Optional[int], int]]] = None
+        # Max tree of region sizes: node i covers nodes 2i and 2i + 1 and
+        # the leaves start at len(self._size_tree) // 2. None if stale.
+        self._size_tree: Optional[List[int]] = None
+
+    def snapshot(self) -> int:
+        """Return a snapshot of the current state for use with 'rollback'."""
+        if self._undo is None:
+            self._undo = []
+        return len(self._undo)
+
+    def rollback(self, snapshot: int) -> None:
+        """Return to the state when 'snapshot' was taken.
+
+        Snapshots taken after 'snapshot' are no longer valid."""
+        assert self._undo is not None and snapshot <= len(self._undo)
+        self._size_tree = None
+        while len(self._undo) > snapshot:
+            idx, base, end = self._undo.pop()
+            if idx < 0:
+                assert base is not None
+                self._bases.insert(-idx - 1, base)
+                self._ends.insert(-idx - 1, end)
+            elif base is None:
+                del self._bases[idx]
+                del self._ends[idx]
+            else:
+                self._bases[idx] = base
+                self._ends[idx] = end
+
+    def _set(self, idx: int, base: int, end: int) -> None:
+        if self._undo is not None:
+            self._undo.append((idx, self._bases[idx], self._ends[idx]))
+        self._bases[idx] = base
+        self._ends[idx] = end
+        tree = self._size_tree
+        if tree is not None:
+            node = len(tree) // 2 + idx
+            tree[node] = end - base
+            while node > 1:
+                node //= 2
+                tree[node] = max(tree[2 * node], tree[2 * node + 1])
+
+    def _insert(self, idx: int, base: int, end: int) -> None:
+        if self._undo is not None:
+            self._undo.append((idx, None, 0))
+        self._bases.insert(idx, base)
+        self._ends.insert(idx, end)
+        self._size_tree = None
+
+    def _delete(self, idx: int) -> None:
+        if self._undo is not None:
+            self._undo.append((-idx - 1, self._bases[idx], self._ends[idx]))
+        del self._bases[idx]
+        del self._ends[idx]
+        self._size_tree = None
 
     def _check(self) -> None:
         # Ensure that regions are sorted and non-overlapping
         last_end: Optional[int] = None
-        for region in self._regions:
+        for base, end in zip(self._bases, self._ends):
+            assert base < end
             if last_end is not None:
-                assert region.base >= last_end
-            last_end = region.end
+                assert base >= last_end
+            last_end = end
+
+    def _check_neighbours(self, idx: int) -> None:
+        """Check the region at 'idx' is ordered with respect to its neighbours."""
+        if idx > 0:
+            assert self._ends[idx - 1] <= self._bases[idx]
+        if idx + 1 < len(self._bases):
+            assert self._ends[idx] <= self._bases[idx + 1]
+        if self.full_check:
+            self._check()
+
+    def __len__(self) -> int:
+        return len(self._bases)
+
+    def regions(self) -> List[MemoryRegion]:
+        return [MemoryRegion(base, end) for base, end in zip(self._bases, self._ends)]
 
     def dump(self) -> None:
-        for region in self._regions:
-            print(f"   {region.base:016x} - {region.end:016x}")
+        for base, end in zip(self._bases, self._ends):
+            print(f"   {base:016x} - {end:016x}")
 
     def insert_region(self, base: int, end: int) -> None:
-        # Find where it belongs
-        for idx, region in enumerate(self._regions):
-            if end < region.base:
-                break
+        assert base < end
+        idx = bisect_right(self._bases, base)
+        if idx > 0 and self._ends[idx - 1] > base:
+            raise ValueError(f"Attempting to insert region (0x{base:x}-0x{end:x}) that overlaps an existing region")
+        if idx < len(self._bases) and self._bases[idx] < end:
+            raise ValueError(f"Attempting to insert region (0x{base:x}-0x{end:x}) that overlaps an existing region")
+
+        if self._coalesce and idx > 0 and self._ends[idx - 1] == base:
+            # Extend the previous region (and possibly merge with the next)
+            idx -= 1
+            if idx + 1 < len(self._bases) and self._bases[idx + 1] == end:
+                next_end = self._ends[idx + 1]
+                self._delete(idx + 1)
+                self._set(idx, self._bases[idx], next_end)
+            else:
+                self._set(idx, self._bases[idx], end)
+        elif self._coalesce and idx < len(self._bases) and self._bases[idx] == end:
+            # Extend the next region
+            self._set(idx, base, self._ends[idx])
         else:
-            idx = len(self._regions)
-        # FIXME: Should extend here if adjacent rather than
-        # inserting now
-        self._regions.insert(idx, MemoryRegion(base, end))
-        self._check()
+            self._insert(idx, base, end)
+        self._check_neighbours(idx)
 
     def remove_region(self, base: int, end: int) -> None:
-        for idx, region in enumerate(self._regions):
-            if base >= region.base and end <= region.end:
-                break
-        else:
+        idx = bisect_right(self._bases, base) - 1
+        if idx < 0 or end > self._ends[idx] or base >= end:
             raise ValueError(f"Attempting to remove region (0x{base:x}-0x{end:x}) that is not currently covered")
 
-        if region.base == base and region.end == end:
+        region_base = self._bases[idx]
+        region_end = self._ends[idx]
+        if region_base == base and region_end == end:
             # Covers exactly, so just remove
-            del self._regions[idx]
-        elif region.base == base:
+            self._delete(idx)
+            if self.full_check:
+                self._check()
+            return
+        elif region_base == base:
             # Trim the start of the region
-            self._regions[idx] = MemoryRegion(end, region.end)
-        elif region.end == end:
+            self._set(idx, end, region_end)
+        elif region_end == end:
             # Trim end of the region
-            self._regions[idx] = MemoryRegion(region.base, base)
+            self._set(idx, region_base, base)
         else:
             # Splitting
-            self._regions[idx] = MemoryRegion(region.base, base)
-            self._regions.insert(idx + 1, MemoryRegion(end, region.end))
+            self._set(idx, region_base, base)
+            self._insert(idx + 1, end, region_end)
 
-        self._check()
+        self._check_neighbours(idx)
 
     def aligned_power_of_two_regions(self) -> List[MemoryRegion]:
         r = []
-        for region in self._regions:
+        for region in self.regions():
             r += region.aligned_power_of_two_regions()
         return r
 
-    def allocate(self, size: int) -> int:
-        """Allocate region of 'size' bytes, returning the base address.
-
-        The allocated region is removed from the disjoint memory region."""
+    def find_free(self, size: int, align: int = 1, min_base: int = 0) -> Optional[int]:
+        """Return the lowest base address (at or above 'min_base') of a
+        free, 'align' aligned, region of 'size' bytes, or None if there
+        is no such region.
 
-        # Allocation policy is simple first fit.
-        # Possibly a 'best fit' policy would be better.
-        # 'best' may be something that best matches a power-of-two
-        # allocation
-        for region in self._regions:
-            if size <= region.size:
+        The region is not removed."""
+        idx: Optional[int] = max(bisect_right(self._bases, min_base) - 1, 0)
+        while idx is not None:
+            idx = self._first_index_of_size(idx, size)
+            if idx is None:
                 break
+            aligned_base = round_up(max(self._bases[idx], min_base), align)
+            if aligned_base + size <= self._ends[idx]:
+                return aligned_base
+            idx += 1
+        return None
+
+    def _first_index_of_size(self, start: int, size: int) -> Optional[int]:
+        """Return the index of the first region at or after 'start' of at
+        least 'size' bytes, or None if there is no such region."""
+        tree = self._size_tree
+        if tree is None:
+            leaves = 1 << max(len(self._bases) - 1, 0).bit_length()
+            tree = [0] * leaves + [end - base for base, end in zip(self._bases, self._ends)]
+            tree += [0] * (2 * leaves - len(tree))
+            for node in range(leaves - 1, 0, -1):
+                tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            self._size_tree = tree
+
+        leaves = len(tree) // 2
+
+        def search(node: int, node_start: int, node_end: int) -> Optional[int]:
+            if node_end <= start or tree[node] < size:
+                return None
+            if node >= leaves:
+                return node_start
+            mid = (node_start + node_end) // 2
+            found = search(2 * node, node_start, mid)
+            return found if found is not None else search(2 * node + 1, mid, node_end)
+
+        found = search(1, 0, leaves)
+        return found if found is not None and found < len(self._bases) else None
+
+    def fragmentation(self) -> Fragmentation:
+        return Fragmentation(
+            regions=len(self._bases),
+            free_bytes=sum(end - base for base, end in zip(self._bases, self._ends)),
+            largest_region=max((end - base for base, end in zip(self._bases, self._ends)), default=0),
+            untyped_count=len(self.aligned_power_of_two_regions()),
+        )
+
+    def _placements(self, size: int, min_base: int) -> Iterator[Tuple[int, int, int]]:
+        """Yield (region base, region end, base) for candidate placements
+        of 'size' bytes at or above 'min_base'.
+
+        Candidates are the start and end of each region, aligned to each
+        power of two that could matter for the size of the region."""
+        for region_base, region_end in zip(self._bases, self._ends):
+            start = max(region_base, min_base)
+            if start + size > region_end:
+                continue
+            for bits in range(msb(region_end - start) + 1):
+                align = 1 << bits
+                low = round_up(start, align)
+                if low + size <= region_end:
+                    yield region_base, region_end, low
+                high = round_down(region_end - size, align)
+                if high >= start:
+                    yield region_base, region_end, high
+
+    def allocate(self, size: int, policy: AllocationPolicy = AllocationPolicy.FIRST_FIT, min_base: int = 0, align: int = 1) -> int:
+        """Allocate region of 'size' bytes, returning the base address.
+
+        The allocated region is removed from the disjoint memory region.
+        Only addresses at or above 'min_base', and aligned to 'align', are
+        considered."""
+        assert is_power_of_two(align)
+        base: Optional[int] = None
+        if policy == AllocationPolicy.FIRST_FIT:
+            base = self.find_free(size, align, min_base)
+        elif policy == AllocationPolicy.BEST_FIT:
+            best_size: Optional[int] = None
+            for region_base, region_end in zip(self._bases, self._ends):
+                start = round_up(max(region_base, min_base), align)
+                if start + size <= region_end and (best_size is None or region_end - start < best_size):
+                    base = start
+                    best_size = region_end - start
+        elif policy == AllocationPolicy.ALIGNED_FIT:
+            bits = (size - 1).bit_length()
+            while base is None and (1 << bits) >= align:
+                base = self.find_free(size, 1 << bits, min_base)
+                bits -= 1
+            if base is None:
+                base = self.find_free(size, align, min_base)
+        elif policy == AllocationPolicy.MIN_UNTYPED:
+            best: Optional[Tuple[int, int]] = None
+            for region_base, region_end, candidate in self._placements(size, min_base):
+                if candidate % align != 0:
+                    continue
+                count = (
+                    len(MemoryRegion(region_base, candidate).aligned_power_of_two_regions()) +
+                    len(MemoryRegion(candidate + size, region_end).aligned_power_of_two_regions()) -
+                    len(MemoryRegion(region_base, region_end).aligned_power_of_two_regions())
+                )
+                if best is None or (count, candidate) < best:
+                    best = (count, candidate)
+            if best is not None:
+                base = best[1]
         else:
+            raise Exception(f"Unknown allocation policy: {policy}")
+
+        if base is None:
             raise ValueError(f"Unable to allocate {size} bytes.")
 
-        self.remove_region(region.base, region.base + size)
+        self.remove_region(base, base + size)
 
-        return region.base
+        return base
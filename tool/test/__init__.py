@@ -6,13 +6,58 @@
 from pathlib import Path
 import unittest
 
-from sel4coreplat.sysxml import xml2system, UserError, PlatformDescription
+from sel4coreplat.sysxml import xml2system, UserError, Channel, PlatformDescription, ProtectionDomain, SysIrq, SysMap, SysMemoryRegion, SystemDescription
+from sel4coreplat.util import AllocationPolicy, DisjointMemoryRegion, MemoryRegion, aligned_blocks, arithmetic_runs, interval_union
+from sel4coreplat.replay import MonitorReplay, ReplayError, invocation_words
+from sel4coreplat.__main__ import MONITOR_CONFIG, paging_structure_names, paging_structure_vaddrs, DemandMap, pack_demand_maps, INVOCATION_WINDOW_HIGH_VADDR, INVOCATION_WINDOW_VADDR, InitSystem, invocation_window_vaddr, KernelObjectAllocator, PageOverlap, SystemCSpace, system_cnode_slots, pd_cnode_size, pd_needs_reply, promote_large_pages, table_map_runs, vspace_index, PADDING_FIXED, PADDING_GREEDY, PADDING_HYBRID, choose_padding, padding_plans
+from sel4coreplat.benchmark import invocation_classes, run_benchmark
+from sel4coreplat.bootcost import CostCalibration, PHASE_MAP, PHASE_RETYPE, estimate_boot_cost
+from sel4coreplat.sel4 import (
+    KernelBootInfo,
+    KernelConfig,
+    Sel4Aarch64Regs,
+    Sel4AsidPoolAssign,
+    Sel4CnodeMint,
+    Sel4InvocationTable,
+    Sel4PageMap,
+    Sel4PageTableMap,
+    Sel4PageUpperDirectoryMap,
+    Sel4TcbWriteRegisters,
+    Sel4Label,
+    Sel4UntypedRetype,
+    UntypedObject,
+    INIT_ASID_POOL_CAP_ADDRESS,
+    INIT_CNODE_CAP_ADDRESS,
+    SEL4_ARM_DEFAULT_VMATTRIBUTES,
+    SEL4_ENDPOINT_OBJECT,
+    SEL4_HUGE_PAGE_OBJECT,
+    SEL4_HUGE_PAGE_SIZE,
+    SEL4_LARGE_PAGE_SIZE,
+    SEL4_PAGE_UPPER_DIRECTORY_OBJECT,
+    SEL4_SMALL_PAGE_OBJECT,
+    SEL4_TCB_OBJECT,
+    SEL4_UNTYPED_OBJECT,
+    SEL4_VSPACE_OBJECT,
+    varint_decode_invocations,
+    varint_decode_words,
+    varint_encode_words,
+)
 
 
 plat_desc = PlatformDescription(
     page_sizes = [0x1_000, 0x200_000]
 )
 
+kernel_config = KernelConfig(
+    word_size=64,
+    minimum_page_size=0x1000,
+    paddr_user_device_top=1 << 40,
+    kernel_frame_size=1 << 12,
+    init_cnode_bits=12,
+    cap_address_bits=64,
+    fan_out_limit=256,
+)
+
 def _file(filename: str) -> Path:
     return Path(__file__).parent / filename
 
@@ -149,4 +194,604 @@ class SystemParseTests(ExtendedTestCase):
         self._check_error("sys_map_not_aligned.xml", "Invalid vaddr alignment on 'map' @ ")
 
     def test_too_many_pds(self):
-        self._check_error("sys_too_many_pds.xml", "Too many protection domains (64) defined. Maximum is 63.")
\ No newline at end of file
+        self._check_error("sys_too_many_pds.xml", "Too many protection domains (64) defined. Maximum is 63.")
+
+class InvocationTableTests(unittest.TestCase):
+    def test_encode_matches_invocations(self):
+        invocations = [
+            Sel4CnodeMint(10, 1, 8, 2, 0x8000_0000_0000_0010, 64, 0xf, 5),
+            Sel4TcbWriteRegisters(0x20, True, 0, Sel4Aarch64Regs(pc=0x200000)),
+            Sel4PageMap(0x30, 0x40, 0x1000_0000, 3, 7),
+        ]
+        invocations[2].repeat(16, page=1, vaddr=0x1000)
+        table = Sel4InvocationTable()
+        table.extend(invocations)
+        expected = b''.join(inv._get_raw_invocation() for inv in invocations)
+        self.assertEqual(table.encode(), expected)
+        self.assertEqual(table.encoded_size, len(expected))
+        self.assertEqual([inv._get_raw_invocation() for inv in table], [inv._get_raw_invocation() for inv in invocations])
+
+    def test_fold(self):
+        table = Sel4InvocationTable(fold=True)
+        for idx in range(4):
+            table.append(Sel4PageMap(0x30 + idx, 0x40, 0x1000_0000 + idx * 0x1000, 3, 7))
+        table.append(Sel4PageMap(0x50, 0x40, 0x2000_0000, 3, 7))
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.call_count, 5)
+        expected = Sel4PageMap(0x30, 0x40, 0x1000_0000, 3, 7)
+        expected.repeat(4, page=1, vaddr=0x1000)
+        self.assertEqual(table.encode()[:len(expected._get_raw_invocation())], expected._get_raw_invocation())
+
+    def test_compact_encoded_size(self):
+        table = Sel4InvocationTable(fold=True)
+        # Folding past 128 iterations grows the repeat count in the tag
+        for idx in range(200):
+            table.append(Sel4PageMap(0x30 + idx, 0x40, 0x1000_0000 + idx * 0x1000, 3, 7))
+        invocation = Sel4CnodeMint(10, 1, 8, 2, 0x8000_0000_0000_0010, 64, 0xf, 5)
+        invocation.repeat(3, dest_index=1)
+        table.append(invocation)
+        self.assertEqual(table.compact_encoded_size, len(table.encode_compact()))
+
+    def test_varint_round_trip(self):
+        words = [0, 1, 0x7f, 0x80, 0x8000_0000_0000_0001, (1 << 64) - 1, 0x1000_0000]
+        data = varint_encode_words(words)
+        self.assertEqual(list(varint_decode_words(data)), words)
+        # Cap addresses in the system CNode encode to a single byte
+        self.assertEqual(len(varint_encode_words([0x8000_0000_0000_0010])), 1)
+        # Signed words: small negative values encode to a single byte
+        signed_words = [0, 1, (1 << 64) - 1, (1 << 64) - 0x40, 0x1000]
+        data = varint_encode_words(signed_words, True)
+        self.assertEqual(list(varint_decode_words(data, True)), signed_words)
+        self.assertEqual(len(varint_encode_words([(1 << 64) - 1], True)), 1)
+
+    def test_compact_negative_increment(self):
+        invocation = Sel4PageMap(0x8000_0000_0000_0030, 0x40, 0x1000_0000, 3, 7)
+        invocation.repeat(4, page=-1, vaddr=-0x1000)
+        table = Sel4InvocationTable()
+        table.append(invocation)
+        data = table.encode_compact()
+        self.assertEqual(list(varint_decode_invocations(data)), list(invocation_words(table.encode())))
+        # The increments are: page -1, vspace 0, vaddr -0x1000 (2 bytes),
+        # rights 0, attr 0
+        self.assertEqual(len(data) - len(varint_encode_words(invocation_words(table.encode())[:6])), 6)
+        self.assertEqual(table.compact_encoded_size, len(data))
+
+
+class ReplayTests(unittest.TestCase):
+    untyped_cap = 18
+
+    def _replay(self, invocations, untyped_region=MemoryRegion(0x4000_0000, 0x4000_4000)):
+        boot_info = KernelBootInfo(
+            fixed_cap_count=15,
+            schedcontrol_cap=16,
+            paging_cap_count=1,
+            page_cap_count=1,
+            untyped_objects=[UntypedObject(self.untyped_cap, untyped_region, False)],
+            first_available_cap=19,
+        )
+        table = Sel4InvocationTable()
+        table.extend(invocations)
+        replay = MonitorReplay(kernel_config, boot_info, MemoryRegion(0x8a00_0000, 0x8a00_1000))
+        return replay.replay(b'', 0, table.encode(), len(table))
+
+    def test_retype(self):
+        retype = Sel4UntypedRetype(self.untyped_cap, SEL4_TCB_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 20, 2)
+        retype.repeat(2, node_offset=2)
+        result = self._replay([retype])
+        self.assertEqual(result.objects_created, {SEL4_TCB_OBJECT: 4})
+        self.assertEqual(result.bytes_retyped, 0x2000)
+
+    def test_untyped_exhausted(self):
+        retype = Sel4UntypedRetype(self.untyped_cap, SEL4_TCB_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 20, 9)
+        with self.assertRaisesRegex(ReplayError, "insufficient space"):
+            self._replay([retype])
+
+    def test_huge_page_size(self):
+        retype = Sel4UntypedRetype(self.untyped_cap, SEL4_HUGE_PAGE_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 20, 1)
+        with self.assertRaisesRegex(ReplayError, "insufficient space"):
+            self._replay([retype])
+
+    def test_huge_page_map(self):
+        invocations = [
+            Sel4UntypedRetype(self.untyped_cap, SEL4_HUGE_PAGE_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 20, 1),
+            Sel4UntypedRetype(self.untyped_cap, SEL4_VSPACE_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 21, 1),
+            Sel4UntypedRetype(self.untyped_cap, SEL4_PAGE_UPPER_DIRECTORY_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 22, 1),
+            Sel4AsidPoolAssign(INIT_ASID_POOL_CAP_ADDRESS, 21),
+            Sel4PageUpperDirectoryMap(22, 21, 0, SEL4_ARM_DEFAULT_VMATTRIBUTES),
+            Sel4PageMap(20, 21, SEL4_HUGE_PAGE_SIZE, 3, 7),
+        ]
+        result = self._replay(invocations, MemoryRegion(0x8000_0000, 0x1_0000_0000))
+        self.assertEqual(result.objects_created[SEL4_HUGE_PAGE_OBJECT], 1)
+        self.assertEqual(result.system_calls[Sel4Label.ARMPageMap], 1)
+        # A huge page must be aligned to 1 GiB
+        invocations[-1] = Sel4PageMap(20, 21, SEL4_HUGE_PAGE_SIZE + SEL4_LARGE_PAGE_SIZE, 3, 7)
+        with self.assertRaisesRegex(ReplayError, "not aligned"):
+            self._replay(invocations, MemoryRegion(0x8000_0000, 0x1_0000_0000))
+
+    def test_slot_not_empty(self):
+        retype = Sel4UntypedRetype(self.untyped_cap, SEL4_TCB_OBJECT, 0, INIT_CNODE_CAP_ADDRESS, 0, 0, 20, 1)
+        with self.assertRaisesRegex(ReplayError, "not empty"):
+            self._replay([retype, retype])
+
+
+class BootCostTests(unittest.TestCase):
+    calibration = CostCalibration(
+        default_call_cost=10,
+        call_costs={Sel4Label.UntypedRetype: 100},
+        zero_cost_per_byte=1,
+        copy_cost_per_byte=2,
+    )
+
+    def test_estimate(self):
+        page_map = Sel4PageMap(0x8000_0000_0000_0020, 0x8000_0000_0000_0010, 0x1000_0000, 3, 7)
+        page_map.repeat(4, page=1, vaddr=0x1000)
+        table = Sel4InvocationTable()
+        table.extend([
+            Sel4UntypedRetype(0x100, SEL4_TCB_OBJECT, 0, 2, 1, 1, 0x40, 2),
+            Sel4UntypedRetype(0x101, SEL4_TCB_OBJECT, 0, 2, 1, 1, 0x42, 1),
+            page_map,
+        ])
+        cap_lookup = {0x8000_0000_0000_0010: "VSpace: PD=a"}
+        for idx in range(4):
+            cap_lookup[0x8000_0000_0000_0020 + idx] = f"Page(4 KiB): MR=b #{idx}"
+        estimate = estimate_boot_cost(self.calibration, b'', 0, table.encode(), len(table), cap_lookup, 64, {0x101}, [0x100])
+        # Memory from device untyped is not zeroed
+        self.assertEqual(estimate.zeroed_bytes, 0x1000)
+        self.assertEqual(estimate.phase_costs[PHASE_RETYPE], 200 + 0x1000)
+        self.assertEqual(estimate.phase_calls[PHASE_MAP], 4)
+        self.assertEqual(estimate.loader_cost, 0x200)
+        self.assertEqual(estimate.top_pds(1), [("a", 40)])
+        self.assertEqual(estimate.top_mrs(1), [("b", 40)])
+
+
+    def test_leaf_cnode_names(self):
+        # More than 1,024 system caps, so objects are created in leaf CNodes
+        cspace = SystemCSpace.for_slots(64, 0x1400)
+        table = Sel4InvocationTable()
+        for node_index, node_depth, node_offset, num_objects in cspace.retype_destinations(0x3fe, 4, 0x100):
+            table.append(Sel4UntypedRetype(0x100, SEL4_TCB_OBJECT, 0, 2, node_index, node_depth, node_offset, num_objects))
+        cap_lookup = {cspace.cap_address_mask | 0x3fe: "TCB: PD=a", cspace.cap_address_mask | 0x400: "TCB: PD=b"}
+        estimate = estimate_boot_cost(self.calibration, b'', 0, table.encode(), len(table), cap_lookup, 64, set(), [])
+        self.assertEqual(estimate.pd_costs, {"a": 100 + 2 * 0x800, "b": 100 + 2 * 0x800})
+
+    def test_pd_costs(self):
+        pds = tuple(ProtectionDomain(name, 100, 1000, 1000, False, False, Path("pd.elf"), (), (), (), None) for name in ("a", "b"))
+        system = SystemDescription((), pds, ())
+        pt_names = paging_structure_names("PageTable", system, [(0, 0x20_0000), (1, 0x20_0000), (1, 0x1000_0000)])
+        table = Sel4InvocationTable()
+        cap_lookup = {}
+        for cap, name in enumerate(pt_names, 0x100):
+            table.append(Sel4PageTableMap(cap, 0x10, 0x20_0000, SEL4_ARM_DEFAULT_VMATTRIBUTES))
+            cap_lookup[cap] = name
+        estimate = estimate_boot_cost(self.calibration, b'', 0, table.encode(), len(table), cap_lookup, 64, set(), [])
+        self.assertEqual(estimate.pd_costs, {"a": 10, "b": 20})
+
+    def test_untyped_not_zeroed(self):
+        table = Sel4InvocationTable()
+        table.append(Sel4UntypedRetype(0x100, SEL4_UNTYPED_OBJECT, 21, 2, 1, 1, 0x40, 4))
+        estimate = estimate_boot_cost(self.calibration, b'', 0, table.encode(), len(table), {}, 64, set(), [])
+        self.assertEqual(estimate.zeroed_bytes, 0)
+        self.assertEqual(estimate.phase_costs[PHASE_RETYPE], 100)
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_all_invocations(self):
+        for cls in invocation_classes():
+            single = run_benchmark(cls, 10, None)
+            repeated = run_benchmark(cls, 10, 4)
+            self.assertEqual(single.invocations, 10)
+            self.assertEqual(repeated.invocations, 3)
+            self.assertLess(repeated.bytes, single.bytes)
+
+
+class DisjointMemoryRegionTests(unittest.TestCase):
+    def setUp(self):
+        DisjointMemoryRegion.full_check = True
+
+    def tearDown(self):
+        DisjointMemoryRegion.full_check = False
+
+    def test_coalesce(self):
+        dmr = DisjointMemoryRegion()
+        dmr.insert_region(0x3000, 0x4000)
+        dmr.insert_region(0x1000, 0x2000)
+        dmr.insert_region(0x2000, 0x3000)
+        self.assertEqual(dmr.regions(), [MemoryRegion(0x1000, 0x4000)])
+        dmr.remove_region(0x2000, 0x3000)
+        self.assertEqual(dmr.regions(), [MemoryRegion(0x1000, 0x2000), MemoryRegion(0x3000, 0x4000)])
+
+    def test_no_coalesce(self):
+        dmr = DisjointMemoryRegion(coalesce=False)
+        dmr.insert_region(0x2000, 0x3000)
+        dmr.insert_region(0x1000, 0x2000)
+        self.assertEqual(dmr.regions(), [MemoryRegion(0x1000, 0x2000), MemoryRegion(0x2000, 0x3000)])
+
+    def test_overlap(self):
+        dmr = DisjointMemoryRegion()
+        dmr.insert_region(0x1000, 0x3000)
+        with self.assertRaises(ValueError):
+            dmr.insert_region(0x2000, 0x4000)
+        with self.assertRaises(ValueError):
+            dmr.remove_region(0x2000, 0x4000)
+
+    def test_find_free(self):
+        dmr = DisjointMemoryRegion()
+        dmr.insert_region(0x1000, 0x3000)
+        dmr.insert_region(0x10_1000, 0x30_0000)
+        self.assertEqual(dmr.find_free(0x2000), 0x1000)
+        self.assertEqual(dmr.find_free(0x2000, 0x2000), 0x10_2000)
+        self.assertEqual(dmr.find_free(0x10_0000, 0x10_0000), 0x20_0000)
+        self.assertIsNone(dmr.find_free(0x20_0000))
+        self.assertEqual(dmr.allocate(0x1000), 0x1000)
+        self.assertEqual(dmr.regions()[0], MemoryRegion(0x2000, 0x3000))
+
+    def test_find_free_after_changes(self):
+        dmr = DisjointMemoryRegion(coalesce=False)
+        for idx in range(100):
+            dmr.insert_region(idx * 0x10_0000, idx * 0x10_0000 + 0x1000)
+        dmr.insert_region(0x1000_0000, 0x1010_0000)
+        self.assertEqual(dmr.find_free(0x2000), 0x1000_0000)
+        snapshot = dmr.snapshot()
+        # Adding a region before the large one, then splitting the large one
+        dmr.insert_region(0x50_1000, 0x50_3000)
+        self.assertEqual(dmr.find_free(0x2000), 0x50_1000)
+        dmr.remove_region(0x1000_1000, 0x1000_2000)
+        self.assertEqual(dmr.find_free(0x2000, min_base=0x1000_0000), 0x1000_2000)
+        dmr.rollback(snapshot)
+        self.assertEqual(dmr.find_free(0x2000), 0x1000_0000)
+        self.assertIsNone(dmr.find_free(0x2000, min_base=0x1010_0000))
+
+    def test_allocation_policies(self):
+        def allocate(policy, min_base=0, align=1):
+            dmr = DisjointMemoryRegion()
+            dmr.insert_region(0x1000, 0x9000)
+            dmr.insert_region(0x10_0000, 0x10_5000)
+            return dmr.allocate(0x4000, policy, min_base, align)
+
+        self.assertEqual(allocate(AllocationPolicy.FIRST_FIT), 0x1000)
+        self.assertEqual(allocate(AllocationPolicy.FIRST_FIT, 0x2000), 0x2000)
+        self.assertEqual(allocate(AllocationPolicy.BEST_FIT), 0x10_0000)
+        self.assertEqual(allocate(AllocationPolicy.ALIGNED_FIT), 0x4000)
+        # Leaves 0x5000-0x9000 (two untyped) rather than 0x1000-0x4000
+        # and 0x8000-0x9000 (three untyped)
+        self.assertEqual(allocate(AllocationPolicy.MIN_UNTYPED), 0x1000)
+        for policy in AllocationPolicy:
+            self.assertEqual(allocate(policy, align=0x8000) % 0x8000, 0)
+
+    def test_rollback(self):
+        dmr = DisjointMemoryRegion()
+        dmr.insert_region(0x1000, 0x3000)
+        dmr.insert_region(0x5000, 0x6000)
+        before = dmr.regions()
+        snapshot = dmr.snapshot()
+        dmr.remove_region(0x2000, 0x2800)
+        nested = dmr.snapshot()
+        dmr.insert_region(0x3000, 0x5000)
+        dmr.remove_region(0x1000, 0x2000)
+        self.assertEqual(dmr.regions(), [MemoryRegion(0x2800, 0x6000)])
+        dmr.rollback(nested)
+        self.assertEqual(dmr.regions(), [MemoryRegion(0x1000, 0x2000), MemoryRegion(0x2800, 0x3000), MemoryRegion(0x5000, 0x6000)])
+        dmr.rollback(snapshot)
+        self.assertEqual(dmr.regions(), before)
+
+
+class IntervalTests(unittest.TestCase):
+    def test_union(self):
+        self.assertEqual(interval_union([(0x5000, 0x6000), (0x1000, 0x3000), (0x2000, 0x4000), (0x4000, 0x4800)]), [(0x1000, 0x4800), (0x5000, 0x6000)])
+
+    def test_aligned_blocks(self):
+        # Two ranges in the same 2MiB block are only counted once
+        self.assertEqual(aligned_blocks([(0x1000, 0x2000), (0x10_0000, 0x20_1000)], 21), [0, 0x20_0000])
+        self.assertEqual(aligned_blocks([(0x40_0000, 0x40_0000 + (1 << 30))], 30), [0, 1 << 30])
+
+
+class KernelObjectAllocatorTests(unittest.TestCase):
+    def _allocator(self, policy):
+        boot_info = KernelBootInfo(
+            fixed_cap_count=15,
+            schedcontrol_cap=16,
+            paging_cap_count=1,
+            page_cap_count=1,
+            untyped_objects=[
+                UntypedObject(18, MemoryRegion(0x4000_0000, 0x4000_2000), False),
+                UntypedObject(19, MemoryRegion(0x4001_0000, 0x4001_1000), False),
+            ],
+            first_available_cap=20,
+        )
+        return KernelObjectAllocator(boot_info, policy)
+
+    def test_first_fit(self):
+        kao = self._allocator(AllocationPolicy.FIRST_FIT)
+        self.assertEqual(kao.alloc(0x800).phys_addr, 0x4000_0000)
+        allocation = kao.alloc(0x1000)
+        self.assertEqual((allocation.untyped_cap_address, allocation.phys_addr), (18, 0x4000_1000))
+        self.assertEqual(kao.untyped[0].alignment_waste, 0x800)
+
+    def test_best_fit(self):
+        kao = self._allocator(AllocationPolicy.BEST_FIT)
+        self.assertEqual(kao.alloc(0x800).phys_addr, 0x4000_0000)
+        allocation = kao.alloc(0x1000)
+        self.assertEqual((allocation.untyped_cap_address, allocation.phys_addr), (19, 0x4001_0000))
+        self.assertEqual(kao.untyped[0].alignment_waste, 0)
+        # Only the first untyped has space left
+        self.assertEqual(kao.alloc(0x400, 2).phys_addr, 0x4000_0800)
+        self.assertEqual(kao.alloc(0x1000).phys_addr, 0x4000_1000)
+        with self.assertRaises(Exception):
+            kao.alloc(0x10)
+
+    def test_rollback(self):
+        kao = self._allocator(AllocationPolicy.FIRST_FIT)
+        kao.alloc(0x800)
+        snapshot = kao.snapshot()
+        kao.alloc(0x1000)
+        kao.alloc_batch(0x800, 2)
+        kao.rollback(snapshot)
+        self.assertEqual([(ut.allocation_point, ut.alignment_waste, len(ut.allocations)) for ut in kao.untyped], [(0x800, 0, 1), (0, 0, 0)])
+        # The same allocations are made again
+        self.assertEqual(kao.alloc(0x1000).phys_addr, 0x4000_1000)
+        self.assertEqual(kao.alloc(0x1000).phys_addr, 0x4001_0000)
+
+    def test_batch_split(self):
+        kao = self._allocator(AllocationPolicy.FIRST_FIT)
+        allocations = kao.alloc_batch(0x1000, 3)
+        self.assertEqual(
+            [(allocation.untyped_cap_address, allocation.phys_addr, count) for allocation, count in allocations],
+            [(18, 0x4000_0000, 2), (19, 0x4001_0000, 1)]
+        )
+        with self.assertRaises(Exception):
+            kao.alloc_batch(0x1000, 1)
+
+    def test_planned_allocation(self):
+        kao = self._allocator(AllocationPolicy.FIRST_FIT)
+        invocations = Sel4InvocationTable()
+        boot_info = KernelBootInfo(15, 16, 1, 1, [], 20)
+        init_system = InitSystem(kernel_config, 2, SystemCSpace.for_slots(64, 0x1000), 0x10, kao, boot_info, invocations, {})
+        endpoints, pages = init_system.allocate_objects_planned([
+            (SEL4_ENDPOINT_OBJECT, ["ep0", "ep1"], None),
+            (SEL4_SMALL_PAGE_OBJECT, ["page0"], None),
+        ])
+        # Cap slots are in request order...
+        self.assertEqual([obj.cap_slot for obj in endpoints + pages], [0x10, 0x11, 0x12])
+        # ... but the larger objects are allocated first
+        self.assertEqual([obj.phys_addr for obj in pages + endpoints], [0x4000_0000, 0x4000_1000, 0x4000_1010])
+        self.assertEqual([inv.object_type for inv in invocations], [SEL4_SMALL_PAGE_OBJECT, SEL4_ENDPOINT_OBJECT])
+        self.assertEqual(kao.untyped[0].alignment_waste, 0)
+
+    def test_fixed_run(self):
+        kao = self._allocator(AllocationPolicy.FIRST_FIT)
+        invocations = Sel4InvocationTable()
+        boot_info = KernelBootInfo(15, 16, 1, 1, [
+            UntypedObject(20, MemoryRegion(0x1000_0000, 0x1000_4000), True),
+            UntypedObject(21, MemoryRegion(0x1000_4000, 0x1000_6000), True),
+        ], 22)
+        init_system = InitSystem(kernel_config, 2, SystemCSpace.for_slots(64, 0x1000), 0x10, kao, boot_info, invocations, {})
+        names = [f"page{i}" for i in range(5)]
+        pages = init_system.allocate_fixed_objects(0x1000_1000, SEL4_SMALL_PAGE_OBJECT, 5, names)
+        self.assertEqual([page.phys_addr for page in pages], [0x1000_1000 + i * 0x1000 for i in range(5)])
+        self.assertEqual([page.name for page in pages], names)
+        # One padding retype, then one retype per device untyped
+        self.assertEqual(
+            [(inv.untyped, inv.object_type, inv.num_objects) for inv in invocations],
+            [(20, SEL4_UNTYPED_OBJECT, 1), (20, SEL4_SMALL_PAGE_OBJECT, 3), (21, SEL4_SMALL_PAGE_OBJECT, 2)]
+        )
+        with self.assertRaises(Exception):
+            init_system.allocate_fixed_objects(0x1000_6000, SEL4_SMALL_PAGE_OBJECT, 1, ["page5"])
+
+
+class PaddingTests(unittest.TestCase):
+    def test_plans(self):
+        greedy, fixed, hybrid = padding_plans(0x1000_0000, 0x5000, 256)
+        self.assertEqual((greedy.strategy, greedy.groups), (PADDING_GREEDY, ((14, 1), (12, 1))))
+        self.assertEqual((fixed.strategy, fixed.groups), (PADDING_FIXED, ((12, 5), )))
+        self.assertEqual((hybrid.strategy, hybrid.groups), (PADDING_HYBRID, ((12, 5), )))
+
+    def test_choice(self):
+        # A single object needs no batching
+        self.assertEqual(choose_padding(0x1000_0000, 0x10_0000, 256).strategy, PADDING_GREEDY)
+        # Batching 5 pages saves an invocation
+        plan = choose_padding(0x1000_0000, 0x5000, 256)
+        self.assertEqual((plan.invocations, plan.caps), (1, 5))
+        # The fixed strategy would need 511 caps for the same number of invocations
+        plan = choose_padding(0x1000_0000, 0x1f_f000, 256)
+        self.assertEqual((plan.strategy, plan.invocations, plan.caps), (PADDING_HYBRID, 2, 256))
+
+
+class VSpaceIndexTests(unittest.TestCase):
+    mrs = {
+        "large": SysMemoryRegion("large", 0x20_0000, 0x20_0000, 1, None),
+        "small": SysMemoryRegion("small", 0x2000, 0x1000, 2, None),
+    }
+
+    def test_sorted(self):
+        maps = (SysMap("large", 0x40_0000, "rw", True, None), SysMap("small", 0x1000, "rw", True, None))
+        index = vspace_index("pd", 0x3000, maps, self.mrs)
+        self.assertEqual(
+            [(mapping.base, mapping.end, mapping.page_size) for mapping in index],
+            [(0x1000, 0x3000, 0x1000), (0x3000, 0x4000, 0x1000), (0x40_0000, 0x60_0000, 0x20_0000)]
+        )
+
+    def test_overlap(self):
+        maps = (SysMap("large", 0x40_0000, "rw", True, None), SysMap("small", 0x50_0000, "rw", True, None))
+        with self.assertRaisesRegex(UserError, "ELF segment 'small' at 0x500000 overlaps ELF segment 'large' at 0x400000 in protection domain 'pd'"):
+            vspace_index("pd", 0x1000, maps, self.mrs)
+
+    def test_paging_structures(self):
+        mrs = dict(self.mrs, huge=SysMemoryRegion("huge", SEL4_HUGE_PAGE_SIZE, SEL4_HUGE_PAGE_SIZE, 1, None))
+        maps = (
+            SysMap("huge", 0x4000_0000, "rw", True, None),
+            SysMap("large", 0x8000_0000, "rw", True, None),
+            SysMap("small", 0x8020_0000, "rw", True, None),
+        )
+        index = vspace_index("pd", 0x1000, maps, mrs)
+        # The huge page is mapped in the upper directory, so needs no
+        # page directory; only the IPC buffer and 'small' need page tables
+        self.assertEqual(paging_structure_vaddrs(index), ([0], [0, 0x8000_0000], [0, 0x8020_0000]))
+
+    def test_ipc_buffer_overlap(self):
+        maps = (SysMap("small", 0x1000, "rw", True, None), )
+        with self.assertRaisesRegex(PageOverlap, "IPC buffer at 0x2000 overlaps"):
+            vspace_index("pd", 0x2000, maps, self.mrs)
+
+
+class SystemCSpaceTests(unittest.TestCase):
+    def test_slots(self):
+        self.assertEqual(system_cnode_slots(1), 2)
+        self.assertEqual(system_cnode_slots(300), 512)
+        self.assertEqual(system_cnode_slots(0x400), 0x400)
+        # Past a single leaf CNode the slots grow a leaf at a time
+        self.assertEqual(system_cnode_slots(0x401), 0x800)
+        self.assertEqual(system_cnode_slots(0x1001), 0x1400)
+
+    def test_layout(self):
+        self.assertEqual(SystemCSpace.for_slots(64, 512), SystemCSpace(64, 1, 9, 1))
+        cspace = SystemCSpace.for_slots(64, 0x1400)
+        self.assertEqual(cspace, SystemCSpace(64, 3, 10, 5))
+        self.assertEqual(cspace.slots, 0x1400)
+        self.assertEqual(cspace.top_guard, 50)
+
+    def test_retype_destinations(self):
+        cspace = SystemCSpace.for_slots(64, 0x1400)
+        leaf = (1 << 63) >> 10
+        # Split at the fan out limit and where the slots cross into the next leaf
+        self.assertEqual(
+            cspace.retype_destinations(0x300, 0x180, 0x80),
+            [(leaf, 54, 0x300, 0x80), (leaf, 54, 0x380, 0x80), (leaf + 1, 54, 0, 0x80)]
+        )
+        self.assertEqual(cspace.retype_destinations(0x3ff, 2, 0x100), [(leaf, 54, 0x3ff, 1), (leaf + 1, 54, 0, 1)])
+
+
+class InvocationWindowTests(unittest.TestCase):
+    monitor = MemoryRegion(0x8a00_0000, 0x8a01_0000)
+
+    def test_below_monitor(self):
+        self.assertEqual(invocation_window_vaddr(self.monitor, 0xa00_0000), INVOCATION_WINDOW_VADDR)
+
+    def test_above_monitor(self):
+        self.assertEqual(invocation_window_vaddr(self.monitor, 0xa00_1000), INVOCATION_WINDOW_HIGH_VADDR)
+
+    def test_overlap(self):
+        with self.assertRaisesRegex(UserError, "overlaps the invocation window"):
+            invocation_window_vaddr(MemoryRegion(0xf000_0000, 0xf001_0000), 0x7000_1000)
+
+
+class PdCnodeTests(unittest.TestCase):
+    def _pd(self, name, pp=False, passive=False, irqs=()):
+        return ProtectionDomain(name, 100, 1000, 1000, pp, passive, Path(f"{name}.elf"), (), irqs, (), None)
+
+    def test_cnode_size(self):
+        server = self._pd("server", pp=True, passive=True)
+        client = self._pd("client")
+        driver = self._pd("driver", irqs=(SysIrq(33, 0), ))
+        idle = self._pd("idle")
+        system = SystemDescription((), (server, client, driver, idle), (Channel("client", 1, "server", 0, None), ))
+        # The client's endpoint cap for channel 1 is in slot 75
+        self.assertEqual(pd_cnode_size(client, system), 128)
+        self.assertEqual(pd_cnode_size(server, system), 16)
+        # The driver's IRQ cap for channel 0 is in slot 138
+        self.assertEqual(pd_cnode_size(driver, system), 256)
+        # Only the input and vspace caps
+        self.assertEqual(pd_cnode_size(idle, system), 4)
+
+    def test_needs_reply(self):
+        self.assertTrue(pd_needs_reply(self._pd("server", pp=True)))
+        self.assertTrue(pd_needs_reply(self._pd("passive", passive=True)))
+        self.assertFalse(pd_needs_reply(self._pd("client")))
+
+
+class TableMapTests(unittest.TestCase):
+    def test_arithmetic_runs(self):
+        self.assertEqual(arithmetic_runs([], 5, 9), [])
+        self.assertEqual(arithmetic_runs([0x20_0000], 5, 9), [(0, 1)])
+        self.assertEqual(arithmetic_runs([0x20_0000, 0x1000_0000, 0x1020_0000, 0x1040_0000], 5, 9), [(0, 1), (1, 3)])
+        self.assertEqual(arithmetic_runs([0, 1, 2, 10, 11, 12], 5, 9), [(0, 3), (3, 3)])
+
+    def test_within_pd(self):
+        descriptors = [(0, 0x20_0000), (0, 0x1000_0000), (0, 0x1020_0000), (0, 0x1040_0000), (1, 0x20_0000)]
+        self.assertEqual(table_map_runs(descriptors), [(0, 1, 1), (1, 3, 1), (4, 1, 1)])
+
+    def test_across_pds(self):
+        descriptors = [(pd_idx, vaddr) for pd_idx in range(3) for vaddr in (0x20_0000, 0x1000_0000, 0x3000_0000)]
+        self.assertEqual(table_map_runs(descriptors), [(0, 3, 3), (1, 3, 3), (2, 3, 3)])
+
+    def test_different_layouts(self):
+        descriptors = [(0, 0x20_0000), (0, 0x40_0000), (1, 0x20_0000), (1, 0x60_0000)]
+        self.assertEqual(table_map_runs(descriptors), [(0, 2, 1), (2, 2, 1)])
+
+
+class DemandMapTests(unittest.TestCase):
+    def test_pack(self):
+        maps = [
+            DemandMap(3, 0x1000_0000, 4, 0x1000, 0x100, 0x200, 0x10, 3, 7),
+            DemandMap(1, 0x2000_0000, 2, 0x20_0000, 0x110, 0x210, 0x11, 1, 7),
+            DemandMap(1, 0x1000_0000, 1, 0x1000, 0x120, 0x220, 0x11, 3, 7),
+        ]
+        data = pack_demand_maps(maps, 0x8, 64)
+        header = MONITOR_CONFIG.demand_map_header_struct
+        cnode, depth, *first = header.unpack(data[:header.size])
+        self.assertEqual((cnode, depth), (0x8, 64))
+        # Badge 1 has maps 0 and 1, badge 3 has map 2
+        self.assertEqual(first[:5], [0, 0, 2, 2, 3])
+        self.assertEqual(first[-1], 3)
+        objects = list(MONITOR_CONFIG.demand_map_object_struct.iter_unpack(data[header.size:]))
+        self.assertEqual([obj[0] for obj in objects], [0x1000_0000, 0x2000_0000, 0x1000_0000])
+        self.assertEqual(objects[1], (0x2000_0000, 2, 21, 0x110, 0x210, 0x11, 1, 7))
+
+    def test_promote_keeps_demand(self):
+        mrs = (SysMemoryRegion("mr", 0x40_0000, 0x1000, 0x400, None, page_size_explicit=False), )
+        pd = ProtectionDomain("pd", 100, 1000, 1000, False, False, Path("pd.elf"), (), (), (), None)
+        _, pd_maps = promote_large_pages(mrs, {pd: (SysMap("mr", 0x20_1000, "rw", True, None, True), )})
+        self.assertEqual(len(pd_maps[pd]), 3)
+        self.assertTrue(all(mp.demand for mp in pd_maps[pd]))
+
+
+class LargePageTests(unittest.TestCase):
+    def test_promote(self):
+        mrs = (
+            SysMemoryRegion("aligned", 0x40_0000, 0x1000, 0x400, None, False),
+            SysMemoryRegion("split", 0x40_0000, 0x1000, 0x400, None, False),
+            SysMemoryRegion("explicit", 0x40_0000, 0x1000, 0x400, None, True),
+        )
+        maps = {
+            "pd0": (SysMap("aligned", 0x1000_0000, "rw", True, None), SysMap("split", 0x2000_1000, "rw", True, None)),
+            "pd1": (SysMap("explicit", 0x1000_0000, "rw", True, None), SysMap("split", 0x3000_1000, "r", True, None)),
+        }
+        promoted_mrs, promoted_maps = promote_large_pages(mrs, maps)
+        self.assertEqual(
+            [(mr.name, mr.page_size, mr.page_count) for mr in promoted_mrs],
+            [
+                ("aligned", 0x200_000, 2),
+                ("split", 0x1000, 0x1ff),
+                ("split (+0x1ff000)", 0x200_000, 1),
+                ("split (+0x3ff000)", 0x1000, 1),
+                ("explicit", 0x1000, 0x400),
+            ]
+        )
+        self.assertEqual(
+            [(mp.mr, mp.vaddr) for mp in promoted_maps["pd1"]],
+            [("explicit", 0x1000_0000), ("split", 0x3000_1000), ("split (+0x1ff000)", 0x3020_0000), ("split (+0x3ff000)", 0x3040_0000)]
+        )
+
+    def test_region_paddr(self):
+        mrs = (
+            SysMemoryRegion("dma", 0x40_0000, 0x1000, 0x400, None, False),
+            SysMemoryRegion("fixed", 0x40_0000, 0x1000, 0x400, 0x4010_0000, False),
+        )
+        maps = {"pd0": (SysMap("dma", 0x1010_0000, "rw", True, None), SysMap("fixed", 0x2010_0000, "rw", True, None))}
+        promoted_mrs, promoted_maps = promote_large_pages(mrs, maps, {"dma", "fixed"})
+        # Splitting 'dma' would allocate each part separately; the parts
+        # of 'fixed' are contiguous anyway
+        self.assertEqual(
+            [(mr.name, mr.page_size, mr.phys_addr) for mr in promoted_mrs],
+            [
+                ("dma", 0x1000, None),
+                ("fixed", 0x1000, 0x4010_0000),
+                ("fixed (+0x100000)", 0x200_000, 0x4020_0000),
+                ("fixed (+0x300000)", 0x1000, 0x4040_0000),
+            ]
+        )
+        self.assertEqual(promoted_maps["pd0"][0], maps["pd0"][0])
+
+    def test_mismatched_offsets(self):
+        mrs = (SysMemoryRegion("mr", 0x40_0000, 0x1000, 0x400, None, False), )
+        maps = {"pd0": (SysMap("mr", 0x1000_0000, "rw", True, None), SysMap("mr", 0x2000_1000, "rw", True, None))}
+        self.assertEqual(promote_large_pages(mrs, maps), (mrs, maps))